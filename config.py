@@ -21,6 +21,11 @@ class Settings:
     OPENAI_BASE_URL: str = os.getenv("OPENAI_BASE_URL")
     ZHIPU_API_KEY: str = os.getenv("ZHIPU_API_KEY")
     OLLAMA: str = os.getenv("OLLAMA")
+    TWITTER_ARCHIVE_DIR: str = os.getenv("TWITTER_ARCHIVE_DIR")
+    XHS_TAB_POOL_SIZE: int = int(os.getenv("XHS_TAB_POOL_SIZE") or 2)
+    XHS_DETAIL_TAB_SIZE: int = int(os.getenv("XHS_DETAIL_TAB_SIZE") or 1)
+    XHS_BLOCK_MEDIA: bool = os.getenv("XHS_BLOCK_MEDIA", "True") == "True"
+    XHS_DAEMON_ADDRESS: str = os.getenv("XHS_DAEMON_ADDRESS")
 
 
 settings = Settings()
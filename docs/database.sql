@@ -20,6 +20,9 @@ create table tweet_raw
 )
     comment '存储发布的原文' charset = utf8mb4 collate = utf8mb4_general_ci;
 
+create unique index content_id
+    on tweet_raw (content_id);
+
 create table tweet_summaries
 (
     id            bigint auto_increment comment '唯一标识符'
@@ -37,9 +40,9 @@ create table tweet_summaries
 )
     comment '存储Twitter用户发表的内容概要信息' charset = utf8mb4 collate = utf8mb4_general_ci;
 
-create index rest_id
+create unique index rest_id
     on tweet_summaries (rest_id)
-    comment '用户ID索引，创建索引以加速查询';
+    comment '帖子ID唯一索引，批量写入时按它判断数据是否存在';
 
 create index user_id
     on tweet_summaries (user_id);
@@ -61,3 +64,85 @@ create table x_users
 )
     comment '推特的用户表' charset = utf8mb4 collate = utf8mb4_general_ci;
 
+
+create table xhs_note
+(
+    id               int auto_increment comment '自增ID'
+        primary key,
+    user_id          varchar(64)           not null comment '用户ID',
+    note_id          varchar(64)           not null comment '笔记ID',
+    type             varchar(16)           null comment '笔记类型(normal | video)',
+    title            varchar(255)          null comment '笔记标题',
+    `desc`           text                  null comment '笔记描述',
+    video_url        text                  null comment '视频地址',
+    liked_count      bigint       default 0  null comment '笔记点赞数',
+    collected_count  bigint       default 0  null comment '笔记收藏数',
+    comment_count    bigint       default 0  null comment '笔记评论数',
+    image_list       json                  null comment '笔记封面图片列表',
+    tag_list         json                  null comment '标签列表',
+    note_url         varchar(255)          null comment '笔记详情页的URL',
+    source_keyword   varchar(255) default '' null comment '搜索来源关键字',
+    last_update_time timestamp             null comment '最后更新时间',
+    add_time         timestamp             null comment '发布时间',
+    created_at       timestamp             null comment '创建时间',
+    updated_at       timestamp             null comment '最后更新时间'
+)
+    comment '小红书笔记' charset = utf8mb4 collate = utf8mb4_general_ci;
+
+create unique index note_id
+    on xhs_note (note_id)
+    comment '笔记ID唯一索引，批量写入时按它判断数据是否存在';
+
+create table xhs_user_snapshot
+(
+    id         int auto_increment comment '主键ID'
+        primary key,
+    created_at timestamp null comment '创建时间',
+    user_id    varchar(64) not null comment '用户ID',
+    fans       int         not null comment '粉丝数'
+)
+    charset = utf8mb4 collate = utf8mb4_general_ci;
+
+create table xhs_users
+(
+    id         int auto_increment comment '自增ID'
+        primary key,
+    user_id    varchar(64)        not null comment '用户ID',
+    nickname   varchar(64)        not null comment '用户昵称',
+    location   varchar(64)        null comment '所在地',
+    `desc`     text               null comment '用户描述',
+    fans       bigint default 0   null comment '粉丝数',
+    tag_list   json               null comment '标签列表',
+    created_at timestamp          null comment '创建时间',
+    updated_at timestamp          null comment '最后更新时间'
+)
+    comment '小红书博主' charset = utf8mb4 collate = utf8mb4_general_ci;
+
+create unique index user_id
+    on xhs_users (user_id)
+    comment '用户ID唯一索引，批量写入时按它判断数据是否存在';
+
+create table qtc_article_summary
+(
+    id           int auto_increment comment '主键ID'
+        primary key,
+    title        varchar(300)       not null comment '标题',
+    tags         varchar(500) default '' null comment '标签',
+    category_id  int                not null comment '分类ID',
+    summary      varchar(1000)      not null comment '简介',
+    aid          int                not null comment '文章ID',
+    author_id    int                not null comment '作者ID',
+    fetch        int default 1      null comment '1-没抓取内容,2-抓取内容',
+    segmentation int default 0      null comment '是否已分段,0-否,1-是',
+    view_count   int default 0      null comment '查看数',
+    vote_count   int default 0      null comment '投票数',
+    is_essence   int default 1      null comment '是否为加精文章, 1-否，2-是',
+    created_at   timestamp          null comment '创建时间',
+    updated_at   timestamp          null comment '更新时间',
+    add_time     timestamp          null comment '文章发布时间'
+)
+    charset = utf8mb4 collate = utf8mb4_general_ci;
+
+create unique index aid
+    on qtc_article_summary (aid)
+    comment '文章ID唯一索引，批量写入时按它判断数据是否存在';
@@ -0,0 +1,22 @@
+-- tweet_summaries.rest_id 由普通索引改为唯一索引
+-- TweetContentService.add_all 按 rest_id 批量写入(ON DUPLICATE KEY UPDATE)，没有唯一索引时重复的帖子会一直新增
+-- 执行前先备份；同一个 rest_id 有多条数据时保留 id 最大的一条
+-- 在 002_tweet_raw_content_id_unique.sql 之前执行
+
+-- tweet_raw.content_id 指向要删除的数据时，改为指向保留的数据
+update tweet_raw r
+    join tweet_summaries s on s.id = r.content_id
+    join (select rest_id, max(id) as id
+          from tweet_summaries
+          group by rest_id
+          having count(*) > 1) k on k.rest_id = s.rest_id and k.id <> s.id
+set r.content_id = k.id;
+
+-- 删除重复的帖子，只保留 id 最大的一条
+delete s
+from tweet_summaries s
+    join tweet_summaries k on k.rest_id = s.rest_id and k.id > s.id;
+
+alter table tweet_summaries
+    drop index rest_id,
+    add unique index rest_id (rest_id) comment '帖子ID唯一索引，批量写入时按它判断数据是否存在';
@@ -0,0 +1,12 @@
+-- tweet_raw.content_id 增加唯一索引
+-- TweetContentService.add_raw_all 按 content_id 批量写入(ON DUPLICATE KEY UPDATE)，没有唯一索引时原文会重复保存
+-- 执行前先备份；在 001_tweet_summaries_rest_id_unique.sql 之后执行，
+-- 001 会把指向重复帖子的原文改为指向保留的帖子，这里再去掉重复的原文
+-- 同一个 content_id 有多条数据时保留 id 最大的一条
+
+delete r
+from tweet_raw r
+    join tweet_raw k on k.content_id = r.content_id and k.id > r.id;
+
+alter table tweet_raw
+    add unique index content_id (content_id);
@@ -0,0 +1,18 @@
+-- xhs_note.note_id、xhs_users.user_id 增加唯一索引
+-- NoteService.add_notes、UserService.add_users 按它们批量写入(ON DUPLICATE KEY UPDATE)，没有唯一索引时会重复新增
+-- 执行前先备份；同一个 note_id / user_id 有多条数据时保留 id 最大的一条
+-- 表里已经有同名的普通索引时，先执行 alter table xhs_note drop index note_id; / alter table xhs_users drop index user_id;
+
+delete n
+from xhs_note n
+    join xhs_note k on k.note_id = n.note_id and k.id > n.id;
+
+alter table xhs_note
+    add unique index note_id (note_id) comment '笔记ID唯一索引，批量写入时按它判断数据是否存在';
+
+delete u
+from xhs_users u
+    join xhs_users k on k.user_id = u.user_id and k.id > u.id;
+
+alter table xhs_users
+    add unique index user_id (user_id) comment '用户ID唯一索引，批量写入时按它判断数据是否存在';
@@ -0,0 +1,12 @@
+-- qtc_article_summary.aid 增加唯一索引
+-- ArticleSummaryService.add 按 aid 批量写入(ON DUPLICATE KEY UPDATE)，没有唯一索引时会重复新增
+-- 执行前先备份；同一个 aid 有多条数据时保留 id 最大的一条
+-- 表里已经有同名的普通索引时，先执行 alter table qtc_article_summary drop index aid;
+-- 执行后清空 Redis 里 qtc_article_summary_get_by_aid_* 的缓存
+
+delete s
+from qtc_article_summary s
+    join qtc_article_summary k on k.aid = s.aid and k.id > s.id;
+
+alter table qtc_article_summary
+    add unique index aid (aid) comment '文章ID唯一索引，批量写入时按它判断数据是否存在';
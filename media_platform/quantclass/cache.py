@@ -0,0 +1,166 @@
+"""
+文章简介的写穿缓存
+每篇文章在Redis里保存两个key：
+    qtc_article_summary_get_by_aid_{aid}   -> 文章简介的json，带写入时的版本号v
+    qtc_article_summary_version_{aid}      -> 文章当前的版本号，每次修改数据库后加1
+新增、更新文章后版本号加1并写入新的数据(put)，只修改个别字段时版本号加1并把新的字段值改到缓存的数据里(update)，
+不用重新查询数据库；
+读取时一次MGET同时取出数据和版本号，版本号不一致的数据是旧的，重新从数据库读取
+"""
+import json
+import threading
+from datetime import datetime
+
+from redis import Redis
+from sqlalchemy import TIMESTAMP
+
+from models.quantclass import QtcArticleSummary
+from tools.utils import to_dict
+
+_DATETIME_FIELDS = [column.name for column in QtcArticleSummary.__table__.columns if isinstance(column.type, TIMESTAMP)]
+
+# 版本号加1并写入带新版本号的数据，一次请求原子执行
+# KEYS: version1, key1, version2, key2...  ARGV: 过期时间, 不带版本号的json1, json2...
+_PUT_SCRIPT = """
+local ex = ARGV[1]
+for i = 1, #KEYS, 2 do
+    local version = redis.call('INCR', KEYS[i])
+    redis.call('EXPIRE', KEYS[i], ex)
+    local info = ARGV[(i + 1) / 2 + 1]
+    redis.call('SET', KEYS[i + 1], string.sub(info, 1, -2) .. ',"v":' .. version .. '}', 'EX', ex)
+end
+return #KEYS / 2
+"""
+
+# 版本号加1，缓存的数据是最新的时改为新的字段值并写入新版本号，一次请求原子执行
+# 没有缓存或者缓存已经是旧的不修改，下次读取时从数据库重新读取
+# KEYS: version1, key1, version2, key2...  ARGV: 过期时间, 修改的字段json
+_UPDATE_SCRIPT = """
+local ex = ARGV[1]
+local values = cjson.decode(ARGV[2])
+local updated = 0
+for i = 1, #KEYS, 2 do
+    local version = redis.call('INCR', KEYS[i])
+    redis.call('EXPIRE', KEYS[i], ex)
+    local cached = redis.call('GET', KEYS[i + 1])
+    if cached then
+        local info = cjson.decode(cached)
+        if info['v'] == version - 1 then
+            for field, value in pairs(values) do
+                info[field] = value
+            end
+            info['v'] = version
+            redis.call('SET', KEYS[i + 1], cjson.encode(info), 'EX', ex)
+            updated = updated + 1
+        end
+    end
+end
+return updated
+"""
+
+
+class SummaryCache:
+
+    def __init__(self, redis: Redis, ex: int = 86400 * 14, prefix: str = 'qtc_article_summary'):
+        """
+        :param ex: 缓存的过期时间(秒)
+        :param prefix: 缓存key的前缀
+        """
+        self._redis = redis
+        self._ex = ex
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        self._put = redis.register_script(_PUT_SCRIPT)
+        self._update = redis.register_script(_UPDATE_SCRIPT)
+        self.hits = 0  # 缓存命中的次数
+        self.misses = 0  # 没有缓存的次数
+        self.stale = 0  # 缓存的版本号不是最新的次数
+        self.writes = 0  # 写入缓存的数量
+
+    def key(self, aid: int) -> str:
+        return f'{self._prefix}_get_by_aid_{aid}'
+
+    def version_key(self, aid: int) -> str:
+        return f'{self._prefix}_version_{aid}'
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def get(self, aid: int) -> (QtcArticleSummary | None, int):
+        """
+        读取缓存
+        :return: (文章简介, 当前的版本号)，没有缓存或者缓存是旧的时文章简介为None，版本号用于fill
+        """
+        cache_info, version = self._redis.mget(self.key(aid), self.version_key(aid))
+        version = int(version) if version is not None else 0
+        if cache_info is None:
+            self._count('misses')
+            return None, version
+        info_json = json.loads(cache_info)
+        if info_json.pop('v', None) != version:
+            self._count('stale')
+            return None, version
+        self._count('hits')
+        for field in _DATETIME_FIELDS:
+            if info_json.get(field):
+                info_json[field] = datetime.fromisoformat(info_json[field])
+        return QtcArticleSummary(**info_json), version
+
+    def fill(self, info: QtcArticleSummary, version: int):
+        """
+        从数据库读取后写入缓存
+        :param version: get返回的版本号，期间数据被修改过时写入的缓存会被下次读取判断为旧的
+        """
+        pipe = self._redis.pipeline(transaction=False)
+        # 版本号不存在时从0开始，已经存在时不修改
+        pipe.set(self.version_key(info.aid), version, ex=self._ex, nx=True)
+        pipe.set(self.key(info.aid), json.dumps({**to_dict(info), "v": version}), ex=self._ex)
+        pipe.execute()
+        self._count('writes')
+
+    def put(self, infos: [QtcArticleSummary]):
+        """
+        修改数据库并提交后调用，版本号加1并写入最新的数据，一次请求Redis
+        :param infos: 从数据库重新读取的最新数据
+        """
+        if not infos:
+            return
+        keys = []
+        args = [self._ex]
+        for info in infos:
+            keys += [self.version_key(info.aid), self.key(info.aid)]
+            args.append(json.dumps(to_dict(info)))
+        self._put(keys=keys, args=args)
+        self._count('writes', len(infos))
+
+    def update(self, aids: [int], values: dict):
+        """
+        只修改个别字段并提交后调用，版本号加1并把新的字段值改到缓存的数据里，一次请求Redis，不用重新查询数据库
+        :param aids: 修改的文章id
+        :param values: 修改的字段和写入数据库的值
+        """
+        if not aids:
+            return
+        keys = []
+        for aid in aids:
+            keys += [self.version_key(aid), self.key(aid)]
+        # 数据库读出的时间不带时区，缓存里保持一致
+        values = {field: value.replace(tzinfo=None).isoformat() if isinstance(value, datetime) else value
+                  for field, value in values.items()}
+        updated = self._update(keys=keys, args=[self._ex, json.dumps(values)])
+        self._count('writes', int(updated))
+
+    def stats(self) -> dict:
+        """
+        缓存的命中统计
+        :return: {"hits": 命中, "misses": 没有缓存, "stale": 缓存是旧的, "writes": 写入, "hit_rate": 命中率}
+        """
+        reads = self.hits + self.misses + self.stale
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "writes": self.writes,
+            "hit_rate": round(self.hits / reads, 3) if reads else 0.0,
+        }
@@ -1,25 +1,34 @@
 import requests
+from requests.adapters import HTTPAdapter
 
 from sqlalchemy.orm import Session
 from redis import Redis
 
 from base.base_crawler import AbstractApiClient
+from tools.pacer import RatePacer
 from tools.time import get_time_within_duration
 from media_platform.quantclass.exception import DataFetchError,AUTHENError
 from tools import utils
 
 
 class QuantClassClient(AbstractApiClient):
+    # 请求的限速，多个线程共用一个客户端时总的频率不超过它，为None时不限速
+    pacer: RatePacer | None = None
+
     def __init__(self,
                  db: Session,
                  redis: Redis,
                  timeout=30,
                  proxies=None,
+                 pool_size=10,
                  ):
         self.proxies = proxies
         self.timeout = timeout
         self._redis = redis
         self._db = db
+        # 所有请求共用一个会话，保持连接，多个线程同时请求时最多保持pool_size个连接
+        self._session = requests.Session()
+        self._session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
         self._headers = {
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36',
             "Referer": "https://bbs.quantclass.cn",
@@ -35,16 +44,21 @@ class QuantClassClient(AbstractApiClient):
         :return:
         """
         response = None
-        headers = self._headers
+        # 复制一份，传入的认证信息不能写进共用的请求头
+        headers = dict(self._headers)
         if kwargs.get('headers'):
             headers.update(kwargs['headers'])
 
         kwargs['headers'] = headers
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs.setdefault('proxies', self.proxies)
 
+        if self.pacer is not None:
+            self.pacer.wait()
         if method == "GET":
-            response = requests.request(method, url, **kwargs)
+            response = self._session.request(method, url, **kwargs)
         elif method == "POST":
-            response = requests.request(method, url, **kwargs)
+            response = self._session.request(method, url, **kwargs)
 
         if response.status_code == 200:
             return response
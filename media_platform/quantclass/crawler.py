@@ -5,6 +5,7 @@ from datetime import datetime
 from media_platform.quantclass.client import QuantClassClient
 from models.quantclass import QtcArticleSummary
 from media_platform.quantclass.exception import AUTHENError
+from tools.pacer import RatePacer
 from tools.utils import logger
 
 
@@ -13,6 +14,12 @@ class QuantClassCrawler():
     def __init__(self, db: Session, redis: Redis):
         self._client = QuantClassClient(db, redis)
 
+    def set_pacer(self, pacer: RatePacer | None):
+        """
+        设置接口请求的限速，多个线程共用这个爬虫时按同一个频率请求
+        """
+        self._client.pacer = pacer
+
     def get_article_by_list(self, page: int = 1, pre_page: int = 20, category_id: int = 0, essence: int = 0, days: int = 0):
         """
         获取文章列表
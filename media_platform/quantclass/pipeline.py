@@ -0,0 +1,84 @@
+"""
+并发抓取文章列表：每个分类先请求第1页拿到总页数，再把剩下的页放进线程池并发请求
+所有分类共用一个线程池和一个限速，每返回一页就写入数据库，写入在调用run的线程里执行，数据库的连接不跨线程使用
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from media_platform.quantclass.crawler import QuantClassCrawler
+from media_platform.quantclass.exception import DataFetchError, AUTHENError
+from media_platform.quantclass.service import ArticleSummaryService
+from tools.pacer import RatePacer
+from tools.utils import logger
+
+
+class ArticleListPipeline:
+
+    def __init__(self, crawler: QuantClassCrawler, summary_service: ArticleSummaryService, pacer: RatePacer,
+                 workers: int = 4, page_size: int = 50, max_page: int = 100):
+        """
+        :param crawler: 爬虫，请求在线程池里执行
+        :param pacer: 所有请求共用的限速
+        :param workers: 同时请求的线程数
+        :param page_size: 每页数量，最大50条
+        :param max_page: 每个分类最多抓取的页数
+        """
+        self._crawler = crawler
+        self._summary_service = summary_service
+        self._pacer = pacer
+        self._workers = workers
+        self._page_size = page_size
+        self._max_page = max_page
+
+    def run(self, categories: [(int, str)], days: int = 0) -> dict:
+        """
+        抓取多个分类的文章列表，全部写入后返回
+        :param categories: [(分类id, 分类名称)]，分类id为0时抓取全部数据
+        :param days: 抓取几天内的数据，0表示抓取所有数据
+        :return: 各阶段的数量和总耗时
+        """
+        stats = {"pages": 0, "failed": 0, "inserted": 0, "updated": 0, "write_failed": 0}
+        start = time.monotonic()
+        self._crawler.set_pacer(self._pacer)
+        try:
+            with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='qtc_list') as executor:
+                pending = {}
+
+                def submit(cid: int, cname: str, page: int):
+                    future = executor.submit(self._crawler.get_article_by_list, page, self._page_size, cid, 0, days)
+                    pending[future] = (cid, cname, page)
+
+                for cid, cname in categories:
+                    submit(cid, cname, 1)
+
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        cid, cname, page = pending.pop(future)
+                        try:
+                            article_list = future.result()
+                        except (DataFetchError, AUTHENError) as e:
+                            stats["failed"] += 1
+                            logger.error(f'[quantclass.ArticleListPipeline.run] 获取分类:{cname},第{page}页失败。{e}')
+                            continue
+
+                        total_page = min(article_list['total_page'], self._max_page)
+                        logger.info(f'[quantclass.ArticleListPipeline.run] 获取分类:{cname},'
+                                    f'第{page}/{article_list["total_page"]}页的文章列表')
+                        if page == 1:
+                            for next_page in range(2, total_page + 1):
+                                submit(cid, cname, next_page)
+                        if article_list['page_length'] == 0:
+                            continue
+
+                        stats["pages"] += 1
+                        result = self._summary_service.add(article_list['summary'])
+                        if result["failed"]:
+                            logger.error(f'[quantclass.ArticleListPipeline.run] 分类:{cname},第{page}页写入失败')
+                        stats["inserted"] += result["inserted"]
+                        stats["updated"] += result["updated"]
+                        stats["write_failed"] += result["failed"]
+        finally:
+            self._crawler.set_pacer(None)
+        stats["elapsed"] = round(time.monotonic() - start, 1)
+        return stats
@@ -1,12 +1,14 @@
 import json
-import math
 from sqlalchemy.orm import Session
-from sqlalchemy import update
+from sqlalchemy import update, select
 from redis import Redis
 
 from models import quantclass
+from tools.db import upsert_counts, to_row, keyset_page
 from tools.utils import to_dict, logger
 from tools.encrypt import calculate_md5
+from tools.time import current_time
+from media_platform.quantclass.cache import SummaryCache
 from media_platform.quantclass.field import QuantCategory
 
 
@@ -73,94 +75,112 @@ class ArticleSummaryService:
         self._db = db
         self._redis = redis
         self.cache_ex = 86400 * 14
+        # add提交后写入最新的数据，只修改个别字段时提交后把新的值改到缓存里，get_by_aid不会读到旧的数据
+        self.cache = SummaryCache(redis, self.cache_ex)
+        # 文章已存在时更新的字段
+        self.update_fields = ['view_count', 'vote_count', 'is_essence', 'summary', 'title']
 
     @staticmethod
     def get_cache_keys(fun: str, key: str):
         return f'qtc_article_summary_{fun}_{key}'
 
-    def add(self, fields: [quantclass.QtcArticleSummary]):
+    def add(self, fields: [quantclass.QtcArticleSummary]) -> dict:
         """
-        添加文章简介列表的数据
+        添加文章简介列表的数据，按aid批量新增或更新，一页数据一次写入
+        新增和更新的数量见tools.db.upsert_counts，写入前查询已经存在的数量，有并发写入时是近似值
+        :param fields: 文章简介列表，同一个aid出现多次时使用最后一个
+        :return: {"inserted": 新增的数量, "updated": 更新的数量, "failed": 写入失败的数量}
         """
+        rows = {field.aid: to_row(field) for field in fields}
+        if not rows:
+            return {"inserted": 0, "updated": 0, "failed": 0}
+
         try:
-            for field in fields:
-                info = self.get_by_aid(field.aid)
-                if info is None:
-                    # 新增
-                    self._db.add(field)
-                else:
-                    # 更新
-                    stmt = (update(quantclass.QtcArticleSummary)
-                    .where(quantclass.QtcArticleSummary.aid == field.aid)
-                    .values(
-                        view_count=field.view_count,
-                        vote_count=field.vote_count,
-                        is_essence=field.is_essence,
-                        summary=field.summary,
-                        title=field.title,
-                    )
-                    )
-                    self._db.execute(stmt)
-                self._db.commit()
+            inserted, updated = upsert_counts(self._db, quantclass.QtcArticleSummary, list(rows.values()), ['aid'],
+                                              self.update_fields)
+            self._db.commit()
         except Exception as e:
+            self._db.rollback()
             logger.error(f'添加文章数据失败。{e}')
-            return False
+            return {"inserted": 0, "updated": 0, "failed": len(rows)}
 
-        return True
+        self._refresh_cache(list(rows))
+        return {"inserted": inserted, "updated": updated, "failed": 0}
 
     def get_by_aid(self, aid: int) -> quantclass.QtcArticleSummary | None:
         """
         根据文章id返回数据
         """
-        cache_key = self.get_cache_keys('get_by_aid', str(aid))
-        cache_info: str = self._redis.get(cache_key)
-        if cache_info:
-            info_json = json.loads(cache_info)
-            return quantclass.QtcArticleSummary(**info_json)
+        info, version = self.cache.get(aid)
+        if info is not None:
+            return info
         info = self._db.query(quantclass.QtcArticleSummary).where(quantclass.QtcArticleSummary.aid == aid).first()
         if info is not None:
-            json_str = json.dumps(to_dict(info))
-            self._redis.set(cache_key, json_str, self.cache_ex)
+            self.cache.fill(info, version)
         return info
 
-    def get_not_fetch(self, page: int = 1, limit: int = 50):
+    def _refresh_cache(self, aids: [int]):
         """
-        没有抓取内容的加精的数据
+        修改数据库并提交后，重新读取修改的数据写入缓存
         """
-        query = self._db.query(quantclass.QtcArticleSummary).where(quantclass.QtcArticleSummary.is_essence == 1,quantclass.QtcArticleSummary.fetch==1)
-        amount = query.count()
-        page_total = math.ceil(amount / limit)
-        start_page = (page - 1) * limit
-        if page > page_total:
-            return 0, None
+        if not aids:
+            return
+        infos = self._db.scalars(select(quantclass.QtcArticleSummary)
+                                 .where(quantclass.QtcArticleSummary.aid.in_(aids))).all()
+        self.cache.put(infos)
 
-        data = query.order_by(quantclass.QtcArticleSummary.id.desc()).offset(
-            start_page).limit(limit).all()
-        return page_total, data
+    def get_not_fetch(self, last_id: int | None = None, limit: int = 50) -> [quantclass.QtcArticleSummary]:
+        """
+        没有抓取内容的加精的数据，按id倒序分页
+        :param last_id: 上一页最后一条数据的id，None时查询第一页
+        :param limit: 每页数量
+        :return: 一页数据，没有数据时返回空列表
+        """
+        query = self._db.query(quantclass.QtcArticleSummary).where(quantclass.QtcArticleSummary.is_essence == 1,quantclass.QtcArticleSummary.fetch==1)
+        return keyset_page(query, quantclass.QtcArticleSummary.id, limit, last_id)
 
     def set_fetch(self, aid: int):
         """
         设置内容已抓取
         """
-        stmt = update(quantclass.QtcArticleSummary).where(quantclass.QtcArticleSummary.aid == aid).values(fetch=2)
+        # 更新时间也写入缓存，和数据库保持一致
+        values = {"fetch": 2, "updated_at": current_time()}
+        stmt = update(quantclass.QtcArticleSummary).where(quantclass.QtcArticleSummary.aid == aid).values(**values)
         self._db.execute(stmt)
         self._db.commit()
+        self.cache.update([aid], values)
 
     def set_segmentation(self, aid: int):
         """
         设置内容已分段
         """
-        stmt = update(quantclass.QtcArticleSummary).where(quantclass.QtcArticleSummary.aid == aid).values(segmentation=1)
+        values = {"segmentation": 1, "updated_at": current_time()}
+        stmt = update(quantclass.QtcArticleSummary).where(quantclass.QtcArticleSummary.aid == aid).values(**values)
+        self._db.execute(stmt)
+        self._db.commit()
+        self.cache.update([aid], values)
+
+    def set_tags(self, aid: int, tags: str):
+        """
+        设置文章的标签
+        """
+        values = {"tags": tags, "updated_at": current_time()}
+        stmt = update(quantclass.QtcArticleSummary).where(quantclass.QtcArticleSummary.aid == aid).values(**values)
         self._db.execute(stmt)
         self._db.commit()
+        self.cache.update([aid], values)
 
     def set_tag(self, tag: str):
         """
         设置内容已抓取
         """
-        stmt = update(quantclass.QtcArticleSummary).where(quantclass.QtcArticleSummary.tags == tag).values(fetch=2)
+        aids = self._db.scalars(select(quantclass.QtcArticleSummary.aid)
+                                .where(quantclass.QtcArticleSummary.tags == tag)).all()
+        values = {"fetch": 2, "updated_at": current_time()}
+        stmt = update(quantclass.QtcArticleSummary).where(quantclass.QtcArticleSummary.tags == tag).values(**values)
         self._db.execute(stmt)
         self._db.commit()
+        self.cache.update(aids, values)
 
 
 class ArticleContentService:
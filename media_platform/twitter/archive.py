@@ -0,0 +1,115 @@
+"""
+推特接口原始返回内容的归档
+只追加写入，每条返回内容单独压缩成一个zstd帧写入分段文件，同名的.idx文件每行记录一条索引：
+    {"endpoint": 接口名, "key": 用户id或帖子id, "cursor": 翻页的定位值, "offset": 偏移, "length": 长度, "time": 抓取时间}
+每个进程写自己的分段文件，不需要加锁；先写数据再写索引，进程异常退出也不会有不完整的索引
+"""
+import json
+import os
+import time
+
+import zstandard
+
+
+class ResponseArchive:
+
+    def __init__(self, directory: str, segment_size: int = 64 * 1024 * 1024, level: int = 3):
+        """
+        :param directory: 归档目录
+        :param segment_size: 分段文件的大小(字节)，超过后写入新的分段
+        :param level: zstd压缩等级
+        """
+        self._directory = directory
+        self._segment_size = segment_size
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._segment = None
+        self._index = None
+        self._sequence = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _open_segment(self):
+        self.close()
+        self._sequence += 1
+        name = f"{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{self._sequence:04d}"
+        self._segment = open(os.path.join(self._directory, f'{name}.zst'), 'ab')
+        self._index = open(os.path.join(self._directory, f'{name}.idx'), 'a', encoding='utf-8')
+
+    def append(self, endpoint: str, key: int | str, cursor: str | None, content: bytes):
+        """
+        归档一条返回内容
+        :param endpoint: 接口名
+        :param key: 用户id或帖子id
+        :param cursor: 翻页的定位值
+        :param content: 返回的原始内容
+        """
+        if self._segment is None or self._segment.tell() >= self._segment_size:
+            self._open_segment()
+
+        frame = self._compressor.compress(content)
+        offset = self._segment.tell()
+        self._segment.write(frame)
+        self._segment.flush()
+
+        self._index.write(json.dumps({
+            "endpoint": endpoint,
+            "key": str(key),
+            "cursor": cursor or '',
+            "offset": offset,
+            "length": len(frame),
+            "time": int(time.time()),
+        }) + '\n')
+        self._index.flush()
+
+    def close(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._index.close()
+            self._segment = None
+            self._index = None
+
+    def iter_index(self, endpoint: str | None = None, key: int | str | None = None) -> [dict]:
+        """
+        按抓取时间顺序获取索引
+        :param endpoint: 只获取指定接口的数据
+        :param key: 只获取指定用户或帖子的数据
+        :return: [dict]，每个索引多了segment字段，为分段文件的路径
+        """
+        result = []
+        for name in sorted(os.listdir(self._directory)):
+            if not name.endswith('.idx'):
+                continue
+            segment = os.path.join(self._directory, name[:-4] + '.zst')
+            with open(os.path.join(self._directory, name), encoding='utf-8') as f:
+                for line in f:
+                    # 最后一行可能没有写完
+                    if not line.endswith('\n'):
+                        break
+                    item = json.loads(line)
+                    if endpoint is not None and item["endpoint"] != endpoint:
+                        continue
+                    if key is not None and item["key"] != str(key):
+                        continue
+                    item["segment"] = segment
+                    result.append(item)
+        result.sort(key=lambda item: item["time"])
+        return result
+
+    def iter_records(self, endpoint: str | None = None, key: int | str | None = None):
+        """
+        按抓取时间顺序读取归档的返回内容
+        :param endpoint: 只获取指定接口的数据
+        :param key: 只获取指定用户或帖子的数据
+        :return: 生成器，每个元素为(索引, 原始内容)
+        """
+        decompressor = zstandard.ZstdDecompressor()
+        files = {}
+        try:
+            for item in self.iter_index(endpoint, key):
+                f = files.get(item["segment"])
+                if f is None:
+                    f = files[item["segment"]] = open(item["segment"], 'rb')
+                f.seek(item["offset"])
+                yield item, decompressor.decompress(f.read(item["length"]))
+        finally:
+            for f in files.values():
+                f.close()
@@ -1,7 +1,11 @@
-import logging
+import asyncio
+import threading
+from typing import Callable, NamedTuple
 
+import httpx
 import requests
 import json
+from requests.adapters import HTTPAdapter
 from sqlalchemy.orm import Session
 from redis import Redis
 
@@ -10,10 +14,28 @@ from media_platform.twitter.exception import *
 from media_platform.twitter.field import UserInfo, CookieIdentity
 from media_platform.twitter.help import extract_value_from_url, get_headers
 from media_platform.twitter.exception import TokenWaitError, DataFetchError
+from media_platform.twitter.cookie_lease import CookieLeaseScheduler
+from media_platform.twitter import decoder
+from media_platform.twitter.archive import ResponseArchive
+from media_platform.twitter.service import CookieService
 from models.twitter import CookiePool
 from tools import utils
 from tools import time
 from tools.message import send_msg_error
+from config import settings
+
+
+class ApiCall(NamedTuple):
+    """
+    一次接口请求：请求的地址、解析返回结果的方法和归档的信息，同步和异步的客户端只是发送请求的方式不同
+    """
+    url: str
+    parse: Callable  # parse(response, data)，data为解析后的json，不用登录用户cookie的接口为None
+    endpoint: str | None = None  # 归档用的接口名，为None时不归档
+    key: int = 0  # 归档用的用户id或帖子id
+    cursor: str | None = None  # 归档用的翻页定位值
+    headers: dict | None = None  # 指定请求头时直接请求，不使用登录用户的cookie
+
 
 class TwitterClient(AbstractApiClient):
     # 需要登录用户cookie的接口
@@ -22,25 +44,45 @@ class TwitterClient(AbstractApiClient):
         'TweetDetail': 150,
         'Following': 493
     }
-    cookie_pool_prefix = 'twitter_cookie_pool_'  # cookie缓存池队列名前缀
+    cookie_pool_prefix = 'twitter_cookie_lease_'  # cookie调度池缓存名前缀
+    limit_window = 900  # 接口访问次数的刷新周期(秒)
+    roster_ttl = 300  # 登录用户cookie列表在进程内的缓存时间(秒)
 
     def __init__(self,
                  db: Session,
                  redis: Redis,
                  timeout=30,
                  proxies=None,
+                 pool_size=20,
                  ):
         self.proxies = proxies
         self.timeout = timeout
         self._redis = redis
         self._db = db
+        self._lease = CookieLeaseScheduler(redis, self.cookie_pool_prefix, window=self.limit_window)
+
+        # 登录用户cookie列表的进程内缓存
+        self._roster_lock = threading.Lock()
+        self._roster = []
+        self._roster_expire = 0
+        self._roster_version = 0
+        self.db_queries_saved = 0  # 缓存省掉的数据库查询次数
+
+        # 复用同一个Session的keep-alive连接，避免每次请求都重新做TCP和TLS握手
+        self._session = requests.Session()
+        self._session.mount('https://', HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+
+        # 接口原始返回内容的归档，没有配置目录时不归档
+        self._archive = ResponseArchive(settings.TWITTER_ARCHIVE_DIR) if settings.TWITTER_ARCHIVE_DIR else None
 
         self._init_cookie_pool()
 
     def get_cookie_by_db(self):
-        return self._db.query(CookiePool).where(CookiePool.identity_type == CookieIdentity.USER.value,
-                                                CookiePool.platform == 'x',
-                                                CookiePool.use_status == 1).all()
+        # 使用单独的会话，异步客户端在线程里刷新时不会和其他协程共用一个会话
+        with Session(self._db.get_bind()) as db:
+            return db.query(CookiePool).where(CookiePool.identity_type == CookieIdentity.USER.value,
+                                              CookiePool.platform == 'x',
+                                              CookiePool.use_status == 1).all()
 
     def _init_cookie_pool(self):
         """
@@ -48,111 +90,225 @@ class TwitterClient(AbstractApiClient):
         :return:
         """
         utils.logger.info("初始化cookie池")
-        pools = self.get_cookie_by_db()
-        if len(pools) == 0:
+        if len(self._refresh_roster()) == 0:
             raise Exception("没有可用的cookie")
 
+    def _refresh_roster(self):
+        """
+        从数据库重新获取登录用户cookie列表，并同步到每个接口的调度池
+        :return: [CookiePool]
+        """
+        # 先取版本号再查询，查询期间有变更时下次会再刷新
+        version = CookieService.get_roster_version(self._redis)
+        pools = self.get_cookie_by_db()
+        self._roster = pools
+        self._roster_expire = time.current_unixtime() + self.roster_ttl
+        self._roster_version = version
+
+        cookies = [{"id": pool.id, "cto": pool.value['cto'], "auth_token": pool.value['auth_token']} for pool in pools]
         for (api, limit) in self.API_LIMITS.items():
-            cache_key = self.cookie_pool_prefix + api
+            amount = self._lease.seed(api, cookies, limit)
+            utils.logger.debug(f'{api}调度池cookie数量{amount}')
 
-            if self._redis.llen(cache_key) > 0:
-                utils.logger.debug(f'{api}队列缓存池不用初始化')
-                continue
+        utils.logger.debug(f'刷新登录用户cookie列表，缓存已省掉{self.db_queries_saved}次数据库查询')
+        return pools
 
-            self._redis.delete(cache_key)
-            for pool in pools:
-                cookie = {
-                    "id": pool.id,
-                    "cto": pool.value['cto'],
-                    "auth_token": pool.value['auth_token'],
-                    'limit': limit,
-                    'limit_reset': 0
-                }
-                self._redis.lpush(cache_key, json.dumps(cookie))
+    def get_cookie_roster(self):
+        """
+        获取登录用户cookie列表，缓存过期或者cookie状态有变更时才查询数据库
+        :return: [CookiePool]
+        """
+        with self._roster_lock:
+            if (time.current_unixtime() >= self._roster_expire
+                    or self._roster_version != CookieService.get_roster_version(self._redis)):
+                return self._refresh_roster()
+
+            self.db_queries_saved += 1
+            return self._roster
 
     def get_cookie(self, url):
+        """
+        获取请求接口剩余次数最多的cookie，没有可用的cookie时抛出TokenWaitError，wait属性为需要等待的秒数
+        :param url: 请求的url
+        :return: cookie数据和接口名
+        """
         api_name = extract_value_from_url(url)
         if not self.API_LIMITS.get(api_name):
             utils.logger.error(f"请求{api_name}接口不存在")
             raise APINOTFOUNDERROR("api 不存在")
-        cache_key = self.cookie_pool_prefix + api_name
-
-        queue_len = self._redis.llen(cache_key)
-        current_time = time.current_unixtime()
-        cookie = {}
-        utils.logger.debug(f"请求{api_name}队列长度{queue_len}")
-
-        while queue_len > 0:
-            cache_value = self._redis.lpop(cache_key)
-            if cache_value is None:
-                raise RateLimitError("没有可用的cookie")
-
-            cookie = json.loads(cache_value)
-            if cookie['limit'] > 0 or current_time > cookie['limit_reset']:
-                break
 
-            limit_reset = time.timestamp_to_date(cookie['limit_reset'])
-            utils.logger.debug(f"limit={cookie['limit']},刷新时间={limit_reset}")
+        cookie = self._lease.acquire(api_name, self.API_LIMITS[api_name])
+        utils.logger.debug(f"请求{api_name}使用cookie:{cookie['id']},剩余次数{cookie['limit']}")
+        return cookie, api_name
 
+    def next_available(self, api_name: str) -> int:
+        """
+        接口下一个请求最早可以执行的时间
+        :param api_name: 接口名，API_LIMITS中的key
+        :return: unix时间戳，没有cookie时返回-1
+        """
+        return self._lease.next_available(api_name)
 
-            queue_len -= 1
-            self._redis.lpush(cache_key, cache_value)
-            cookie = {}
-
-        if not cookie:
-            raise TokenWaitError('等待15分钟后刷新再使用')
+    def forecast(self, api_name: str, minutes: int = 15) -> int:
+        """
+        预测接下来N分钟内接口还能请求的次数
+        :param api_name: 接口名，API_LIMITS中的key
+        :param minutes: 预测的分钟数
+        :return: int
+        """
+        return self._lease.forecast(api_name, self.API_LIMITS[api_name], minutes, self.limit_window)
 
-        return cookie, cache_key
+    def cookie_budget(self) -> int:
+        """
+        登录用户cookie的数量，同一时间最多能并发的请求数
+        :return: int
+        """
+        return len(self.get_cookie_roster())
 
-    def get_by_header(self, url, params: dict | None = None):
+    def get_by_header(self, url, params: dict | None = None, timeout: float | None = None):
         """
         根据请求的url来设置cookie
         :param url: url
         :param params: 参数
-        :return:
+        :param timeout: 本次请求的超时时间，不传使用客户端的默认值
+        :return: 请求返回的结果，解析后的json，所有cookie都返回错误时抛出DataFetchError
         """
-        data = self.get_cookie_by_db()
-        max_len = len(data)
-        while max_len > 0:
-            cookie, cache_key = self.get_cookie(url)
-
-            _headers = get_headers()
-            _headers["cookie"] = f"auth_token={cookie['auth_token']};ct0={cookie['cto']}"
-            _headers["x-csrf-token"] = cookie['cto']
-
+        attempts = len(self.get_cookie_roster())
+        while attempts > 0:
+            cookie, api_name = self.get_cookie(url)
+            # 请求没有正常结束(包括被取消)时在finally里归还cookie，不会一直占着租约
+            settled = False
             try:
-                response = self.request(method="GET", url=f"{url}", params=params, headers=_headers)
-            except (RateLimitError,TokenExpiredError):
+                response = self.request(method="GET", url=f"{url}", params=params,
+                                        headers=self._get_user_headers(cookie), timeout=timeout)
+                attempts -= 1
+                settled = True
+                data = self._settle_cookie(cookie, api_name, response)
+            except (RateLimitError, TokenExpiredError) as e:
+                settled = True
+                self._reject_cookie(cookie, api_name, e)
                 continue
+            finally:
+                if not settled:
+                    self._lease.release(api_name, cookie['id'])
 
-            cookie['limit'] = int(response.headers.get('x-rate-limit-remaining', cookie['limit']))
-            cookie['limit_reset'] = int(response.headers.get('x-rate-limit-reset', 0))
-            result = response.json()
-            errors = result.get('errors')
-            max_len -= 1
-            if errors:
-                send_msg_error(f'推特的cookie出问题了。{cookie["cto"]}。errors:{errors[0]["message"]}')
-                utils.logger.error(f'[x_media_platform.twitter.client.get_by_header]{errors[0]["message"]}')
-                continue
+            if data is not None:
+                return response, data
+        raise DataFetchError(f'请求{extract_value_from_url(url)}失败，所有cookie都返回错误')
 
-            self._redis.lpush(cache_key, json.dumps(cookie))
-            return response
+    def _settle_cookie(self, cookie: dict, api_name: str, response) -> dict | None:
+        """
+        解析返回结果并归还cookie
+        :return: 解析后的json，接口返回错误时为None
+        """
+        try:
+            data = decoder.loads(response.content)
+        except Exception:
+            self._lease.release(api_name, cookie['id'])
+            raise
+        if self._release_cookie(cookie, api_name, response, data):
+            return data
+        return None
+
+    @staticmethod
+    def _get_user_headers(cookie: dict) -> dict:
+        """
+        设置登录用户cookie的请求头
+        :param cookie: cookie池中的数据
+        :return: dict
+        """
+        _headers = get_headers()
+        _headers["cookie"] = f"auth_token={cookie['auth_token']};ct0={cookie['cto']}"
+        _headers["x-csrf-token"] = cookie['cto']
+        return _headers
+
+    def _release_cookie(self, cookie: dict, api_name: str, response, data: dict) -> bool:
+        """
+        根据返回的限流头归还cookie，接口返回错误时把cookie移出调度池
+        :param cookie: cookie池中的数据
+        :param api_name: 接口名
+        :param response: 请求返回的结果
+        :param data: 解析后的json
+        :return: 接口是否成功
+        """
+        errors = data.get('errors')
+        if errors:
+            self._lease.drop(api_name, cookie['id'])
+            send_msg_error(f'推特的cookie出问题了。{cookie["cto"]}。errors:{errors[0]["message"]}')
+            utils.logger.error(f'[x_media_platform.twitter.client.get_by_header]{errors[0]["message"]}')
+            return False
+
+        remaining = response.headers.get('x-rate-limit-remaining')
+        if remaining is None:
+            self._lease.release(api_name, cookie['id'])
+        else:
+            self._lease.release(api_name, cookie['id'], int(remaining),
+                                int(response.headers.get('x-rate-limit-reset', 0)))
+        return True
+
+    def _archive_response(self, endpoint: str, key: int, cursor: str | None, response):
+        """
+        归档接口的原始返回内容，归档失败不影响抓取
+        :param endpoint: 接口名
+        :param key: 用户id或帖子id
+        :param cursor: 翻页的定位值
+        :param response: 请求返回的结果
+        """
+        if self._archive is None:
+            return
+        try:
+            self._archive.append(endpoint, key, cursor, response.content)
+        except OSError as e:
+            utils.logger.error(f'[media_platform.twitter.client.archive]归档{endpoint}返回内容失败:{str(e)}')
+
+    def _reject_cookie(self, cookie: dict, api_name: str, error: Exception):
+        """
+        请求被限流时cookie等到下个刷新周期再用，token失效时移出调度池并设为无效
+        :param cookie: cookie池中的数据
+        :param api_name: 接口名
+        :param error: 请求抛出的异常
+        """
+        if isinstance(error, RateLimitError):
+            self._lease.release(api_name, cookie['id'], 0, time.current_unixtime() + self.limit_window)
+        else:
+            self._expire_cookie(cookie['id'])
 
-    def request(self, method, url, **kwargs):
+    def _expire_cookie(self, cookie_id: int):
+        """
+        token失效，从所有接口的调度池删除，数据库里设为无效，刷新cookie列表时不会再加回调度池
+        :param cookie_id: cookie的id
+        """
+        for api in self.API_LIMITS:
+            self._lease.drop(api, cookie_id)
+        # 使用单独的会话，异步客户端在线程里调用
+        with Session(self._db.get_bind()) as db:
+            CookieService(db, self._redis).set_cookie_invalid([cookie_id])
+        utils.logger.error(f'[media_platform.twitter.client.expire_cookie]cookie {cookie_id} 的token已失效')
+
+    def request(self, method, url, timeout: float | None = None, **kwargs):
         """
         GET、POST统一请求方法，根据http状态码会抛出异常
         :param method: GET或POST方法
         :param url: 请求url
+        :param timeout: 本次请求的超时时间，不传使用客户端的默认值
         :param kwargs: 参数
         :return:
         """
         response = None
 
-        if method == "GET":
-            response = requests.request(method, url, **kwargs)
-        elif method == "POST":
-            response = requests.request(method, url, **kwargs)
+        if method in ("GET", "POST"):
+            response = self._session.request(method, url, timeout=timeout or self.timeout, proxies=self.proxies,
+                                             **kwargs)
 
+        return self._check_response(response)
+
+    @staticmethod
+    def _check_response(response):
+        """
+        根据http状态码检查返回结果，异常状态码会抛出异常
+        :param response: requests或httpx的返回结果
+        :return:
+        """
         if response.status_code == 200:
             return response
 
@@ -171,66 +327,87 @@ class TwitterClient(AbstractApiClient):
         utils.logger.error(f"请求数据失败: {response.text}")
         raise DataFetchError(response.text)
 
-    def get(self, url: str, params: dict | None = None, headers: dict | None = None):
+    def get(self, url: str, params: dict | None = None, headers: dict | None = None, timeout: float | None = None):
         """
         GET请求
         :param url: 请求地址
         :param params: 参数
         :param headers: http头参数
+        :param timeout: 本次请求的超时时间
         :return:
         """
-        return self.request(method="GET", url=f"{url}", params=params, headers=headers)
+        return self.request(method="GET", url=f"{url}", params=params, headers=headers, timeout=timeout)
 
-    def post(self, url: str, data: dict, headers: dict | None = None):
+    def post(self, url: str, data: dict, headers: dict | None = None, timeout: float | None = None):
         """
         POST请求
         :param url: 请求地址
         :param data: 参数
         :param headers: http头参数
+        :param timeout: 本次请求的超时时间
         :return:
         """
-        return self.request(method="POST", url=f"{url}", data=data, headers=headers)
+        return self.request(method="POST", url=f"{url}", data=data, headers=headers, timeout=timeout)
+
+    def call(self, api: ApiCall, timeout: float | None = None):
+        """
+        发送接口请求，归档并解析返回结果
+        :param api: 接口请求
+        :param timeout: 本次请求的超时时间
+        :return: api.parse的结果
+        """
+        if api.headers is not None:
+            return self._handle(api, self.get(api.url, headers=api.headers, timeout=timeout), None)
+        response, data = self.get_by_header(api.url, timeout=timeout)
+        return self._handle(api, response, data)
+
+    def _handle(self, api: ApiCall, response, data: dict | None):
+        if api.endpoint is not None:
+            self._archive_response(api.endpoint, api.key, api.cursor, response)
+        return api.parse(response, data)
 
-    def api_user_by_screen_name(self, user: str, headers: dict):
+    def api_user_by_screen_name(self, user: str, headers: dict, timeout: float | None = None):
         """
         获取指定账号的基础信息
         :param headers: header信息
         :param user: 用户名，@后面的用户名
+        :param timeout: 本次请求的超时时间
         :return: UserInfo
         """
+        return self.call(ApiCall(self._user_by_screen_name_url(user), self._parse_user_by_screen_name,
+                                 headers=headers), timeout)
+
+    @staticmethod
+    def _user_by_screen_name_url(user: str) -> str:
         variables = '{"screen_name":"' + user + '","withSafetyModeUserFields":true}'
         features = '{"hidden_profile_subscriptions_enabled":true,"rweb_tipjar_consumption_enabled":true,"responsive_web_graphql_exclude_directive_enabled":true,"verified_phone_label_enabled":false,"subscriptions_verification_info_is_identity_verified_enabled":true,"subscriptions_verification_info_verified_since_enabled":true,"highlights_tweets_tab_ui_enabled":true,"responsive_web_twitter_article_notes_tab_enabled":true,"subscriptions_feature_can_gift_premium":true,"creator_subscriptions_tweet_preview_api_enabled":true,"responsive_web_graphql_skip_user_profile_image_extensions_enabled":false,"responsive_web_graphql_timeline_navigation_enabled":true}'
         fieldToggles = '{"withAuxiliaryUserLabels":false}'
-        url = f'https://twitter.com/i/api/graphql/Yka-W8dz7RaEuQNkroPkYw/UserByScreenName?variables={variables}&features={features}&fieldToggles={fieldToggles}'
-        response = self.get(url, headers=headers)
+        return f'https://twitter.com/i/api/graphql/Yka-W8dz7RaEuQNkroPkYw/UserByScreenName?variables={variables}&features={features}&fieldToggles={fieldToggles}'
 
+    @staticmethod
+    def _parse_user_by_screen_name(response, data: dict | None = None) -> UserInfo:
+        """
+        解析UserByScreenName接口的返回数据
+        """
         headers = response.headers
-        data = response.json()["data"]["user"]["result"]
-        legacy = response.json()["data"]["user"]["result"]["legacy"]
-
-        x_created_at = time.convert_to_ymd(legacy['created_at'])
-
-        return UserInfo(
-            rest_id=data["rest_id"],
-            name=legacy["screen_name"],
-            rate_limit_reset=headers["x-rate-limit-remaining"],
-            limit_remaining=response.headers["x-rate-limit-reset"],
-            followers_count=legacy["followers_count"],
-            friends_count=legacy["friends_count"],
-            statuses_count=legacy["statuses_count"],
-            description=legacy["description"],
-            x_created_at=x_created_at,
-            full_name=legacy["name"],
-        )
+        return decoder.decode_user(decoder.loads(response.content), headers["x-rate-limit-remaining"],
+                                   headers["x-rate-limit-reset"])
 
-    def api_user_tweets(self, user_id: int, next_course: str | None = None):
+    def api_user_tweets(self, user_id: int, next_course: str | None = None, timeout: float | None = None):
         """
         获取指定用户的内容
         接口访问限制：50/15分钟
         :param user_id: 用户id
         :param next_course: 向下翻页的定位值
+        :param timeout: 本次请求的超时时间
         :return:
         """
+        return self.call(ApiCall(self._user_tweets_url(user_id, next_course),
+                                 lambda response, data: self._parse_user_tweets(response, data, user_id),
+                                 'UserTweets', user_id, next_course), timeout)
+
+    @staticmethod
+    def _user_tweets_url(user_id: int, next_course: str | None = None) -> str:
         variables_json = {
             "userId": user_id,
             "count": 20,
@@ -245,145 +422,51 @@ class TwitterClient(AbstractApiClient):
         variables = json.dumps(variables_json)
         features = '{"rweb_tipjar_consumption_enabled":true,"responsive_web_graphql_exclude_directive_enabled":true,"verified_phone_label_enabled":false,"creator_subscriptions_tweet_preview_api_enabled":true,"responsive_web_graphql_timeline_navigation_enabled":true,"responsive_web_graphql_skip_user_profile_image_extensions_enabled":false,"communities_web_enable_tweet_community_results_fetch":true,"c9s_tweet_anatomy_moderator_badge_enabled":true,"articles_preview_enabled":true,"responsive_web_edit_tweet_api_enabled":true,"graphql_is_translatable_rweb_tweet_is_translatable_enabled":true,"view_counts_everywhere_api_enabled":true,"longform_notetweets_consumption_enabled":true,"responsive_web_twitter_article_tweet_consumption_enabled":true,"tweet_awards_web_tipping_enabled":false,"creator_subscriptions_quote_tweet_preview_enabled":false,"freedom_of_speech_not_reach_fetch_enabled":true,"standardized_nudges_misinfo":true,"tweet_with_visibility_results_prefer_gql_limited_actions_policy_enabled":true,"rweb_video_timestamps_enabled":true,"longform_notetweets_rich_text_read_enabled":true,"longform_notetweets_inline_media_enabled":true,"responsive_web_enhance_cards_enabled":false}'
         fieldToggles = '{"withArticlePlainText":false}'
-        url = f'https://api.x.com/graphql/E3opETHurmVJflFsUBVuUQ/UserTweets?variables={variables}&features={features}&fieldToggles={fieldToggles}'
-
-        response = self.get_by_header(url)
+        return f'https://api.x.com/graphql/E3opETHurmVJflFsUBVuUQ/UserTweets?variables={variables}&features={features}&fieldToggles={fieldToggles}'
 
-        result = response.json()
-        instructions = result["data"]["user"]["result"]["timeline_v2"]["timeline"]["instructions"]
-
-        # 获取时间数据列表
-        entries = []
-        for timeline in instructions:
-            if timeline["type"] == "TimelineAddEntries":
-                entries = timeline["entries"]
-
-        data = self._get_content_by_timeline(entries, user_id)
+    @staticmethod
+    def _parse_user_tweets(response, data: dict, user_id: int):
+        """
+        解析UserTweets接口的返回数据
+        """
+        records, next_cursor = decoder.decode_user_tweets(data, user_id)
 
         utils.logger.debug(
             f'调用api_user_tweets接口剩余次数:{response.headers["x-rate-limit-remaining"]},刷新时间:{response.headers["x-rate-limit-reset"]}')
         return {
-            "data": data["data"],
+            "data": records,
             "limit-remaining": response.headers["x-rate-limit-remaining"],  # 访问剩余次数
             "x-rate-limit-reset": response.headers["x-rate-limit-reset"],  # 刷新时间
-            "next_cursor": data["next_cursor"],
-        }
-
-    def _get_content_by_timeline(self, contents, user_id: int):
-        """
-        细节列表页中的数据
-        :param contents:
-        :return:
-        """
-        list = []
-        next_cursor = ''  # 向下翻页的值
-        for v in contents:
-            if v["content"]["entryType"] == "TimelineTimelineModule":  # 有多个数据
-                # 忽略推荐关注人的数据
-                if v["entryId"].startswith("who-to-follow"):
-                    continue
-
-                if v["content"]["items"][0]["item"]["itemContent"]["tweet_results"]["result"]['__typename'] == 'Tweet':
-                    result = v["content"]["items"][0]["item"]["itemContent"]["tweet_results"]["result"]
-                else:
-                    result = v["content"]["items"][0]["item"]["itemContent"]["tweet_results"]["result"]['tweet']
-
-                legacy = result["legacy"]
-                rest_id = result["rest_id"]
-                views = result["views"]
-                if views["state"] == "Enabled":
-                    views_count = 0
-                else:
-                    views_count = views['count']
-
-                list.append({
-                    "content": legacy["full_text"],
-                    "created_at": time.convert_to_ymd(legacy["created_at"]),
-                    "favorite_count": legacy["favorite_count"],  # 喜欢数
-                    "reply_count": legacy["reply_count"],  # 评论数
-                    "retweet_count": legacy["retweet_count"],  # 转帖数
-                    "views_count": views_count,  # 查看数
-                    "id": int(rest_id),  # 帖子id
-                    "user_id": int(user_id),  # 帖子id
-                    "retweeted_id": 0,  # 转发帖原帖id
-                })
-            elif v["content"]["entryType"] == "TimelineTimelineItem":  # 转帖
-                core = v["content"]["itemContent"]["tweet_results"]["result"].get('core', -1)
-                if core == -1:
-                    continue
-                legacy = v["content"]["itemContent"]["tweet_results"]["result"]["legacy"]
-                views = v["content"]["itemContent"]["tweet_results"]["result"]["views"]
-                if views["state"] == "Enabled":
-                    views_count = 0
-                else:
-                    views_count = views["count"]
-
-                # 获取转发帖子的id
-                retweeted_id = 0
-                if legacy.get("quoted_status_id_str"):
-                    retweeted_id = legacy["quoted_status_id_str"]
-                elif legacy.get("retweeted_status_result"):
-                    retweeted_id = legacy["retweeted_status_result"]["result"]["rest_id"]
-
-                list.append({
-                    "content": legacy["full_text"],
-                    "created_at": time.convert_to_ymd(legacy["created_at"]),
-                    "favorite_count": legacy["favorite_count"],  # 喜欢数
-                    "reply_count": legacy["reply_count"],  # 评论数
-                    "retweet_count": legacy["retweet_count"],  # 转帖数
-                    "views_count": views_count,  # 查看数
-                    "id": int(legacy["id_str"]),  # 帖子id
-                    "user_id": int(user_id),  # 用户id
-                    "retweeted_id": retweeted_id,
-                })
-            elif v["content"]["entryType"] == "TimelineTimelineCursor" and v["content"]["cursorType"] == "Bottom":
-                next_cursor = v["content"]["value"]
-
-        return {
-            "data": list,
-            "next_cursor": next_cursor
+            "next_cursor": next_cursor,
         }
 
-    def api_tweet_detail_text(self, tweet_id: int):
+    def api_tweet_detail_text(self, tweet_id: int, timeout: float | None = None):
         """
         获取指定帖子的内容，不获取回复
         访问限制：150/15分钟
         :param tweet_id:
+        :param timeout: 本次请求的超时时间
         :return:
         """
         utils.logger.debug(f"api_tweet_detail_text接口调用，tweet_id={tweet_id}")
 
+        return self.call(ApiCall(self._tweet_detail_url(tweet_id), self._parse_tweet_detail, 'TweetDetail', tweet_id),
+                         timeout)
+
+    @staticmethod
+    def _tweet_detail_url(tweet_id: int) -> str:
         variables = '{"focalTweetId":"' + str(
             tweet_id) + '","with_rux_injections":false,"rankingMode":"Relevance","includePromotedContent":true,"withCommunity":true,"withQuickPromoteEligibilityTweetFields":true,"withBirdwatchNotes":true,"withVoice":true}'
         features = '{"rweb_tipjar_consumption_enabled":true,"responsive_web_graphql_exclude_directive_enabled":true,"verified_phone_label_enabled":false,"creator_subscriptions_tweet_preview_api_enabled":true,"responsive_web_graphql_timeline_navigation_enabled":true,"responsive_web_graphql_skip_user_profile_image_extensions_enabled":false,"communities_web_enable_tweet_community_results_fetch":true,"c9s_tweet_anatomy_moderator_badge_enabled":true,"articles_preview_enabled":true,"responsive_web_edit_tweet_api_enabled":true,"graphql_is_translatable_rweb_tweet_is_translatable_enabled":true,"view_counts_everywhere_api_enabled":true,"longform_notetweets_consumption_enabled":true,"responsive_web_twitter_article_tweet_consumption_enabled":true,"tweet_awards_web_tipping_enabled":false,"creator_subscriptions_quote_tweet_preview_enabled":false,"freedom_of_speech_not_reach_fetch_enabled":true,"standardized_nudges_misinfo":true,"tweet_with_visibility_results_prefer_gql_limited_actions_policy_enabled":true,"rweb_video_timestamps_enabled":true,"longform_notetweets_rich_text_read_enabled":true,"longform_notetweets_inline_media_enabled":true,"responsive_web_enhance_cards_enabled":false}'
         fieldToggles = '{"withArticleRichContentState":true,"withArticlePlainText":false,"withGrokAnalyze":false,"withDisallowedReplyControls":false}'
-        url = f'https://x.com/i/api/graphql/QuBlQ6SxNAQCt6-kBiCXCQ/TweetDetail?variables={variables}&features={features}&fieldToggles={fieldToggles}'
-        # response = self.get(url, headers=headers)
-        response = self.get_by_header(url)
-
-        result = response.json()
-        instructions = result["data"]["threaded_conversation_with_injections_v2"]["instructions"]
-
-        entries = []
-        text = ''
-        for val in instructions:
-            if val["type"] == "TimelineAddEntries":
-                entries = val["entries"]
-                break
-        for entry in entries:
-            if entry["content"]["entryType"] != "TimelineTimelineItem":
-                continue
-            if entry["content"]["itemContent"]["itemType"] != "TimelineTweet":
-                continue
-
-            result = entry["content"]["itemContent"]["tweet_results"]["result"]
+        return f'https://x.com/i/api/graphql/QuBlQ6SxNAQCt6-kBiCXCQ/TweetDetail?variables={variables}&features={features}&fieldToggles={fieldToggles}'
 
-            if result.get('note_tweet'):
-
-                text = entry["content"]["itemContent"]["tweet_results"]["result"]["note_tweet"]["note_tweet_results"][
-                    "result"]["text"]
-            else:
-                text = entry["content"]["itemContent"]["tweet_results"]["result"]['legacy']['full_text']
+    @staticmethod
+    def _parse_tweet_detail(response, data: dict):
+        """
+        解析TweetDetail接口的返回数据
+        """
+        text = decoder.decode_tweet_detail(data)
 
         utils.logger.debug(
             f'调用api_tweet_detail_text接口剩余次数:{response.headers["x-rate-limit-remaining"]},刷新时间:{response.headers["x-rate-limit-reset"]}')
@@ -394,9 +477,14 @@ class TwitterClient(AbstractApiClient):
             "limit_remaining": response.headers["x-rate-limit-reset"],
         }
 
-    def api_following(self, user_id: int, cursor: str | None = None):
+    def api_following(self, user_id: int, cursor: str | None = None, timeout: float | None = None):
         utils.logger.debug(f"api_following接口调用，user_id={user_id}")
 
+        return self.call(ApiCall(self._following_url(user_id, cursor), self._parse_following, 'Following', user_id,
+                                 cursor), timeout)
+
+    @staticmethod
+    def _following_url(user_id: int, cursor: str | None = None) -> str:
         variables_json = {
             "userId": user_id,
             "count": 20,
@@ -405,47 +493,15 @@ class TwitterClient(AbstractApiClient):
         if cursor is not None:
             variables_json["cursor"] = cursor
         variables = json.dumps(variables_json)
-        url = f'https://x.com/i/api/graphql/7oQrdmth4zE3EtD42ZxgOA/Following?variables={variables}&features=%7B%22rweb_tipjar_consumption_enabled%22%3Atrue%2C%22responsive_web_graphql_exclude_directive_enabled%22%3Atrue%2C%22verified_phone_label_enabled%22%3Afalse%2C%22creator_subscriptions_tweet_preview_api_enabled%22%3Atrue%2C%22responsive_web_graphql_timeline_navigation_enabled%22%3Atrue%2C%22responsive_web_graphql_skip_user_profile_image_extensions_enabled%22%3Afalse%2C%22communities_web_enable_tweet_community_results_fetch%22%3Atrue%2C%22c9s_tweet_anatomy_moderator_badge_enabled%22%3Atrue%2C%22articles_preview_enabled%22%3Atrue%2C%22responsive_web_edit_tweet_api_enabled%22%3Atrue%2C%22graphql_is_translatable_rweb_tweet_is_translatable_enabled%22%3Atrue%2C%22view_counts_everywhere_api_enabled%22%3Atrue%2C%22longform_notetweets_consumption_enabled%22%3Atrue%2C%22responsive_web_twitter_article_tweet_consumption_enabled%22%3Atrue%2C%22tweet_awards_web_tipping_enabled%22%3Afalse%2C%22creator_subscriptions_quote_tweet_preview_enabled%22%3Afalse%2C%22freedom_of_speech_not_reach_fetch_enabled%22%3Atrue%2C%22standardized_nudges_misinfo%22%3Atrue%2C%22tweet_with_visibility_results_prefer_gql_limited_actions_policy_enabled%22%3Atrue%2C%22rweb_video_timestamps_enabled%22%3Atrue%2C%22longform_notetweets_rich_text_read_enabled%22%3Atrue%2C%22longform_notetweets_inline_media_enabled%22%3Atrue%2C%22responsive_web_enhance_cards_enabled%22%3Afalse%7D'
-        response = self.get_by_header(url)
+        return f'https://x.com/i/api/graphql/7oQrdmth4zE3EtD42ZxgOA/Following?variables={variables}&features=%7B%22rweb_tipjar_consumption_enabled%22%3Atrue%2C%22responsive_web_graphql_exclude_directive_enabled%22%3Atrue%2C%22verified_phone_label_enabled%22%3Afalse%2C%22creator_subscriptions_tweet_preview_api_enabled%22%3Atrue%2C%22responsive_web_graphql_timeline_navigation_enabled%22%3Atrue%2C%22responsive_web_graphql_skip_user_profile_image_extensions_enabled%22%3Afalse%2C%22communities_web_enable_tweet_community_results_fetch%22%3Atrue%2C%22c9s_tweet_anatomy_moderator_badge_enabled%22%3Atrue%2C%22articles_preview_enabled%22%3Atrue%2C%22responsive_web_edit_tweet_api_enabled%22%3Atrue%2C%22graphql_is_translatable_rweb_tweet_is_translatable_enabled%22%3Atrue%2C%22view_counts_everywhere_api_enabled%22%3Atrue%2C%22longform_notetweets_consumption_enabled%22%3Atrue%2C%22responsive_web_twitter_article_tweet_consumption_enabled%22%3Atrue%2C%22tweet_awards_web_tipping_enabled%22%3Afalse%2C%22creator_subscriptions_quote_tweet_preview_enabled%22%3Afalse%2C%22freedom_of_speech_not_reach_fetch_enabled%22%3Atrue%2C%22standardized_nudges_misinfo%22%3Atrue%2C%22tweet_with_visibility_results_prefer_gql_limited_actions_policy_enabled%22%3Atrue%2C%22rweb_video_timestamps_enabled%22%3Atrue%2C%22longform_notetweets_rich_text_read_enabled%22%3Atrue%2C%22longform_notetweets_inline_media_enabled%22%3Atrue%2C%22responsive_web_enhance_cards_enabled%22%3Afalse%7D'
 
-        result = response.json()
-        instructions = result["data"]["user"]["result"]["timeline"]["timeline"]["instructions"]
-
-        entries = []
-        for val in instructions:
-            if val["type"] == "TimelineAddEntries":
-                entries = val["entries"]
-                break
-
-        user_list = []
-        bottom = ""  # 向下翻页
-        for entry in entries:
-            if entry["content"]["entryType"] == "TimelineTimelineCursor" and entry["content"]["cursorType"] == "Bottom":
-                bottom = entry["content"]["value"]
-
-            if entry["content"]["entryType"] != "TimelineTimelineItem":
-                continue
-
-            user_results = entry["content"]["itemContent"]["user_results"]
-            if len(user_results) == 0:
-                continue
+    @staticmethod
+    def _parse_following(response, data: dict):
+        """
+        解析Following接口的返回数据
+        """
+        user_list, bottom = decoder.decode_following(data)
 
-            result = user_results["result"]
-            legacy = result["legacy"]
-            user_list.append(
-                UserInfo(
-                    rest_id=result["rest_id"],
-                    name=legacy["screen_name"],
-                    followers_count=legacy["followers_count"],
-                    friends_count=legacy["friends_count"],
-                    statuses_count=legacy["statuses_count"],
-                    description=legacy["description"],
-                    x_created_at=time.convert_to_ymd(legacy["created_at"]),
-                    full_name=legacy["name"],
-                    rate_limit_reset=0,
-                    limit_remaining=0,
-                )
-            )
         utils.logger.debug(
             f'调用api_following接口剩余次数:{response.headers["x-rate-limit-remaining"]},刷新时间:{response.headers["x-rate-limit-reset"]}')
         return {
@@ -459,7 +515,107 @@ class TwitterClient(AbstractApiClient):
         """
         按照关键字搜索
         """
-        url = f'https://x.com/i/api/graphql/UN1i3zUiCWa-6r-Uaho4fw/SearchTimeline?variables={"rawQuery":"{keyword}","count":20,"querySource":"typed_query","product":"Top"}&features={"rweb_tipjar_consumption_enabled":true,"responsive_web_graphql_exclude_directive_enabled":true,"verified_phone_label_enabled":false,"creator_subscriptions_tweet_preview_api_enabled":true,"responsive_web_graphql_timeline_navigation_enabled":true,"responsive_web_graphql_skip_user_profile_image_extensions_enabled":false,"communities_web_enable_tweet_community_results_fetch":true,"c9s_tweet_anatomy_moderator_badge_enabled":true,"articles_preview_enabled":true,"responsive_web_edit_tweet_api_enabled":true,"graphql_is_translatable_rweb_tweet_is_translatable_enabled":true,"view_counts_everywhere_api_enabled":true,"longform_notetweets_consumption_enabled":true,"responsive_web_twitter_article_tweet_consumption_enabled":true,"tweet_awards_web_tipping_enabled":false,"creator_subscriptions_quote_tweet_preview_enabled":false,"freedom_of_speech_not_reach_fetch_enabled":true,"standardized_nudges_misinfo":true,"tweet_with_visibility_results_prefer_gql_limited_actions_policy_enabled":true,"rweb_video_timestamps_enabled":true,"longform_notetweets_rich_text_read_enabled":true,"longform_notetweets_inline_media_enabled":true,"responsive_web_enhance_cards_enabled":false}'
-        response = self.get_by_header(url)
+        return self.call(ApiCall(self._search_url(keyword), lambda response, data: data))
+
+    @staticmethod
+    def _search_url(keyword: str) -> str:
+        return f'https://x.com/i/api/graphql/UN1i3zUiCWa-6r-Uaho4fw/SearchTimeline?variables={"rawQuery":"{keyword}","count":20,"querySource":"typed_query","product":"Top"}&features={"rweb_tipjar_consumption_enabled":true,"responsive_web_graphql_exclude_directive_enabled":true,"verified_phone_label_enabled":false,"creator_subscriptions_tweet_preview_api_enabled":true,"responsive_web_graphql_timeline_navigation_enabled":true,"responsive_web_graphql_skip_user_profile_image_extensions_enabled":false,"communities_web_enable_tweet_community_results_fetch":true,"c9s_tweet_anatomy_moderator_badge_enabled":true,"articles_preview_enabled":true,"responsive_web_edit_tweet_api_enabled":true,"graphql_is_translatable_rweb_tweet_is_translatable_enabled":true,"view_counts_everywhere_api_enabled":true,"longform_notetweets_consumption_enabled":true,"responsive_web_twitter_article_tweet_consumption_enabled":true,"tweet_awards_web_tipping_enabled":false,"creator_subscriptions_quote_tweet_preview_enabled":false,"freedom_of_speech_not_reach_fetch_enabled":true,"standardized_nudges_misinfo":true,"tweet_with_visibility_results_prefer_gql_limited_actions_policy_enabled":true,"rweb_video_timestamps_enabled":true,"longform_notetweets_rich_text_read_enabled":true,"longform_notetweets_inline_media_enabled":true,"responsive_web_enhance_cards_enabled":false}'
+
+
+class AsyncTwitterClient(TwitterClient):
+    """
+    TwitterClient的asyncio版本
+    所有请求共用一个keep-alive连接池，服务端支持时使用HTTP/2，可以同时发起多个请求
+    只替换了发送请求的方法，api_*方法继承自TwitterClient，返回的是协程，需要await
+    Redis和数据库的操作在线程里执行，不阻塞事件循环
+    """
+
+    def __init__(self,
+                 db: Session,
+                 redis: Redis,
+                 timeout=30,
+                 proxies=None,
+                 pool_size=20,
+                 ):
+        super().__init__(db, redis, timeout, proxies, pool_size)
+
+        proxy = proxies.get('https') if proxies else None
+        self._client = httpx.AsyncClient(
+            http2=True,
+            timeout=timeout,
+            proxy=proxy,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    async def aclose(self):
+        """
+        关闭连接池
+        """
+        await self._client.aclose()
+
+    async def request(self, method, url, timeout: float | None = None, **kwargs):
+        """
+        GET、POST统一请求方法，根据http状态码会抛出异常
+        :param method: GET或POST方法
+        :param url: 请求url
+        :param timeout: 本次请求的超时时间，不传使用客户端的默认值
+        :param kwargs: 参数
+        :return:
+        """
+        response = None
+
+        if method in ("GET", "POST"):
+            response = await self._client.request(method, url, timeout=timeout or self.timeout, **kwargs)
+
+        return self._check_response(response)
+
+    async def get(self, url: str, params: dict | None = None, headers: dict | None = None,
+                  timeout: float | None = None):
+        return await self.request(method="GET", url=f"{url}", params=params, headers=headers, timeout=timeout)
+
+    async def post(self, url: str, data: dict, headers: dict | None = None, timeout: float | None = None):
+        return await self.request(method="POST", url=f"{url}", data=data, headers=headers, timeout=timeout)
+
+    async def call(self, api: ApiCall, timeout: float | None = None):
+        if api.headers is not None:
+            return self._handle(api, await self.get(api.url, headers=api.headers, timeout=timeout), None)
+        response, data = await self.get_by_header(api.url, timeout=timeout)
+        return self._handle(api, response, data)
+
+    async def get_by_header(self, url, params: dict | None = None, timeout: float | None = None):
+        """
+        根据请求的url来设置cookie，和TwitterClient.get_by_header一样
+        :param url: url
+        :param params: 参数
+        :param timeout: 本次请求的超时时间
+        :return: 请求返回的结果，解析后的json，所有cookie都返回错误时抛出DataFetchError
+        """
+        attempts = len(await asyncio.to_thread(self.get_cookie_roster))
+        while attempts > 0:
+            cookie, api_name = await asyncio.to_thread(self.get_cookie, url)
+            # 被取消时也要归还cookie，finally里直接调用，不再等待线程
+            settled = False
+            try:
+                response = await self.request(method="GET", url=f"{url}", params=params,
+                                              headers=self._get_user_headers(cookie), timeout=timeout)
+                attempts -= 1
+                # 交给线程归还，线程被取消后也会执行完
+                settled = True
+                data = await asyncio.to_thread(self._settle_cookie, cookie, api_name, response)
+            except (RateLimitError, TokenExpiredError) as e:
+                settled = True
+                await asyncio.to_thread(self._reject_cookie, cookie, api_name, e)
+                continue
+            finally:
+                if not settled:
+                    self._lease.release(api_name, cookie['id'])
 
-        result = response.json()
+            if data is not None:
+                return response, data
+        raise DataFetchError(f'请求{extract_value_from_url(url)}失败，所有cookie都返回错误')
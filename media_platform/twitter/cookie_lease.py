@@ -0,0 +1,272 @@
+"""
+登录用户cookie的租约调度
+每个接口用3个key保存cookie池：
+    {prefix}{api}         有序集合，可用的cookie，分值越小越优先
+    {prefix}{api}_leased  有序集合，正在使用中的cookie，分值为租约过期时间
+    {prefix}{api}_state   哈希表，cookie的数据和剩余次数
+分值规则：还有剩余次数的cookie分值为 -剩余次数，次数用完的cookie分值为刷新时间(unix时间戳)
+所以取分值最小的一个就是最优的cookie，分值大于当前时间说明要等到这个时间才有cookie可用
+"""
+import json
+from redis import Redis
+
+from media_platform.twitter.exception import RateLimitError, TokenWaitError
+from tools.time import current_unixtime
+
+# 计算cookie在可用队列里的分值
+_SCORE_FUNC = """
+local function score(cookie)
+    if cookie['limit'] > 0 then
+        return -cookie['limit']
+    end
+    return cookie['limit_reset']
+end
+"""
+
+# 同步数据库里的cookie：新增的cookie加入可用队列，已经不在数据库里的cookie删除
+# KEYS: ready, leased, state  ARGV: limit, id1, cookie1, id2, cookie2...
+_SEED_SCRIPT = _SCORE_FUNC + """
+local limit = tonumber(ARGV[1])
+local ids = {}
+for i = 2, #ARGV, 2 do
+    local id = ARGV[i]
+    ids[id] = true
+    if redis.call('HEXISTS', KEYS[3], id) == 0 then
+        redis.call('HSET', KEYS[3], id, ARGV[i + 1])
+        redis.call('ZADD', KEYS[1], -limit, id)
+    end
+end
+for _, id in ipairs(redis.call('HKEYS', KEYS[3])) do
+    if not ids[id] then
+        redis.call('HDEL', KEYS[3], id)
+        redis.call('ZREM', KEYS[1], id)
+        redis.call('ZREM', KEYS[2], id)
+    end
+end
+return redis.call('HLEN', KEYS[3])
+"""
+
+# 获取最优的cookie并加上租约，没有可用cookie时返回还要等待的秒数
+# KEYS: ready, leased, state  ARGV: limit, lease_ttl
+# 返回 {1, cookie} 或 {0, 等待秒数}，等待秒数为-1表示cookie池为空
+_ACQUIRE_SCRIPT = _SCORE_FUNC + """
+local now = tonumber(redis.call('TIME')[1])
+
+-- 回收租约过期的cookie，防止进程异常退出后cookie一直被占用
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+    redis.call('ZREM', KEYS[2], id)
+    local raw = redis.call('HGET', KEYS[3], id)
+    if raw then
+        redis.call('ZADD', KEYS[1], score(cjson.decode(raw)), id)
+    end
+end
+
+while true do
+    local best = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    if #best == 0 then
+        -- 都在使用中，归还后按cookie的分值排队，取分值最小的一个计算等待时间
+        local leased = redis.call('ZRANGE', KEYS[2], 0, -1)
+        if #leased == 0 then
+            return {0, -1}
+        end
+        local earliest = nil
+        for _, id in ipairs(leased) do
+            local raw = redis.call('HGET', KEYS[3], id)
+            if raw then
+                local value = score(cjson.decode(raw))
+                if earliest == nil or value < earliest then
+                    earliest = value
+                end
+            end
+        end
+        if earliest == nil then
+            return {0, -1}
+        end
+        return {0, math.max(earliest - now, 1)}
+    end
+
+    local id = best[1]
+    local best_score = tonumber(best[2])
+    if best_score > now then
+        return {0, best_score - now}
+    end
+
+    local raw = redis.call('HGET', KEYS[3], id)
+    redis.call('ZREM', KEYS[1], id)
+    if raw then
+        local cookie = cjson.decode(raw)
+        if cookie['limit'] <= 0 then
+            -- 已经过了刷新时间，次数恢复
+            cookie['limit'] = tonumber(ARGV[1])
+            cookie['limit_reset'] = 0
+            raw = cjson.encode(cookie)
+            redis.call('HSET', KEYS[3], id, raw)
+        end
+        redis.call('ZADD', KEYS[2], now + tonumber(ARGV[2]), id)
+        return {1, raw}
+    end
+end
+"""
+
+# 归还cookie，同时记录x-rate-limit-*返回的剩余次数和刷新时间
+# KEYS: ready, leased, state  ARGV: id, remaining, reset, window  remaining为空时剩余次数减1
+# 没有返回限流头时不知道刷新时间，按这次请求开始一个新的刷新周期，次数用完后要等到周期结束
+_RELEASE_SCRIPT = _SCORE_FUNC + """
+local raw = redis.call('HGET', KEYS[3], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+if not raw then
+    return 0
+end
+local cookie = cjson.decode(raw)
+if ARGV[2] == '' then
+    local now = tonumber(redis.call('TIME')[1])
+    cookie['limit'] = cookie['limit'] - 1
+    if cookie['limit_reset'] <= now then
+        cookie['limit_reset'] = now + tonumber(ARGV[4])
+    end
+else
+    cookie['limit'] = tonumber(ARGV[2])
+    cookie['limit_reset'] = tonumber(ARGV[3])
+end
+redis.call('HSET', KEYS[3], ARGV[1], cjson.encode(cookie))
+redis.call('ZADD', KEYS[1], score(cookie), ARGV[1])
+return 1
+"""
+
+# 删除不能使用的cookie
+# KEYS: ready, leased, state  ARGV: id
+_DROP_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+return redis.call('HDEL', KEYS[3], ARGV[1])
+"""
+
+
+class CookieLeaseScheduler:
+    """
+    基于Redis有序集合和Lua脚本的cookie调度，获取、归还cookie都只需要一次Redis请求，多个进程共用也不会冲突
+    """
+
+    def __init__(self, redis: Redis, prefix: str = 'twitter_cookie_lease_', lease_ttl: int = 120, window: int = 900):
+        """
+        :param redis: redis连接
+        :param prefix: 缓存名前缀
+        :param lease_ttl: 租约时长(秒)，超过这个时间没归还的cookie会被回收
+        :param window: 接口访问次数的刷新周期(秒)，接口没有返回刷新时间时使用
+        """
+        self._redis = redis
+        self._prefix = prefix
+        self._lease_ttl = lease_ttl
+        self._window = window
+        self._seed = redis.register_script(_SEED_SCRIPT)
+        self._acquire = redis.register_script(_ACQUIRE_SCRIPT)
+        self._release = redis.register_script(_RELEASE_SCRIPT)
+        self._drop = redis.register_script(_DROP_SCRIPT)
+
+    def _keys(self, api: str) -> list:
+        key = self._prefix + api
+        return [key, f'{key}_leased', f'{key}_state']
+
+    def seed(self, api: str, cookies: [dict], limit: int) -> int:
+        """
+        把数据库里的cookie同步到调度池
+        :param api: 接口名
+        :param cookies: cookie列表，包含id、cto、auth_token
+        :param limit: 接口15分钟内的访问次数
+        :return: 调度池里cookie的数量
+        """
+        args = [limit]
+        for cookie in cookies:
+            args.extend([cookie['id'], json.dumps({**cookie, 'limit': limit, 'limit_reset': 0})])
+        return self._seed(keys=self._keys(api), args=args)
+
+    def acquire(self, api: str, limit: int) -> dict:
+        """
+        获取剩余次数最多的cookie
+        :param api: 接口名
+        :param limit: 接口15分钟内的访问次数，刷新时间过后恢复的次数
+        :return: dict
+        """
+        ok, value = self._acquire(keys=self._keys(api), args=[limit, self._lease_ttl])
+        if ok == 1:
+            return json.loads(value)
+        if value < 0:
+            raise RateLimitError("没有可用的cookie")
+        raise TokenWaitError(f'{api}没有可用的cookie,等待{value}秒后再使用', value)
+
+    def release(self, api: str, cookie_id: int, remaining: int | None = None, reset: int | None = None):
+        """
+        归还cookie，记录接口返回的剩余次数和刷新时间
+        :param api: 接口名
+        :param cookie_id: cookie的id
+        :param remaining: x-rate-limit-remaining，不传则剩余次数减1
+        :param reset: x-rate-limit-reset
+        """
+        args = [cookie_id, '', '', self._window] if remaining is None else [cookie_id, remaining, reset or 0, self._window]
+        self._release(keys=self._keys(api), args=args)
+
+    def drop(self, api: str, cookie_id: int):
+        """
+        从调度池删除cookie
+        :param api: 接口名
+        :param cookie_id: cookie的id
+        """
+        self._drop(keys=self._keys(api), args=[cookie_id])
+
+    def state(self, api: str) -> [dict]:
+        """
+        调度池里每个cookie的剩余次数和刷新时间
+        :param api: 接口名
+        :return: [dict]
+        """
+        return [json.loads(value) for value in self._redis.hvals(self._keys(api)[2])]
+
+    def next_available(self, api: str) -> int:
+        """
+        下一个请求最早可以执行的时间
+        :param api: 接口名
+        :return: unix时间戳，调度池为空时返回-1
+        """
+        ready, leased, _ = self._keys(api)
+        now = current_unixtime()
+        best = self._redis.zrange(ready, 0, 0, withscores=True)
+        if best:
+            return max(now, int(best[0][1]))
+        # 都在使用中，和acquire一样按归还后分值最小的cookie计算
+        scores = [self._score(cookie) for cookie in self.state(api)
+                  if self._redis.zscore(leased, cookie['id']) is not None]
+        if scores:
+            return max(now, min(scores))
+        return -1
+
+    @staticmethod
+    def _score(cookie: dict) -> int:
+        """
+        cookie在可用队列里的分值，和Lua脚本里的score一样
+        """
+        return -cookie['limit'] if cookie['limit'] > 0 else cookie['limit_reset']
+
+    def forecast(self, api: str, limit: int, minutes: int, window: int = 900) -> int:
+        """
+        预测接下来N分钟内还能请求多少次
+        每个cookie在刷新时间之前能用完剩余次数，之后每个刷新周期恢复limit次
+        :param api: 接口名
+        :param limit: 接口每个刷新周期的访问次数
+        :param minutes: 预测的分钟数
+        :param window: 刷新周期(秒)
+        :return: int
+        """
+        now = current_unixtime()
+        end = now + minutes * 60
+        total = 0
+        for cookie in self.state(api):
+            reset = cookie['limit_reset']
+            if reset <= now:
+                # 已经过了刷新时间或者还没用过，下次请求开始新的周期
+                remaining, reset = limit, now + window
+            else:
+                remaining = max(cookie['limit'], 0)
+            total += remaining
+            if reset < end:
+                total += limit * (1 + (end - 1 - reset) // window)
+        return total
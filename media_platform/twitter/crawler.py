@@ -1,28 +1,64 @@
+import asyncio
+import json
 import math
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from redis import Redis
 
 from models.twitter import CookiePool
 from media_platform.twitter.field import CookieIdentity
-from media_platform.twitter.client import TwitterClient
+from media_platform.twitter.client import TwitterClient, AsyncTwitterClient
 from media_platform.twitter import help
-from media_platform.twitter.exception import TokenWaitError, RateLimitError, DataAddError
+from media_platform.twitter.decoder import TweetRecord
+from media_platform.twitter.exception import TokenWaitError, RateLimitError, DataAddError, TokenExpiredError
 from tools.utils import logger
-from tools.time import random_wait
+from tools.time import random_wait, async_random_wait
 from media_platform.twitter.service import UserService, CookieService, ContentServie
 from models.twitter import TweetSummaries
 
 
 class TwitterCrawler():
+    timeline_top_prefix = 'twitter_timeline_top_'  # 用户已同步的最新帖子id
+    timeline_bottom_prefix = 'twitter_timeline_bottom_'  # 全量抓取向下翻页的定位值，中断后从这里继续
+    timeline_gap_prefix = 'twitter_timeline_gap_'  # 增量同步没翻到已同步的帖子时，剩下的部分从这里继续
+    timeline_ex = 30 * 86400
+    guest_user_agent = ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) "
+                        "Chrome/128.0.0.0 Safari/537.3")
+    guest_parallelism = 4  # 同时获取游客cookie的数量
+    guest_batch = 5  # 获取到多少个游客cookie写入一次数据库
+    guest_user_limit = 95  # 一个游客cookie每15分钟能获取用户信息的次数
+    user_info_interval = 3600  # 用户基础信息的更新间隔(秒)
 
     def __init__(self, db: Session, redis: Redis, timeout=30):
         self._user_service = UserService(db)
-        self._cookie_service = CookieService(db)
+        self._cookie_service = CookieService(db, redis)
         self._content_service = ContentServie(db)
+        self._redis = redis
 
-        self._client = TwitterClient(db, redis, timeout)
+        self._client = self._create_client(db, redis, timeout)
+
+    def _create_client(self, db: Session, redis: Redis, timeout: int):
+        return TwitterClient(db, redis, timeout)
+
+    def cookie_budget(self) -> int:
+        """
+        登录用户cookie的数量，用来控制同时请求的数量
+        """
+        return self._client.cookie_budget()
+
+    def forecast(self, api_name: str, minutes: int = 15) -> int:
+        """
+        接下来N分钟内接口还能请求的次数，用来安排同步任务
+        """
+        return self._client.forecast(api_name, minutes)
+
+    def next_available(self, api_name: str) -> int:
+        """
+        接口下一个请求最早可以执行的时间
+        """
+        return self._client.next_available(api_name)
 
     def get_content_by_name(self, name: str, next_course: str | None = None):
         """
@@ -40,43 +76,120 @@ class TwitterCrawler():
 
         return result, next_course
 
-    def sync_content_by_name(self, name: str, page: int = 1):
+    def sync_content_by_name(self, name: str, page: int = 1) -> int:
         """
-        同步指定用户的文章到数据库
+        增量同步指定用户的文章到数据库
+        从最新的一页开始翻页，遇到已经保存过的帖子就停止
         :param name: 用户名
-        :param page: 同步几页数据，默认同步一页
-        :return:
+        :param page: 最多同步几页数据，默认同步一页
+        :return: 请求的页数
         """
-        next_course = None
-        logger.info(f"开始同步{name}的推特内容.")
+        job = TimelineSync(self, self._user_service.get_user_by_name(name), page)
+        while job.pending():
+            if job.requested:
+                random_wait(3, 5)
+            if not job.feed(*self.get_content_by_name(name, job.cursor)):
+                break
+        return job.finish()
 
-        while page > 0:
-            try:
-                logger.debug(f'还要获取{page}页数据')
-                content_list, next_course = self.get_content_by_name(name, next_course)
-                data = []
-                for con in content_list:
-                    data.append(
-                        TweetSummaries(
-                            content=con["content"],
-                            reply_count=con["reply_count"],
-                            retweet_count=con["retweet_count"],
-                            views_count=con["views_count"],
-                            like_count=con["favorite_count"],
-                            x_created_at=con["created_at"],
-                            user_id=con["user_id"],
-                            rest_id=con["id"],
-                        )
-                    )
-                self._content_service.add_all(data)
-                if page > 1:
-                    random_wait(3,5)
-                page -= 1
-            except DataAddError as e:
-                logger.error(f"添加推特列表内容失败:{str(e)}")
-                return ''
-
-        logger.info(f"{name}的推特内容同步完成")
+    def backfill_content_by_name(self, name: str, page: int = 200) -> bool:
+        """
+        全量抓取指定用户的文章，从上次中断的位置继续向下翻页
+        :param name: 用户名
+        :param page: 本次最多抓取几页数据
+        :return: 是否已经抓取到最后一页
+        """
+        job = TimelineBackfill(self, self._user_service.get_user_by_name(name), page)
+        while job.pending():
+            if job.requested:
+                random_wait(3, 5)
+            if not job.feed(*self.get_content_by_name(name, job.cursor)):
+                break
+        return job.finish()
+
+    def _save_content(self, content_list: [TweetRecord]) -> bool:
+        """
+        保存一页推特列表
+        :return: 是否保存成功
+        """
+        try:
+            self._content_service.add_all(self.to_summaries(content_list))
+        except DataAddError as e:
+            logger.error(f"添加推特列表内容失败:{str(e)}")
+            return False
+        return True
+
+    def _get_timeline_top(self, user_id: int) -> int:
+        """
+        用户已同步的最新帖子id，缓存没有时从数据库获取
+        """
+        top = self._redis.get(self.timeline_top_prefix + str(user_id))
+        if top is not None:
+            return int(top)
+        return self._content_service.get_max_rest_id(user_id)
+
+    def _set_timeline_top(self, user_id: int, rest_id: int):
+        if rest_id > 0:
+            self._redis.set(self.timeline_top_prefix + str(user_id), rest_id, ex=self.timeline_ex)
+
+    def _get_timeline_bottom(self, user_id: int) -> str | None:
+        return self._redis.get(self.timeline_bottom_prefix + str(user_id))
+
+    def _set_timeline_bottom(self, user_id: int, cursor: str):
+        self._redis.set(self.timeline_bottom_prefix + str(user_id), cursor, ex=self.timeline_ex)
+
+    def _get_timeline_gap(self, user_id: int) -> dict | None:
+        """
+        增量同步没有完成的部分
+        :return: {"cursor": 继续向下翻页的定位值, "newest": 已经保存的最新帖子id}，没有时返回None
+        """
+        gap = self._redis.get(self.timeline_gap_prefix + str(user_id))
+        return json.loads(gap) if gap else None
+
+    def _set_timeline_gap(self, user_id: int, cursor: str, newest: int):
+        self._redis.set(self.timeline_gap_prefix + str(user_id), json.dumps({"cursor": cursor, "newest": newest}),
+                        ex=self.timeline_ex)
+
+    @staticmethod
+    def _is_overlap(content_list: list, top: int) -> bool:
+        """
+        这一页是否包含已经保存过的帖子，包含则后面的页都已经保存过
+        只比较时间线上的帖子，对话模块里可能是更早的被回复、被引用的帖子，不能用来判断
+        """
+        if not content_list:
+            return True
+        ids = [con.id for con in content_list if not con.in_module]
+        return bool(ids) and min(ids) <= top
+
+    @staticmethod
+    def _is_timeline_end(content_list: list, cursor: str, next_course: str | None) -> bool:
+        """
+        是否已经翻到最后一页：没有数据、没有下一页或者下一页的定位值没变
+        """
+        return not content_list or not cursor or cursor == next_course
+
+    @staticmethod
+    def to_summaries(content_list: [TweetRecord]) -> [TweetSummaries]:
+        """
+        把接口返回的推特列表转换成数据表的数据
+        :param content_list:
+        :return:
+        """
+        data = []
+        for con in content_list:
+            data.append(
+                TweetSummaries(
+                    content=con.content[:280],
+                    reply_count=con.reply_count,
+                    retweet_count=con.retweet_count,
+                    views_count=con.views_count,
+                    like_count=con.favorite_count,
+                    x_created_at=con.created_at,
+                    user_id=con.user_id,
+                    rest_id=con.id,
+                )
+            )
+        return data
 
     def get_detail_content(self, tweet_id: int):
         """
@@ -113,54 +226,90 @@ class TwitterCrawler():
             if int(cursor.split("|")[0]) == 0:
                 break
 
-    def sync_user_info(self):
+    def sync_user_info(self, batch_size: int = 200):
         """
         同步用户的基础信息
-        一个游客cookie请求限制：95/15分钟
+        一个游客cookie请求限制：95/15分钟，所有游客cookie同时请求，每个cookie用完次数就不再使用
+        :param batch_size: 每批更新的用户数量
         :return:
         """
-        cookie_amount = self._cookie_service.get_cookie_amount()
-        user_amount = self._user_service.get_user_amount()
-        user_ceil = math.ceil(user_amount / 95)
-        if cookie_amount < user_ceil:
-            self.sync_cookie_pool(user_ceil - cookie_amount)
-
-        header_data = self._cookie_service.get_cookie_with_header()
-        current_time = datetime.now()
-
-        user_list = self._user_service.get_user_list_latest()
-        for user in user_list:
-            # 检查上次跟新时间，1小时内不再更新
-            updated_at = user.updated_at if user.updated_at else 0
-            if updated_at != 0:
-                time_difference = current_time - updated_at
-                difference = time_difference.total_seconds()
-            else:
-                difference = 3601
-            if difference < 3600:
-                logger.info(f"{user.name}更新没超过1小时，不更新.")
-                continue
+        before = datetime.now() - timedelta(seconds=self.user_info_interval)
+        user_amount = self._user_service.get_stale_user_amount(before)
+        if user_amount == 0:
+            logger.info("没有需要更新基础信息的用户.")
+            return
 
-            logger.info(f"更新{user.name}的基础信息.")
-            try:
-                user_info = self._client.api_user_by_screen_name(user.name, headers=header_data["header"])
+        user_ceil = math.ceil(user_amount / self.guest_user_limit)
+        if self._cookie_service.get_cookie_amount() < user_ceil:
+            self.sync_cookie_pool(user_ceil)
+
+        cookies = self._cookie_service.get_cookies_with_header()
+        if not cookies:
+            raise RateLimitError("没有可用的游客cookie")
+        for cookie in cookies:
+            cookie['remaining'] = self.guest_user_limit
+
+        updated = 0
+        with ThreadPoolExecutor(max_workers=len(cookies)) as executor:
+            for users in self._user_service.iter_stale_users(before, batch_size):
+                plan = self._assign_users(users, cookies)
+                results = executor.map(lambda item: self._refresh_users(*item), plan)
+                updated += self._user_service.update_user_infos([info for result in results for info in result])
+                if sum(len(assigned) for _, assigned in plan) < len(users):
+                    logger.info("游客cookie的访问次数已用完，剩下的用户下次再更新.")
+                    break
 
-                if user_info.rate_limit_reset < 1:
-                    self._cookie_service.set_cookie_invalid([header_data["cookie_id"]])
-                    header_data = self._cookie_service.get_cookie_with_header()
+        # 次数用完的游客cookie设为无效，下次重新获取
+        exhausted = [cookie['cookie_id'] for cookie in cookies if cookie['remaining'] < 1]
+        if exhausted:
+            self._cookie_service.set_cookie_invalid(exhausted)
+        logger.info(f"更新{updated}个用户的基础信息,用完{len(exhausted)}个游客cookie.")
+
+    @staticmethod
+    def _assign_users(users: list, cookies: [dict]) -> list:
+        """
+        把用户分配给剩余次数最多的游客cookie，超过所有cookie剩余次数的用户不分配
+        :return: [(cookie, [(XUser.id, XUser.name)])]
+        """
+        plan = {cookie['cookie_id']: (cookie, []) for cookie in cookies}
+        for user in users:
+            cookie, assigned = max(plan.values(), key=lambda item: item[0]['remaining'] - len(item[1]))
+            if cookie['remaining'] - len(assigned) < 1:
+                break
+            assigned.append(user)
+        return [item for item in plan.values() if item[1]]
 
-                self._user_service.update_user_info(user_info)
-            except RateLimitError as e:
-                logger.warning(f"更新次数太多被限制，等待1分钟后再请求。message:{str(e)}")
-                time.sleep(600)
+    def _refresh_users(self, cookie: dict, users: list) -> list:
+        """
+        用一个游客cookie依次获取用户的基础信息，在线程池里执行，不操作数据库
+        :return: [(XUser.id, UserInfo)]
+        """
+        result = []
+        for uid, name in users:
+            logger.info(f"更新{name}的基础信息.")
+            try:
+                user_info = self._client.api_user_by_screen_name(name, headers=cookie['header'])
+            except (RateLimitError, TokenExpiredError) as e:
+                logger.warning(f"游客cookie不能再使用,cookie_id={cookie['cookie_id']}。message:{str(e)}")
+                cookie['remaining'] = 0
+                break
             except Exception as e:
-                logger.warning(f"更新{user.name}失败, message:{str(e)}")
+                logger.warning(f"更新{name}失败, message:{str(e)}")
+                cookie['remaining'] -= 1
+                continue
 
-    def sync_cookie_pool(self, limit: int = 5):
+            cookie['remaining'] = min(cookie['remaining'] - 1, user_info.limit_remaining)
+            result.append((uid, user_info))
+            if cookie['remaining'] < 1:
+                break
+        return result
+
+    def sync_cookie_pool(self, limit: int = 5, parallelism: int | None = None):
         """
         维护游客的cookie池
         :param limit:维持可用cookie数量
-        :return: void
+        :param parallelism: 同时获取cookie的数量，默认guest_parallelism
+        :return: bool
         """
         self._cookie_service.remove_not_available()
         amount = self._cookie_service.get_available_amount(CookieIdentity.GUEST.value)
@@ -170,25 +319,241 @@ class TwitterCrawler():
         amount = limit - amount
         logger.info(f"开始获取{amount}个游客cookie")
 
+        return asyncio.run(self.mint_cookie_pool(amount, parallelism)) > 0
+
+    async def mint_cookie_pool(self, amount: int, parallelism: int | None = None) -> int:
+        """
+        用一个浏览器并发获取游客cookie，每获取到guest_batch个就写入数据库
+        :param amount: 获取的数量
+        :param parallelism: 同时获取cookie的数量，默认guest_parallelism
+        :return: 写入数据库的数量
+        """
+        start = time.perf_counter()
         new_cookie_pool: [CookiePool] = []
-        try:
-            for i in range(amount):
-                guest_cookie = help.get_guest_cookie(
-                    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) "
-                    "Chrome/128.0.0.0 Safari/537.3")
-
-                new_cookie_pool.append(
-                    CookiePool(
-                        value=guest_cookie['cookies'],
-                        expired=guest_cookie['expired'],
-                        identity_type=CookieIdentity.GUEST.value,
-                        platform='x'
-                    )
+        added = 0
+        failed = 0
+        async for guest_cookie in help.mint_guest_cookies(amount, self.guest_user_agent,
+                                                          parallelism or self.guest_parallelism):
+            if isinstance(guest_cookie, Exception) or not guest_cookie["cookies"].get("gt"):
+                logger.warning(f"获取游客cookie失败.messsage:{str(guest_cookie)}")
+                failed += 1
+                continue
+
+            new_cookie_pool.append(
+                CookiePool(
+                    value=guest_cookie['cookies'],
+                    expired=guest_cookie['expired'],
+                    identity_type=CookieIdentity.GUEST.value,
+                    platform='x'
                 )
+            )
+            if len(new_cookie_pool) >= self.guest_batch:
+                added += self._add_guest_cookies(new_cookie_pool)
+                new_cookie_pool = []
+        added += self._add_guest_cookies(new_cookie_pool)
 
+        cost = time.perf_counter() - start
+        logger.info(f"插入{added}个游客cookie成功,失败{failed}个,耗时{cost:.1f}秒,"
+                    f"速度{added / cost * 60 if cost else 0:.1f}个/分钟")
+        return added
+
+    def _add_guest_cookies(self, new_cookie_pool: [CookiePool]) -> int:
+        if not new_cookie_pool:
+            return 0
+        try:
             self._cookie_service.add_all(new_cookie_pool)
-        except Exception as e:
+        except DataAddError as e:
             logger.error(f"添加游客cookie失败.messsage:{str(e)}")
+            return 0
+        return len(new_cookie_pool)
+
+
+class AsyncTwitterCrawler(TwitterCrawler):
+    """
+    使用AsyncTwitterClient的爬虫，多个用户的内容可以同时请求
+    数据库和Redis的读写在单独的线程里执行，不阻塞事件循环
+    """
+
+    def __init__(self, db: Session, redis: Redis, timeout=30):
+        # 爬虫使用自己的会话，只在读写线程里使用，不和调用方的会话混用
+        self._crawler_db = Session(db.get_bind())
+        super().__init__(self._crawler_db, redis, timeout)
+        # 只有一个线程，多个协程的读写排队执行，会话不会被多个线程同时使用
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix='twitter-crawler-io')
+
+    def _create_client(self, db: Session, redis: Redis, timeout: int):
+        return AsyncTwitterClient(db, redis, timeout)
+
+    async def _run_io(self, func, *args):
+        """
+        在读写线程里执行数据库和Redis的操作
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._io, func, *args)
+
+    async def aclose(self):
+        await self._client.aclose()
+        await self._run_io(self._crawler_db.close)
+        self._io.shutdown(wait=False)
+
+    def _get_user_rest_id(self, name: str) -> int:
+        return self._user_service.get_user_by_name(name).rest_id
+
+    async def get_content_by_name(self, name: str, next_course: str | None = None):
+        rest_id = await self._run_io(self._get_user_rest_id, name)
+        content = await self._client.api_user_tweets(rest_id, next_course=next_course)
+        return content["data"], content['next_cursor']
+
+    async def sync_content_by_name(self, name: str, page: int = 1) -> int:
+        user = await self._run_io(self._user_service.get_user_by_name, name)
+        job = await self._run_io(TimelineSync, self, user, page)
+        while job.pending():
+            if job.requested:
+                await async_random_wait(3, 5)
+            if not await self._run_io(job.feed, *await self.get_content_by_name(name, job.cursor)):
+                break
+        return await self._run_io(job.finish)
+
+    async def backfill_content_by_name(self, name: str, page: int = 200) -> bool:
+        user = await self._run_io(self._user_service.get_user_by_name, name)
+        job = await self._run_io(TimelineBackfill, self, user, page)
+        while job.pending():
+            if job.requested:
+                await async_random_wait(3, 5)
+            if not await self._run_io(job.feed, *await self.get_content_by_name(name, job.cursor)):
+                break
+        return await self._run_io(job.finish)
+
+
+class TimelineSync:
+    """
+    增量同步一个用户时间线的翻页状态，同步和异步的爬虫共用，只有请求的方式不同
+    从最新的一页开始翻页，遇到已经保存过的帖子就停止
+    页数用完还没翻到已同步的帖子时，已同步的最新帖子id(top)不变，记下翻到的位置(gap)，
+    下次先同步新的帖子直到gap记录的最新帖子，再从gap的位置继续翻到top，翻到后才更新top
+    """
+
+    def __init__(self, crawler: TwitterCrawler, user, page: int):
+        """
+        :param crawler: 爬虫
+        :param user: 用户
+        :param page: 最多请求的页数
+        """
+        self._crawler = crawler
+        self._user = user
+        self._page = page
+        self.top = crawler._get_timeline_top(user.rest_id)
+        gap = crawler._get_timeline_gap(user.rest_id)
+        self._gap_cursor = gap["cursor"] if gap else None
+        self.newest = max(self.top, gap["newest"]) if gap else self.top
+        # 先翻到上次已经保存的最新帖子，有gap时是gap记录的最新帖子
+        self._stop_at = self.newest
+        self.cursor = None  # 下一页的定位值
+        self.requested = 0  # 已经请求的页数
+        self._done = False  # 是否已经翻到top
+        logger.info(f"开始同步{user.name}的推特内容.")
+
+    def pending(self) -> bool:
+        """
+        是否还要请求下一页
+        """
+        if self._done or self.requested >= self._page:
+            return False
+        logger.debug(f'还要获取{self._page - self.requested}页数据')
+        return True
+
+    def feed(self, content_list: [TweetRecord], cursor: str) -> bool:
+        """
+        保存请求到的一页数据
+        :return: 是否保存成功
+        """
+        self.requested += 1
+        if not self._crawler._save_content(content_list):
             return False
 
-        logger.info(f"插入{amount}个游客cookie成功.")
+        self.newest = max([self.newest] + [con.id for con in content_list])
+        self.cursor = cursor
+        if not cursor:
+            # 已经到最后一页
+            self._done = True
+        elif self._crawler._is_overlap(content_list, self._stop_at):
+            if self._gap_cursor is not None:
+                # 新的帖子已经同步完，继续上次没翻完的部分
+                self.cursor, self._gap_cursor = self._gap_cursor, None
+                self._stop_at = self.top
+            else:
+                self._done = True
+        return True
+
+    def finish(self) -> int:
+        """
+        翻到top后更新已同步的最新帖子，没翻到时记下翻到的位置，下次继续
+        :return: 请求的页数
+        """
+        user_id = self._user.rest_id
+        if self._done:
+            self._crawler._set_timeline_top(user_id, self.newest)
+            self._crawler._redis.delete(self._crawler.timeline_gap_prefix + str(user_id))
+            logger.info(f"{self._user.name}的推特内容同步完成,请求{self.requested}页")
+        elif self._gap_cursor is not None:
+            # 还没翻到上次记下的位置，保留原来的gap，下次重新从最新的一页开始
+            logger.info(f"{self._user.name}的推特内容没有翻到上次中断的位置,请求{self.requested}页")
+        elif self.cursor is not None:
+            self._crawler._set_timeline_gap(user_id, self.cursor, self.newest)
+            logger.info(f"{self._user.name}的推特内容没有翻到已同步的帖子,请求{self.requested}页,下次继续")
+        return self.requested
+
+
+class TimelineBackfill:
+    """
+    全量抓取一个用户时间线的翻页状态，从上次中断的位置继续向下翻页，同步和异步的爬虫共用
+    """
+
+    def __init__(self, crawler: TwitterCrawler, user, page: int):
+        """
+        :param crawler: 爬虫
+        :param user: 用户
+        :param page: 本次最多请求的页数
+        """
+        self._crawler = crawler
+        self._user = user
+        self._page = page
+        self.cursor = crawler._get_timeline_bottom(user.rest_id)  # 下一页的定位值
+        self.requested = 0  # 已经请求的页数
+        self._end = False  # 是否已经抓取到最后一页
+        logger.info(f"开始全量抓取{user.name}的推特内容.")
+
+    def pending(self) -> bool:
+        """
+        是否还要请求下一页
+        """
+        if self._end or self.requested >= self._page:
+            return False
+        logger.debug(f'还要获取{self._page - self.requested}页数据')
+        return True
+
+    def feed(self, content_list: [TweetRecord], cursor: str) -> bool:
+        """
+        保存请求到的一页数据
+        :return: 是否保存成功
+        """
+        self.requested += 1
+        if not self._crawler._save_content(content_list):
+            return False
+
+        if self._crawler._is_timeline_end(content_list, cursor, self.cursor):
+            self._end = True
+            return True
+        self.cursor = cursor
+        self._crawler._set_timeline_bottom(self._user.rest_id, cursor)
+        return True
+
+    def finish(self) -> bool:
+        """
+        :return: 是否已经抓取到最后一页
+        """
+        if self._end:
+            self._crawler._redis.delete(self._crawler.timeline_bottom_prefix + str(self._user.rest_id))
+            logger.info(f"{self._user.name}的推特内容全量抓取完成")
+        else:
+            logger.info(f"{self._user.name}的推特内容本次抓取结束,下次继续")
+        return self._end
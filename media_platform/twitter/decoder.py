@@ -0,0 +1,244 @@
+"""
+推特GraphQL接口返回数据的解析
+每个返回内容只解析一次json，安装了orjson时使用orjson，字段通过预先编译好的路径获取
+"""
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+from media_platform.twitter.field import UserInfo
+from tools import time
+
+try:
+    import orjson
+
+    def loads(content: bytes | str):
+        return orjson.loads(content)
+except ImportError:
+    import json
+
+    def loads(content: bytes | str):
+        return json.loads(content)
+
+
+_MONTHS = {month: i for i, month in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), 1)}
+_CST = ZoneInfo('Asia/Shanghai')
+
+
+def convert_created_at(date_str: str) -> str:
+    """
+    把推特的时间转换为东八区的'年-月-日 时:分:秒'，结果和tools.time.convert_to_ymd一样
+    推特返回的时间固定是UTC，直接按位置取值比strptime快很多
+    :param date_str: 如 "Tue Apr 17 00:56:17 +0000 2012"
+    :return: str
+    """
+    try:
+        _, month, day, clock, offset, year = date_str.split(' ')
+        if offset != '+0000':
+            raise ValueError(offset)
+        hour, minute, second = clock.split(':')
+        date_obj = datetime(int(year), _MONTHS[month], int(day), int(hour), int(minute), int(second),
+                            tzinfo=timezone.utc)
+    except (ValueError, KeyError):
+        return time.convert_to_ymd(date_str)
+    return date_obj.astimezone(_CST).isoformat(' ', 'seconds')[:19]
+
+
+class Path:
+    """
+    预先编译好的取值路径，如 Path('content.items.0.item') 相当于 data['content']['items'][0]['item']
+    中间任意一级不存在时返回默认值
+    """
+    __slots__ = ('keys',)
+
+    def __init__(self, path: str):
+        self.keys = tuple(int(key) if key.isdigit() else key for key in path.split('.'))
+
+    def __call__(self, data, default=None):
+        try:
+            for key in self.keys:
+                data = data[key]
+        except (KeyError, IndexError, TypeError):
+            return default
+        return data
+
+
+class TweetRecord:
+    """
+    时间线里的一条推特
+    """
+    __slots__ = ('id', 'user_id', 'content', 'created_at', 'favorite_count', 'reply_count', 'retweet_count',
+                 'views_count', 'retweeted_id', 'in_module')
+
+    def __init__(self, id: int, user_id: int, content: str, created_at: str, favorite_count: int, reply_count: int,
+                 retweet_count: int, views_count: int, retweeted_id: int = 0, in_module: bool = False):
+        self.id = id  # 帖子id
+        self.user_id = user_id  # 用户id
+        self.content = content
+        self.created_at = created_at
+        self.favorite_count = favorite_count  # 喜欢数
+        self.reply_count = reply_count  # 评论数
+        self.retweet_count = retweet_count  # 转帖数
+        self.views_count = views_count  # 查看数
+        self.retweeted_id = retweeted_id  # 转发帖原帖id
+        self.in_module = in_module  # 是否来自对话模块，模块里可能是更早的被回复、被引用的帖子
+
+    def __repr__(self):
+        return f'TweetRecord(id={self.id}, user_id={self.user_id})'
+
+
+_USER_TWEETS_INSTRUCTIONS = Path('data.user.result.timeline_v2.timeline.instructions')
+_TWEET_DETAIL_INSTRUCTIONS = Path('data.threaded_conversation_with_injections_v2.instructions')
+_FOLLOWING_INSTRUCTIONS = Path('data.user.result.timeline.timeline.instructions')
+_USER_RESULT = Path('data.user.result')
+
+_ENTRY_TYPE = Path('content.entryType')
+_CURSOR_TYPE = Path('content.cursorType')
+_CURSOR_VALUE = Path('content.value')
+_ITEM_TYPE = Path('content.itemContent.itemType')
+_MODULE_TWEET = Path('content.items.0.item.itemContent.tweet_results.result')
+_ITEM_TWEET = Path('content.itemContent.tweet_results.result')
+_ITEM_USER = Path('content.itemContent.user_results')
+_RETWEETED_ID = Path('retweeted_status_result.result.rest_id')
+_NOTE_TEXT = Path('note_tweet.note_tweet_results.result.text')
+
+
+def _entries(instructions: list | None) -> list:
+    """
+    获取TimelineAddEntries里的数据列表
+    """
+    for instruction in instructions or []:
+        if instruction["type"] == "TimelineAddEntries":
+            return instruction["entries"]
+    return []
+
+
+def _views_count(views: dict) -> int:
+    if views.get("state") == "Enabled":
+        return 0
+    return int(views.get("count", 0))
+
+
+def decode_user_tweets(data: dict, user_id: int) -> ([TweetRecord], str):
+    """
+    解析UserTweets接口的数据
+    :param data: 解析后的json
+    :param user_id: 用户id
+    :return: 推特列表，向下翻页的值
+    """
+    user_id = int(user_id)
+    records = []
+    next_cursor = ''
+    instructions = _USER_TWEETS_INSTRUCTIONS(data)
+    # 只取最后一个TimelineAddEntries
+    entries = []
+    for instruction in instructions or []:
+        if instruction["type"] == "TimelineAddEntries":
+            entries = instruction["entries"]
+
+    for entry in entries:
+        entry_type = _ENTRY_TYPE(entry)
+        if entry_type == "TimelineTimelineModule":  # 有多个数据
+            # 忽略推荐关注人的数据
+            if entry["entryId"].startswith("who-to-follow"):
+                continue
+            result = _MODULE_TWEET(entry)
+            if result['__typename'] != 'Tweet':
+                result = result['tweet']
+            legacy = result["legacy"]
+            records.append(TweetRecord(
+                id=int(result["rest_id"]),
+                user_id=user_id,
+                content=legacy["full_text"],
+                created_at=convert_created_at(legacy["created_at"]),
+                favorite_count=legacy["favorite_count"],
+                reply_count=legacy["reply_count"],
+                retweet_count=legacy["retweet_count"],
+                views_count=_views_count(result["views"]),
+                in_module=True,
+            ))
+        elif entry_type == "TimelineTimelineItem":  # 转帖
+            result = _ITEM_TWEET(entry)
+            if 'core' not in result:
+                continue
+            legacy = result["legacy"]
+            # 获取转发帖子的id
+            retweeted_id = legacy.get("quoted_status_id_str") or _RETWEETED_ID(legacy, 0)
+            records.append(TweetRecord(
+                id=int(legacy["id_str"]),
+                user_id=user_id,
+                content=legacy["full_text"],
+                created_at=convert_created_at(legacy["created_at"]),
+                favorite_count=legacy["favorite_count"],
+                reply_count=legacy["reply_count"],
+                retweet_count=legacy["retweet_count"],
+                views_count=_views_count(result["views"]),
+                retweeted_id=int(retweeted_id),
+            ))
+        elif entry_type == "TimelineTimelineCursor" and _CURSOR_TYPE(entry) == "Bottom":
+            next_cursor = _CURSOR_VALUE(entry)
+
+    return records, next_cursor
+
+
+def _user_info(result: dict, limit_remaining: int = 0, rate_limit_reset: int = 0) -> UserInfo:
+    legacy = result["legacy"]
+    return UserInfo(
+        rest_id=result["rest_id"],
+        name=legacy["screen_name"],
+        followers_count=legacy["followers_count"],
+        friends_count=legacy["friends_count"],
+        statuses_count=legacy["statuses_count"],
+        description=legacy["description"],
+        x_created_at=convert_created_at(legacy["created_at"]),
+        full_name=legacy["name"],
+        limit_remaining=limit_remaining,
+        rate_limit_reset=rate_limit_reset,
+    )
+
+
+def decode_user(data: dict, limit_remaining: int, rate_limit_reset: int) -> UserInfo:
+    """
+    解析UserByScreenName接口的数据
+    :param data: 解析后的json
+    :param limit_remaining: x-rate-limit-remaining
+    :param rate_limit_reset: x-rate-limit-reset
+    :return: UserInfo
+    """
+    return _user_info(_USER_RESULT(data), limit_remaining, rate_limit_reset)
+
+
+def decode_tweet_detail(data: dict) -> str:
+    """
+    解析TweetDetail接口的数据，获取帖子的原文
+    :param data: 解析后的json
+    :return: str
+    """
+    text = ''
+    for entry in _entries(_TWEET_DETAIL_INSTRUCTIONS(data)):
+        if _ENTRY_TYPE(entry) != "TimelineTimelineItem" or _ITEM_TYPE(entry) != "TimelineTweet":
+            continue
+        result = _ITEM_TWEET(entry)
+        text = _NOTE_TEXT(result) or result['legacy']['full_text']
+    return text
+
+
+def decode_following(data: dict) -> ([UserInfo], str):
+    """
+    解析Following接口的数据
+    :param data: 解析后的json
+    :return: 用户列表，向下翻页的值
+    """
+    user_list = []
+    bottom = ""
+    for entry in _entries(_FOLLOWING_INSTRUCTIONS(data)):
+        entry_type = _ENTRY_TYPE(entry)
+        if entry_type == "TimelineTimelineCursor" and _CURSOR_TYPE(entry) == "Bottom":
+            bottom = _CURSOR_VALUE(entry)
+        if entry_type != "TimelineTimelineItem":
+            continue
+        user_results = _ITEM_USER(entry)
+        if not user_results:
+            continue
+        user_list.append(_user_info(user_results["result"]))
+    return user_list, bottom
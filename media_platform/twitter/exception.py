@@ -11,7 +11,10 @@ class TokenWaitError(Exception):
     """
     Token访问受限，等待刷新时间后再访问
     """
-    pass
+
+    def __init__(self, message: str = '', wait: int = 0):
+        super().__init__(message)
+        self.wait = wait  # 距离有cookie可用还要等待的秒数
 
 
 class TokenExpiredError(Exception):
@@ -1,5 +1,11 @@
-from playwright.sync_api import sync_playwright
+import asyncio
 import re
+from playwright.sync_api import sync_playwright
+from playwright.async_api import async_playwright
+
+# 游客cookie需要保存的字段
+guest_cookie_fields = ["guest_id", "gt", "guest_id_marketing"]
+
 
 def get_headers():
     return {
@@ -23,7 +29,6 @@ def get_guest_cookie(user_agent: str):
     :param user_agent: header的浏览器代理设置，不设置会获取不到
     :return:
     """
-    cookies = {}
     with sync_playwright() as p:
         browser = p.chromium.launch(timeout=15000)
         context = browser.new_context(
@@ -34,19 +39,63 @@ def get_guest_cookie(user_agent: str):
         page = context.new_page()
         # 访问 Twitter 页面
         page.goto("https://x.com")
-        # 获取指定的cookie值
-        fields = ["guest_id", "gt", "guest_id_marketing"]
-        for val in page.context.cookies():
-            if val["name"] in fields:
-                # 转换过期时间
-                expired = int(val["expires"])
-                # 只保留domain为x.com
-                if val["domain"] != ".x.com":
-                    continue
-                cookies.update({
-                    val["name"]: val["value"]
-                })
+        result = _parse_guest_cookie(page.context.cookies())
         browser.close()
+    return result
+
+
+async def mint_guest_cookies(amount: int, user_agent: str, parallelism: int = 4):
+    """
+    用同一个浏览器并发创建独立的context获取游客cookie，获取到一个返回一个
+    :param amount: 获取的数量
+    :param user_agent: header的浏览器代理设置，不设置会获取不到
+    :param parallelism: 同时打开的context数量
+    :return: 异步生成器，每个元素和get_guest_cookie的返回值一样，获取失败的返回异常
+    """
+    semaphore = asyncio.Semaphore(max(parallelism, 1))
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(timeout=15000)
+
+        async def mint():
+            async with semaphore:
+                # 每个context的cookie互相隔离，相当于一个新的游客
+                context = await browser.new_context(user_agent=user_agent)
+                try:
+                    page = await context.new_page()
+                    await page.goto("https://x.com")
+                    return _parse_guest_cookie(await context.cookies())
+                finally:
+                    await context.close()
+
+        tasks = [asyncio.create_task(mint()) for _ in range(amount)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                try:
+                    yield await task
+                except Exception as e:
+                    yield e
+        finally:
+            for task in tasks:
+                task.cancel()
+            await browser.close()
+
+
+def _parse_guest_cookie(browser_cookies: list) -> dict:
+    """
+    从浏览器的cookie里取出游客cookie
+    :param browser_cookies: context.cookies()的返回值
+    :return: {"cookies": dict, "expired": 过期时间}
+    """
+    cookies = {}
+    expired = 0
+    for val in browser_cookies:
+        # 只保留domain为x.com
+        if val["name"] not in guest_cookie_fields or val["domain"] != ".x.com":
+            continue
+        cookies[val["name"]] = val["value"]
+        # 转换过期时间
+        expired = int(val["expires"])
     return {"cookies": cookies, "expired": expired}
 
 
@@ -4,11 +4,13 @@
 from datetime import datetime
 
 from sqlalchemy.orm import Session
-from sqlalchemy import update, delete
+from redis import Redis
+from sqlalchemy import update, delete, func, select, or_
 
-from models.twitter import CookiePool, XUser, TweetSummaries, WatchXUser
-from tools.time import current_unixtime
-from media_platform.twitter.field import UserInfo
+from models.twitter import CookiePool, XUser, TweetSummaries, TweetRaw, WatchXUser
+from tools.time import current_unixtime, current_time
+from tools.db import upsert
+from media_platform.twitter.field import UserInfo, CookieIdentity
 from media_platform.twitter.exception import NoData, DataAddError
 from tools.utils import logger
 from media_platform.twitter.help import get_header_by_guest
@@ -42,6 +44,23 @@ class UserService():
         else:
             raise NoData(f"没有找到要跟新的数据,{user_info.name}")
 
+    def update_user_infos(self, user_infos: [(int, UserInfo)]) -> int:
+        """
+        按主键批量更新用户数据，一批只执行一次UPDATE
+        :param user_infos: [(XUser.id, UserInfo)]
+        :return: 更新的数量
+        """
+        if not user_infos:
+            return 0
+        now = current_time()
+        rows = [
+            {"id": uid, **info.dict(exclude={"limit_remaining", "rate_limit_reset"}), "updated_at": now}
+            for uid, info in user_infos
+        ]
+        self._db.execute(update(XUser), rows)
+        self._db.commit()
+        return len(rows)
+
     def set_full(self, uid):
         stmt = update(XUser).where(XUser.id == uid).values(full=1)
         self._db.execute(stmt)
@@ -76,6 +95,30 @@ class UserService():
         """
         return self._db.query(XUser).order_by(XUser.id.desc()).all()
 
+    def get_stale_user_amount(self, before: datetime) -> int:
+        """
+        获取在指定时间之后没有更新过的用户数量
+        :param before: 更新时间早于这个时间的用户需要更新
+        :return: int
+        """
+        return self._db.query(XUser).where(or_(XUser.updated_at.is_(None), XUser.updated_at < before)).count()
+
+    def iter_stale_users(self, before: datetime, batch_size: int = 500):
+        """
+        分批获取在指定时间之后没有更新过的用户，按id从大到小排序
+        使用单独的会话流式读取，更新数据时提交事务不会影响读取
+        :param before: 更新时间早于这个时间的用户需要更新
+        :param batch_size: 每批的数量
+        :return: 生成器，每个元素为[(XUser.id, XUser.name)]
+        """
+        stmt = (select(XUser.id, XUser.name)
+                .where(or_(XUser.updated_at.is_(None), XUser.updated_at < before))
+                .order_by(XUser.id.desc())
+                .execution_options(yield_per=batch_size))
+        with Session(self._db.get_bind()) as session:
+            for partition in session.execute(stmt).partitions():
+                yield [(row.id, row.name) for row in partition]
+
     def get_user_monitored_list(self):
         """
         获取需要监控内容的用户列表
@@ -120,9 +163,23 @@ class UserService():
 
 
 class CookieService():
+    # 登录用户cookie状态的版本号，保存在Redis里，登录用户cookie有变更时加1，各个进程的cookie列表缓存根据它判断是否失效
+    roster_version_key = 'twitter_cookie_roster_version'
 
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, redis: Redis | None = None):
+        """
+        :param redis: 不传时修改cookie状态不更新版本号
+        """
         self._db = db
+        self._redis = redis
+
+    @classmethod
+    def get_roster_version(cls, redis: Redis) -> int:
+        """
+        登录用户cookie状态的版本号
+        """
+        version = redis.get(cls.roster_version_key)
+        return int(version) if version else 0
 
     def get_cookie_by_id(self, id: int):
         """
@@ -164,6 +221,17 @@ class CookieService():
             'cookie_id': cookie.id
         }
 
+    def get_cookies_with_header(self, guest=1):
+        """
+        获取所有可用的cookie并设置好cookie头
+        :param guest: 1-获取游客，2-获取登录用户
+        :return: [dict]
+        """
+        now = current_unixtime()
+        cookies = self._db.query(CookiePool).where(CookiePool.identity_type == guest, CookiePool.expired >= now,
+                                                   CookiePool.amount > 0, CookiePool.use_status == 1, CookiePool.platform == 'x').all()
+        return [{'header': get_header_by_guest(cookie.value), 'cookie_id': cookie.id} for cookie in cookies]
+
     def get_cookie_amount(self, guest=1):
         """
         获取cookie可用的数量
@@ -185,9 +253,14 @@ class CookieService():
         :param ids:
         :return:
         """
+        users = self._db.scalars(select(CookiePool.id).where(CookiePool.id.in_(ids), CookiePool.platform == 'x',
+                                                             CookiePool.identity_type == CookieIdentity.USER.value)).all()
         stmt = update(CookiePool).values(use_status=2).where(CookiePool.id.in_(ids), CookiePool.platform == 'x')
         self._db.execute(stmt)
         self._db.commit()
+        # 游客cookie不在登录用户cookie列表里，不用更新版本号
+        if users and self._redis is not None:
+            self._redis.incr(self.roster_version_key)
 
     def add_all(self, data: [CookiePool]):
         """
@@ -199,6 +272,7 @@ class CookieService():
             self._db.add_all(data)
             self._db.commit()
         except Exception as e:
+            self._db.rollback()
             logger.error(f"添加cookie失败")
             raise DataAddError("cookie")
 
@@ -216,6 +290,9 @@ class CookieService():
 
 
 class ContentServie():
+    # 数据存在时更新的字段
+    update_fields = ["like_count", "reply_count", "views_count", "retweet_count", "x_created_at"]
+
     def __init__(self, db: Session):
         self._db = db
 
@@ -233,23 +310,51 @@ class ContentServie():
     def add_all(self, data: [TweetSummaries]):
         """
         批量添加特推列表数据，如果数据存在则更新喜欢等数据
+        按rest_id一次批量写入，不再逐条查询
         :param data:
-        :return:
+        :return: 写入的数据条数
         """
+        rows = {}
         for val in data:
-            try:
-                info = self.get_info_by_id(val.rest_id)
-                info.like_count = val.like_count
-                info.reply_count = val.reply_count
-                info.views_count = val.views_count
-                info.retweet_count = val.retweet_count
-                info.x_created_at = val.x_created_at
-            except NoData:
-                self._db.add(val)
-            except Exception as e:
-                logger.error(f"添加内容失败: message:{str(e)}")
-                raise DataAddError("summaries add_all")
-        self._db.commit()
+            rows[val.rest_id] = {
+                "content": val.content,
+                "reply_count": val.reply_count,
+                "retweet_count": val.retweet_count,
+                "like_count": val.like_count,
+                "views_count": val.views_count,
+                "x_created_at": val.x_created_at,
+                "created_at": val.created_at or current_time(),
+                "rest_id": val.rest_id,
+                "user_id": val.user_id,
+            }
+        try:
+            amount = upsert(self._db, TweetSummaries, list(rows.values()), ["rest_id"], self.update_fields)
+            self._db.commit()
+        except Exception as e:
+            self._db.rollback()
+            logger.error(f"添加内容失败: message:{str(e)}")
+            raise DataAddError("summaries add_all")
+        return amount
+
+    def add_raw_all(self, raws: dict) -> int:
+        """
+        批量保存推特的原文，tweet_summaries里没有的帖子不保存
+        :param raws: {rest_id: 原文}
+        :return: 写入的数据条数
+        """
+        if not raws:
+            return 0
+        ids = dict(self._db.query(TweetSummaries.rest_id, TweetSummaries.id)
+                   .where(TweetSummaries.rest_id.in_(list(raws))).all())
+        rows = [{"content_id": ids[rest_id], "raw_content": text} for rest_id, text in raws.items() if rest_id in ids]
+        try:
+            amount = upsert(self._db, TweetRaw, rows, ["content_id"], ["raw_content"])
+            self._db.commit()
+        except Exception as e:
+            self._db.rollback()
+            logger.error(f"添加原文失败: message:{str(e)}")
+            raise DataAddError("raw add_all")
+        return amount
 
     def get_latest_by_user_id(self, user_id: int, date: datetime | None = None, limit: int = 3):
         """
@@ -267,6 +372,15 @@ class ContentServie():
 
         return query.order_by(TweetSummaries.x_created_at.desc()).limit(limit).all()
 
+    def get_max_rest_id(self, user_id: int) -> int:
+        """
+        获取指定用户已经保存的最新帖子id
+        :param user_id: twitter的用户id
+        :return: int，没有数据返回0
+        """
+        rest_id = self._db.query(func.max(TweetSummaries.rest_id)).where(TweetSummaries.user_id == user_id).scalar()
+        return rest_id or 0
+
     def get_amount_by_user_id(self, user_id: int):
         """
         获取指定用户的内容数量
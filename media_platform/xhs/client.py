@@ -3,67 +3,79 @@ import json
 import re
 import time
 import random
+from abc import abstractmethod
 from DrissionPage import ChromiumPage
+from DrissionPage.errors import BaseError
 from base.base_crawler import AbstractApiClient
 from urllib.parse import urlencode, quote
 
+from config import settings
+from tools.pacer import AdaptivePacer
 from tools.utils import logger
 from tools.time import convert_timestamp_to_date,random_wait
-from media_platform.xhs.help import sign, convert_str_cookie_to_dict, convert_cookies, chinese_to_number, get_search_id
+from media_platform.xhs.help import chinese_to_number, get_search_id
+from media_platform.xhs.sign_context import SignContext
+from media_platform.xhs.tab_pool import TabPool
 from media_platform.xhs.field import SearchSortType, SearchNoteType
-from media_platform.xhs.exception import IPBlockError, DataFetchError
+from media_platform.xhs.exception import IPBlockError, DataFetchError, HTTPStatusError, LoginError
 from tools.message import send_msg_error
 
-class XHSClient(AbstractApiClient):
-
-    def __init__(self, page: ChromiumPage, cookie: dict):
-        self._domain = "https://www.xiaohongshu.com"
-        self._host = "https://edith.xiaohongshu.com"
-        self._header = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36',
-            "Origin": "https://www.xiaohongshu.com",
-            "Referer": "https://www.xiaohongshu.com",
-            "Content-Type": "application/json;charset=UTF-8"
-        }
-        self.IP_ERROR_STR = "网络连接异常，请检查网络设置或重启试试"
-        self.IP_ERROR_CODE = 300012
-        self.NOTE_ABNORMAL_STR = "笔记状态异常，请稍后查看"
-        self.NOTE_ABNORMAL_CODE = -510001
-
-        logger.debug("[xhs.XHSClient.__init__] 打开小红书主页")
-        self._browser = page
-        self._tab = self._browser.latest_tab
-        self._tab.get(self._domain)
-        login_try = 5
-
-        logger.debug("[xhs.XHSClient.__init__] 检查登录状态")
-        while not self.login_status() and login_try > 0:
-            self.login_cookie(cookie)
-            login_try -= 1
-            logger.info(f"[xhs.XHSClient.__init__] 尝试登录,剩余次数：{login_try}")
-            random_wait(2,5)
-        if login_try <= 0:
-            logger.error("[xhs.XHSClient.__init__] 尝试登录5次失败，退出")
-            send_msg_error("[xhs.XHSClient.__init__] 尝试登录5次失败，退出")
-            exit()
+class XHSApiClient(AbstractApiClient):
+    """
+    小红书接口的客户端，接口请求在本进程发出，签名和浏览器打开页面由子类实现：
+    XHSClient使用本地启动的浏览器，RemoteXHSClient使用守护进程里已经登录的浏览器
+    """
+    NOTE_DETAIL_URI = "/api/sns/web/v1/feed"
+    _domain = "https://www.xiaohongshu.com"
+    _host = "https://edith.xiaohongshu.com"
+    _header = {
+        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36',
+        "Origin": "https://www.xiaohongshu.com",
+        "Referer": "https://www.xiaohongshu.com",
+        "Content-Type": "application/json;charset=UTF-8"
+    }
+    IP_ERROR_STR = "网络连接异常，请检查网络设置或重启试试"
+    IP_ERROR_CODE = 300012
+    NOTE_ABNORMAL_STR = "笔记状态异常，请稍后查看"
+    NOTE_ABNORMAL_CODE = -510001
+    # 接口请求的限速，根据请求结果调整频率，为None时不限速
+    pacer: AdaptivePacer | None = None
+
+    def __init__(self, signer: SignContext):
+        """
+        :param signer: 生成接口签名头的上下文
+        """
+        self._signer = signer
 
     def request(self, method, url, **kwargs):
         """
         GET、POST统一请求方法，根据http状态码会抛出异常
+        设置了pacer时请求前按pacer的频率等待，状态码461时降低频率，没有pacer时状态码461暂停30-60秒
         :param method: GET或POST方法
         :param url: 请求url
         :param kwargs: 参数
-        :return:
+        :return: 状态码为200的response
+        :raise IPBlockError: 状态码461，请求太频繁
+        :raise HTTPStatusError: 其他不是200的状态码
         """
-        response = requests.request(method, url, **kwargs)
+        if self.pacer is not None:
+            self.pacer.wait()
+        with self._signer.timer('request'):
+            response = requests.request(method, url, **kwargs)
+        self._signer.on_response(response)
 
-        if response.status_code == 200 or response.status_code == 200:
+        if response.status_code == 200:
             return response
-        if response.status_code == 461:# 接口请求失败，有可能是请求次数过多，暂停几秒后再继续请求
-            logger.info(f"[xhs.XHSClient.request]状态码：461，暂停30-60秒后再请求")
-            random_wait(30,60)
+        if response.status_code == 461:  # 请求次数过多被限制
+            logger.warning(f"[xhs.XHSClient.request]状态码：461，请求太频繁")
+            self._report(False)
+            if self.pacer is None:
+                # 没有pacer控制频率时和原来一样，暂停30-60秒后再请求
+                random_wait(30, 60)
+            raise IPBlockError(self.IP_ERROR_STR)
 
         logger.warning(f"[xhs.XHSClient.request]请求错误:{response.content},状态码：{response.status_code}")
+        raise HTTPStatusError(response.status_code, response.text[:200])
 
     def _pre_headers(self, url: str, data=None):
         """
@@ -71,32 +83,62 @@ class XHSClient(AbstractApiClient):
         url: 请求的url的地址
         data:请求参数
         """
-        local_storage = self._tab.local_storage()
-        if data:
-            encrypt_params = self._tab.run_js('return window._webmsxyw(arguments[0],arguments[1]);', url, data)
-        else:
-            encrypt_params = self._tab.run_js(f"window._webmsxyw('{url}','{data}')", as_expr=True)
-
-        cookie_str, cookie_dict = convert_cookies(self._tab.cookies())
-        _cookie_dict = convert_str_cookie_to_dict(cookie_str)
-
-        signs = sign(
-            a1=_cookie_dict['a1'],
-            b1=local_storage.get("b1", ""),
-            x_s=encrypt_params.get("X-s", ""),
-            x_t=str(encrypt_params.get("X-t", ""))
-        )
-
-        headers = {
-            "X-S": signs["x-s"],
-            "X-T": signs["x-t"],
-            "x-S-Common": signs["x-s-common"],
-            "X-B3-Traceid": signs["x-b3-traceid"],
-            'Cookie': cookie_str
-        }
+        headers = self._signer.headers(url, data)
         headers.update(self._header)
         return headers
 
+    def _report(self, success: bool):
+        """
+        把请求结果告诉pacer：成功时提高频率，被限制时降低频率
+        """
+        if self.pacer is None:
+            return
+        if success:
+            self.pacer.success()
+        else:
+            self.pacer.blocked()
+
+    def sign_batch(self, items: [(str, dict | None)]) -> [dict]:
+        """
+        批量生成请求头的参数签名，多个请求只执行一次js
+        :param items: [(请求的url的地址, 请求参数)]
+        :return: [dict]，顺序和items一样
+        """
+        headers_list = self._signer.headers_batch(items)
+        for headers in headers_list:
+            headers.update(self._header)
+        return headers_list
+
+    def sign_note_details(self, notes: [(str, str, str)]) -> [dict]:
+        """
+        批量生成笔记详情接口的请求头，传给api_get_note_detail使用
+        :param notes: [(笔记ID, xsec_token, xsec_source)]
+        :return: [dict]
+        """
+        return self.sign_batch([(self.NOTE_DETAIL_URI, self._note_detail_params(*note)) for note in notes])
+
+    def sign_stats(self) -> dict:
+        """
+        签名和网络请求各阶段的次数和耗时
+        """
+        stats = self._signer.stats()
+        if self.pacer is not None:
+            stats['pacer'] = self.pacer.stats()
+        return stats
+
+    def set_cookies(self, cookies: [dict]):
+        """
+        设置浏览器的cookie
+        :param cookies: [{"name": 名称, "value": 值, "domain": 域名, "path": 路径}]
+        """
+        self._signer.set_cookies(cookies)
+
+    @abstractmethod
+    def close(self):
+        """
+        关闭浏览器或者和浏览器的连接
+        """
+
     def get(self, url: str, headers: dict | None = None):
         """
         GET请求
@@ -106,16 +148,31 @@ class XHSClient(AbstractApiClient):
         """
         return self.request(method="GET", url=f"{url}", headers=headers)
 
+    @abstractmethod
     def login_cookie(self, cookie: dict):
         """
-        使用cookie登录
-        :cookie_str web_session的值
+        在浏览器里设置登录的cookie
+        :param cookie: 登录用的cookie
         """
-        logger.debug("[xhs.XHSClient.login_cookie]开始设置登录的cookie")
-        self._tab.set.cookies(f'a1={cookie["a1"]}; path=/; domain=.xiaohongshu.com;')
-        self._tab.set.cookies(f'web_session={cookie["web_session"]}; path=/; domain=.xiaohongshu.com;')
-        random_wait(1,3)
-        logger.debug("[xhs.XHSClient.login_cookie]设置cookie完成")
+
+    def login(self, cookie: dict, max_try: int = 5):
+        """
+        没有登录时设置登录的cookie，直到登录状态正常
+        :param cookie: 登录用的cookie
+        :param max_try: 最多尝试的次数
+        """
+        login_try = max_try
+
+        logger.debug("[xhs.XHSApiClient.login] 检查登录状态")
+        while not self.login_status() and login_try > 0:
+            self.login_cookie(cookie)
+            login_try -= 1
+            logger.info(f"[xhs.XHSApiClient.login] 尝试登录,剩余次数：{login_try}")
+            random_wait(2,5)
+        if login_try <= 0 and not self.login_status():
+            logger.error(f"[xhs.XHSApiClient.login] 尝试登录{max_try}次失败，退出")
+            send_msg_error(f"[xhs.XHSApiClient.login] 尝试登录{max_try}次失败，退出")
+            raise LoginError(f"尝试登录{max_try}次失败")
 
     def login_status(self) -> bool:
         """
@@ -139,22 +196,28 @@ class XHSClient(AbstractApiClient):
         host = self._host if domain == 'api' else self._domain
         headers = self._pre_headers(url)
 
-        return self.request(method="GET", url=f"{host}{url}", headers=headers)
+        response = self.request(method="GET", url=f"{host}{url}", headers=headers)
+        self._report(True)
+        return response
 
-    def post_with_api(self, url: str, params: dict | None = None):
+    def post_with_api(self, url: str, params: dict | None = None, headers: dict | None = None):
         """
         GET请求
         :url: 请求地址
         :params: 参数
+        :headers: 已经签名的请求头，不传则重新签名
         :return:
         """
-        headers = self._pre_headers(url, params)
+        if headers is None:
+            headers = self._pre_headers(url, params)
         json_str = json.dumps(params, separators=(',', ':'), ensure_ascii=False)
         response = self.request(method="POST", url=f"{self._host}{url}", data=json_str, headers=headers)
         data = response.json()
         if data["success"]:
+            self._report(True)
             return data.get("data", data.get("success", {}))
         elif data["code"] == self.IP_ERROR_CODE:
+            self._report(False)
             raise IPBlockError(self.IP_ERROR_STR)
         else:
             raise DataFetchError(data.get("msg", None))
@@ -169,7 +232,7 @@ class XHSClient(AbstractApiClient):
         url = f"/user/profile/{user_id}"
 
         if guest:
-            response = self.get(f'{self._domain}url', headers=self._header)
+            response = self.get(f'{self._domain}{url}', headers=self._header)
         else:
             response = self.get_with_api(url, 'domain')
 
@@ -221,6 +284,14 @@ class XHSClient(AbstractApiClient):
 
         return self.get_with_api(uri + '?' + urlencode(params))
 
+    @abstractmethod
+    def browser_page_state(self, url: str):
+        """
+        在浏览器里打开页面，获取页面的window.__INITIAL_STATE__
+        :param url: 页面地址
+        :return: dict
+        """
+
     def browser_get_note_detail(self, note_id: str, xsec_source: str, xsec_token: str | None = None):
         """
             获取笔记详情API, 笔记内容在window.__INITIAL_STATE__变量里
@@ -232,16 +303,12 @@ class XHSClient(AbstractApiClient):
             url = f"{self._domain}/explore/{note_id}"
         else:
             url = f"{self._domain}/explore/{note_id}?xsec_token={xsec_token}&xsec_source={xsec_source}&source=web_explore_feed"
-        tab = self._browser.new_tab()
-        tab.get(url)
-        data_dict = tab.run_js('return window.__INITIAL_STATE__')
+        data_dict = self.browser_page_state(url)
         try:
             note = data_dict['note']['noteDetailMap'][note_id]['note']
-        except KeyError:
-            self._browser.close_tabs(tab.tab_id)
+        except (KeyError, TypeError):
             raise DataFetchError("获取笔记错误")
 
-        self._browser.close_tabs(tab.tab_id)
         return {
             "title": note['title'],
             "desc": note['desc'],
@@ -266,71 +333,13 @@ class XHSClient(AbstractApiClient):
         }
         return self.get_with_api(uri + '?' + urlencode(params))
 
+    @abstractmethod
     def browser_get_note_by_search(self, keyword: str, amount: int):
         """
-        根据关键词搜索笔记
+        在浏览器里打开搜索页面，下拉amount次，获取搜索到的笔记
         :keyword: 关键词参数
         :amount: 下拉次数
         """
-        # 填写关键词搜索
-        keyword = quote(keyword)
-        url = f"https://www.xiaohongshu.com/search_result?keyword={keyword}&source=web_explore_feed"
-        self._tab.get(url)
-        notes = []
-        for num in range(amount):
-            data = self._get_info_by_search()
-            notes.extend(data)
-
-            random_secs = random.uniform(2,8)
-            logger.debug(f"[xhs.XHSClient.browser_get_note_by_search] 下拉第{num + 1}次,休息{random_secs}秒")
-            time.sleep(random_secs)
-            self._tab.scroll.to_bottom()
-        return notes
-
-    def _get_info_by_search(self):
-        data = []
-        # 定位包含笔记信息的sections
-        container = self._tab.ele('.feeds-page')
-        sections = container.eles('.note-item')
-        for section in sections:
-            # 定位标题、作者、点赞
-            try:
-                # 定位文章id
-                note_link = section.ele('.cover ld mask', timeout=0).link
-                link_match = re.search('/search_result/([^?]+)', note_link)
-                if link_match:
-                    note_id = link_match.group(1)
-                else:
-                    continue
-
-                # 定位标题、作者、点赞
-                footer = section.ele('.footer', timeout=0)
-                # 定位标题
-                title = footer.ele('.title', timeout=0).text
-                # 定位作者
-                author_wrapper = footer.ele('.author-wrapper')
-                nickname = author_wrapper.ele('.author').text
-                author_link = author_wrapper.ele('tag:a', timeout=0).link
-                # 提取作者id
-                uid_match = re.search(r"/profile/([^?]+)", author_link)
-                if uid_match:
-                    uid = uid_match.group(1)
-                else:
-                    continue
-
-                # 定位点赞
-                like = footer.ele('.like-wrapper like-active').text
-                data.append({
-                    "title": title,
-                    "nickname": nickname,
-                    "note_id": note_id,
-                    "note_link": note_link,
-                    "uid": uid,
-                    "like": like,
-                })
-            except Exception as e:
-                continue
-        return data
 
     def api_get_note_by_keyword(
             self, keyword: str,
@@ -361,31 +370,186 @@ class XHSClient(AbstractApiClient):
             try:
                 return self.post_with_api(uri, params)
             except IPBlockError as e:
+                # request里已经按pacer或者暂停30-60秒控制了重试的间隔
+                logger.error(f"[xhs.client.get_note_by_keyword]网络请求异常:{e}.尝试第{try_count}次重新获取")
+                try_count += 1
+            except HTTPStatusError as e:
+                # 只有服务端的临时错误重试
+                if e.status_code < 500:
+                    raise
                 logger.error(f"[xhs.client.get_note_by_keyword]网络请求异常:{e}.尝试第{try_count}次重新获取")
                 try_count += 1
                 time.sleep(2)
 
         raise DataFetchError("获取数据失败")
 
-    def api_get_note_detail(self, note_id: str, xsec_token: str, xsec_source: str):
+    def api_get_note_detail(self, note_id: str, xsec_token: str, xsec_source: str, headers: dict | None = None):
         """
         通过接口获取笔记详情API
         :note_id:笔记ID
         :xsec_token: 搜索关键字之后返回的比较列表中返回的token
         :xsec_source: 渠道来源
+        :headers: sign_note_details预先签名的请求头
         """
-        params = {
+        params = self._note_detail_params(note_id, xsec_token, xsec_source)
+        res = self.post_with_api(self.NOTE_DETAIL_URI, params, headers)
+
+        if res.get('items'):
+            return res["items"][0]["note_card"]
+
+        # 爬取太频繁会出现没有数据返回的情况
+        return {}
+
+    @staticmethod
+    def _note_detail_params(note_id: str, xsec_token: str, xsec_source: str) -> dict:
+        return {
             "source_note_id": note_id,
             "image_formats": ["jpg", "webp", "avif"],
             "extra": {"need_body_topic": 1},
             "xsec_source": xsec_source,
             "xsec_token": xsec_token
         }
-        uri = "/api/sns/web/v1/feed"
-        res = self.post_with_api(uri, params)
 
-        if res.get('items'):
-            return res["items"][0]["note_card"]
 
-        # 爬取太频繁会出现没有数据返回的情况
-        return {}
+class XHSClient(XHSApiClient):
+    """
+    使用本地浏览器的客户端，启动时用cookie登录
+    """
+    # 详情页屏蔽的请求：图片、字体、视频，笔记数据在页面的window.__INITIAL_STATE__里，不需要这些资源
+    MEDIA_BLOCKED_URLS = (
+        '*.jpg*', '*.jpeg*', '*.png*', '*.gif*', '*.webp*', '*.avif*', '*.svg*',
+        '*.woff*', '*.ttf*', '*.otf*', '*.mp4*', '*.m3u8*',
+        '*://sns-webpic*', '*://sns-img*', '*://sns-avatar*', '*://sns-video*', '*://picasso-static*',
+    )
+    # 提取搜索页面新加载的笔记：处理过的元素用data-collected记下笔记链接，只处理新的或者内容变了的元素，
+    # 已经返回过的笔记ID记在window.__xhsSearchSeen里，页面重新渲染同一篇笔记时不重复返回
+    SEARCH_COLLECT_JS = """
+    if (arguments[0] || !window.__xhsSearchSeen) {
+        window.__xhsSearchSeen = new Set();
+        document.querySelectorAll('.note-item[data-collected]').forEach((el) => delete el.dataset.collected);
+    }
+    const seen = window.__xhsSearchSeen;
+    const text = (el) => el ? el.innerText.trim() : '';
+    const data = [];
+    document.querySelectorAll('.feeds-page .note-item').forEach((section) => {
+        const cover = section.querySelector('a.cover.ld.mask');
+        if (!cover || section.dataset.collected === cover.href) {
+            return;
+        }
+        section.dataset.collected = cover.href;
+        const noteMatch = cover.href.match(/\\/search_result\\/([^?]+)/);
+        const footer = section.querySelector('.footer');
+        const authorLink = footer && footer.querySelector('.author-wrapper a');
+        const uidMatch = authorLink && authorLink.href.match(/\\/profile\\/([^?]+)/);
+        if (!noteMatch || !uidMatch || seen.has(noteMatch[1])) {
+            return;
+        }
+        seen.add(noteMatch[1]);
+        data.push({
+            title: text(footer.querySelector('.title')),
+            nickname: text(footer.querySelector('.author-wrapper .author')),
+            note_id: noteMatch[1],
+            note_link: cover.href,
+            uid: uidMatch[1],
+            like: text(footer.querySelector('.like-wrapper.like-active')),
+        });
+    });
+    return data;
+    """
+
+    def __init__(self, page: ChromiumPage, cookie: dict, tab_pool_size: int | None = None):
+        """
+        :param page: 浏览器
+        :param cookie: 登录用的cookie
+        :param tab_pool_size: 签名用的标签页数量，不传使用配置XHS_TAB_POOL_SIZE
+        """
+        logger.debug("[xhs.XHSClient.__init__] 打开小红书主页")
+        self._browser = page
+        self._tab = self._browser.latest_tab
+        self._tab.get(self._domain)
+        # 主标签页用来登录和搜索页面的下拉，签名在标签页池里执行，可以多个线程同时签名
+        self._tabs = TabPool(self._browser, self._domain, tab_pool_size or settings.XHS_TAB_POOL_SIZE)
+        super().__init__(SignContext(self._tabs))
+        # 详情页的标签页一直保留，每次在原标签页里打开新的笔记，不用每次新建和关闭标签页
+        self._detail_tabs = TabPool(self._browser, self._domain, settings.XHS_DETAIL_TAB_SIZE,
+                                    ready_js='return true;', on_open=self._setup_detail_tab)
+        self.login(cookie)
+
+    def sign_stats(self) -> dict:
+        """
+        签名、网络请求和浏览器打开详情页(detail)各阶段的次数和耗时，tab_recycled为重新打开的标签页数量，
+        tab_checks为借出前检查标签页是否可用的次数
+        """
+        stats = super().sign_stats()
+        stats['tab_recycled'] = self._tabs.recycled + self._detail_tabs.recycled
+        stats['tab_checks'] = self._tabs.checks + self._detail_tabs.checks
+        return stats
+
+    def close(self):
+        """
+        关闭浏览器
+        """
+        self._browser.quit()
+
+    def login_cookie(self, cookie: dict):
+        """
+        使用cookie登录
+        :cookie_str web_session的值
+        """
+        logger.debug("[xhs.XHSClient.login_cookie]开始设置登录的cookie")
+        self._tab.set.cookies(f'a1={cookie["a1"]}; path=/; domain=.xiaohongshu.com;')
+        self._tab.set.cookies(f'web_session={cookie["web_session"]}; path=/; domain=.xiaohongshu.com;')
+        self._signer.invalidate()
+        random_wait(1,3)
+        logger.debug("[xhs.XHSClient.login_cookie]设置cookie完成")
+
+    def browser_page_state(self, url: str):
+        """
+        在详情页的标签页里打开页面，获取页面的window.__INITIAL_STATE__
+        :param url: 页面地址
+        :return: dict
+        """
+        with self._signer.timer('detail'), self._detail_tabs.tab() as tab:
+            tab.get(url)
+            return tab.run_js('return window.__INITIAL_STATE__')
+
+    def _setup_detail_tab(self, tab):
+        """
+        详情页的标签页只等到DOM加载完成，按配置屏蔽图片、字体和视频
+        """
+        tab.set.load_mode.eager()
+        if settings.XHS_BLOCK_MEDIA:
+            tab.set.blocked_urls(list(self.MEDIA_BLOCKED_URLS))
+
+    def browser_get_note_by_search(self, keyword: str, amount: int):
+        """
+        根据关键词搜索笔记
+        :keyword: 关键词参数
+        :amount: 下拉次数
+        """
+        # 填写关键词搜索
+        keyword = quote(keyword)
+        url = f"https://www.xiaohongshu.com/search_result?keyword={keyword}&source=web_explore_feed"
+        self._tab.get(url)
+        # 页面跳转后cookie可能被页面的js更新
+        self._signer.invalidate()
+        notes = self._get_info_by_search(reset=True)
+        for num in range(amount):
+            random_secs = random.uniform(2,8)
+            logger.debug(f"[xhs.XHSClient.browser_get_note_by_search] 下拉第{num + 1}次,休息{random_secs}秒")
+            time.sleep(random_secs)
+            self._tab.scroll.to_bottom()
+            notes.extend(self._get_info_by_search())
+        return notes
+
+    def _get_info_by_search(self, reset: bool = False) -> [dict]:
+        """
+        提取搜索页面上次提取之后新加载的笔记，一次执行js返回，已经提取过的笔记不会重复返回
+        :param reset: 是否清空已经提取过的笔记，打开新的搜索页面时使用
+        """
+        try:
+            data = self._tab.run_js(self.SEARCH_COLLECT_JS, reset)
+        except BaseError as e:
+            logger.warning(f"[xhs.XHSClient._get_info_by_search] 提取搜索结果失败:{e}")
+            return []
+        return data or []
@@ -6,7 +6,7 @@ from DrissionPage import ChromiumOptions, ChromiumPage
 from sqlalchemy.orm import Session
 from redis import Redis
 
-from media_platform.xhs.client import XHSClient
+from media_platform.xhs.client import XHSClient, XHSApiClient
 from media_platform.xhs.service import UserService, NoteService
 from tools.utils import logger
 from media_platform.xhs.exception import DataFetchError
@@ -16,19 +16,39 @@ from models.xhs import XHSNote, XHSUser
 from tools.time import convert_timestamp_to_date
 
 
+def create_page(auto_port: bool = False) -> ChromiumPage:
+    """
+    启动无头浏览器
+    :param auto_port: 自动分配端口和用户目录，同时启动多个浏览器时使用
+    """
+    co = ChromiumOptions()
+    # 设置无头
+    co.headless()
+    co.set_argument('--no-sandbox')  # 无沙盒模式
+    if auto_port:
+        co.auto_port()
+    return ChromiumPage(co)
+
+
 class XHSCrawler():
     context_page: ChromiumPage
-    xhs_client: XHSClient
-
-    def __init__(self, cookie: dict, db: Session, redis: Redis):
-        logger.debug("[xhs.crawler.__init__] 初始化浏览器")
-        co = ChromiumOptions()
-        # 设置无头
-        co.headless()
-        co.set_argument('--no-sandbox')  # 无沙盒模式
-        self.context_page = ChromiumPage(co)
-        self.xhs_client = XHSClient(self.context_page, cookie)
-        logger.debug("[xhs.crawler.__init__] 初始化浏览器完成")
+    xhs_client: XHSApiClient
+    presign_size = 20  # 笔记详情每次批量签名的数量，和搜索接口一页的数量一样
+    sign_max_age = 60  # 预先签名的有效时间(秒)，超过后重新签名
+
+    def __init__(self, cookie: dict | None, db: Session, redis: Redis, xhs_client: XHSApiClient | None = None):
+        """
+        :param cookie: 登录用的cookie
+        :param xhs_client: 已经登录的客户端，如连接守护进程的RemoteXHSClient，传入时不再启动浏览器
+        """
+        if xhs_client is None:
+            logger.debug("[xhs.crawler.__init__] 初始化浏览器")
+            self.context_page = create_page()
+            self.xhs_client = XHSClient(self.context_page, cookie)
+            logger.debug("[xhs.crawler.__init__] 初始化浏览器完成")
+        else:
+            self.context_page = None
+            self.xhs_client = xhs_client
         self._db = db
         self._redis = redis
 
@@ -70,10 +90,28 @@ class XHSCrawler():
         :keyword: 搜索的关键词
         :page_size: 要抓取数据的页数,默认抓取1页
         """
-        page = 1
-        has_more = True
         note_ids = []
         user_fields = []
+        for users, notes in self.iter_search_by_api(keyword, page_size, search_type, sort):
+            user_fields.extend(users)
+            note_ids.extend(notes)
+
+        return {"user_fields": user_fields, "note_ids": note_ids}
+
+    def iter_search_by_api(
+            self, keyword: str,
+            page_size: int = 1,
+            search_type: SearchNoteType = SearchNoteType.ALL,
+            sort: SearchSortType = SearchSortType.LATEST
+    ):
+        """
+        通过接口搜索笔记，每获取一页返回一次
+        :keyword: 搜索的关键词
+        :page_size: 要抓取数据的页数,默认抓取1页
+        :return: 生成器，每个元素为一页的(用户列表, 笔记列表)
+        """
+        page = 1
+        has_more = True
         while page <= page_size and has_more:
             logger.info(f'[xhs.crawler.search_by_api] 开始获取第{page}页数据')
             try:
@@ -81,6 +119,8 @@ class XHSCrawler():
                 # 获取是否还有更多的数据
                 has_more = data.get('has_more', False)
 
+                note_ids = []
+                user_fields = []
                 for item in data['items']:
                     if item['model_type'] in ['rec_query', 'hot_query']:
                         continue
@@ -96,28 +136,53 @@ class XHSCrawler():
                         "xsec_token": item['xsec_token'],
                         "liked_count": chinese_to_number(item['note_card']['interact_info']['liked_count']),
                     })
-                page += 1
-                pause_duration = random.uniform(1, 3)
-                time.sleep(pause_duration)
-
             except DataFetchError as e:
                 logger.error(f"[xhs.crawler.search_by_api.DataFetchError] 获取数据失败:{e}")
                 break
             except Exception as e:
                 raise DataFetchError(f"[xhs.crawler.search_by_api.Exception]搜索数据获取失败.{e}")
 
-        return {"user_fields": user_fields, "note_ids": note_ids}
+            yield user_fields, note_ids
+            page += 1
+            # 客户端设置了pacer时由pacer控制请求的频率
+            if self.xhs_client.pacer is None:
+                time.sleep(random.uniform(1, 3))
+
+    def presign_note_details(self, notes: [dict], xsec_source: str = 'pc_search',
+                             limit: int | None = None) -> [(dict, dict | None, float | None)]:
+        """
+        批量签名笔记详情接口的请求，每presign_size条笔记(搜索结果的一页)签名一次
+        :notes: search_by_api返回的note_ids
+        :xsec_source: 渠道来源
+        :limit: 最多签名前几条笔记，sign_max_age秒内用不到的签名会过期，后面的笔记请求时再签名
+        :return: [(note, 预先签名的请求头, 签名的时间)]，传给note_detail_by_api使用，没有签名的请求头和时间为None
+        """
+        amount = len(notes) if limit is None else max(0, min(limit, len(notes)))
+        signed = []
+        for start in range(0, amount, self.presign_size):
+            chunk = notes[start:min(start + self.presign_size, amount)]
+            headers_list = self.xhs_client.sign_note_details(
+                [(note['id'], note['xsec_token'], xsec_source) for note in chunk])
+            signed_at = time.monotonic()
+            signed.extend((note, headers, signed_at) for note, headers in zip(chunk, headers_list))
+        signed.extend((note, None, None) for note in notes[amount:])
+        return signed
 
     def note_detail_by_api(self, note_id: str, xsec_token: str, xsec_source: str = 'pc_search',
-                           keyword: str = '') -> XHSNote | None:
+                           keyword: str = '', headers: dict | None = None,
+                           signed_at: float | None = None) -> XHSNote | None:
         """
         获取笔记详情API
         :note_id:笔记ID
         :xsec_token: 搜索关键字之后返回的比较列表中返回的token
         :xsec_source: 渠道来源
+        :headers: presign_note_details预先签名的请求头
+        :signed_at: 签名的时间，超过sign_max_age秒时不使用预先签名的请求头，重新签名
         """
+        if headers is not None and signed_at is not None and time.monotonic() - signed_at > self.sign_max_age:
+            headers = None
         try:
-            item = self.xhs_client.api_get_note_detail(note_id, xsec_token, xsec_source)
+            item = self.xhs_client.api_get_note_detail(note_id, xsec_token, xsec_source, headers)
             return XHSNote(
                 note_id=note_id,
                 user_id=item['user']['user_id'],
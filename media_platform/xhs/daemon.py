@@ -0,0 +1,243 @@
+"""
+小红书浏览器守护进程
+常驻后台，为cookie池里每个登录用户的cookie启动一个浏览器并保持登录，通过本地的HTTP接口提供签名和页面数据
+运行时间短的脚本通过RemoteXHSClient连接，不用每次启动浏览器和登录
+每隔keepalive秒检查一次所有浏览器的登录状态，登录失效时用原来的cookie重新登录，
+重新登录失败的cookie设置为无效，之后指定这个cookie_id的请求返回登录失效的错误
+接口的参数和返回都是json，都可以带cookie_id指定登录用户，不传时按顺序轮流分配，返回结果里有分配的cookie_id：
+    POST /sign_batch  {"items": [[地址, 参数]]} -> {"headers": [签名头]}
+    POST /page_state  {"url": 页面地址} -> {"state": window.__INITIAL_STATE__}
+    POST /search      {"keyword": 关键词, "amount": 下拉次数} -> {"notes": [笔记]}
+    POST /login       {"cookie": 登录用的cookie} -> {}，在浏览器里设置登录的cookie
+    POST /cookies     {"cookies": [cookie]} -> {}，接口返回的Set-Cookie同步到浏览器
+    GET  /status      -> {"sessions": {cookie_id: 各阶段的耗时统计}, "expired": {cookie_id: 登录失效的原因}}
+出错时返回 {"success": false, "msg": 错误信息}，登录失效时还有 "code": "login_expired"
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from media_platform.xhs.client import XHSClient
+from media_platform.xhs.crawler import create_page
+from media_platform.xhs.exception import DataFetchError, LoginError
+from media_platform.xhs.remote import RemoteXHSClient
+from tools.cookie_pool import set_cookie_invalid
+from tools.utils import logger
+
+
+class XHSDaemon:
+
+    def __init__(self, sessions: {int: XHSClient}, cookies: dict | None = None, keepalive: float = 600):
+        """
+        :param sessions: {cookie_id: 已经登录的客户端}
+        :param cookies: {cookie_id: 登录用的cookie}，登录失效时用来重新登录，不传时不重新登录
+        :param keepalive: 检查登录状态的间隔(秒)
+        """
+        self._sessions = sessions
+        self._cookies = cookies or {}
+        self._keepalive = keepalive
+        self._expired = {}  # 登录失效的cookie: {cookie_id: 原因}
+        self._next = 0
+        self._lock = threading.Lock()
+        # 登录和搜索页面的下拉都在主标签页执行，每个浏览器同时只能执行一个
+        self._main_locks = {cookie_id: threading.Lock() for cookie_id in sessions}
+        self._stop = threading.Event()
+
+    @classmethod
+    def login(cls, cookies: list) -> 'XHSDaemon':
+        """
+        每个cookie启动一个浏览器并登录，登录失败的cookie设置为无效
+        :param cookies: cookie_pool表的数据
+        """
+        sessions = {}
+        values = {}
+        for cookie in cookies:
+            page = create_page(auto_port=True)
+            try:
+                sessions[cookie.id] = XHSClient(page, cookie.value)
+                values[cookie.id] = cookie.value
+                logger.info(f'[xhs.XHSDaemon.login] cookie {cookie.id} 登录完成')
+            except Exception as e:
+                page.quit()
+                set_cookie_invalid('xhs', [cookie.id])
+                logger.error(f'[xhs.XHSDaemon.login] cookie {cookie.id} 登录失败:{e}')
+        return cls(sessions, values)
+
+    @property
+    def cookie_ids(self) -> [int]:
+        with self._lock:
+            return list(self._sessions)
+
+    def session(self, cookie_id: int | None = None) -> (int, XHSClient):
+        """
+        获取登录用户的客户端
+        :param cookie_id: 不传按顺序轮流分配
+        """
+        if cookie_id is None:
+            with self._lock:
+                cookie_ids = list(self._sessions)
+                if not cookie_ids:
+                    raise DataFetchError('没有登录的浏览器')
+                cookie_id = cookie_ids[self._next % len(cookie_ids)]
+                self._next += 1
+        cookie_id = int(cookie_id)
+        if cookie_id in self._expired:
+            raise LoginError(f'cookie {cookie_id} 的登录已经失效:{self._expired[cookie_id]}')
+        client = self._sessions.get(cookie_id)
+        if client is None:
+            raise DataFetchError(f'没有cookie_id为{cookie_id}的浏览器')
+        return cookie_id, client
+
+    def keep_alive(self):
+        """
+        检查所有浏览器的登录状态，登录失效的重新登录，重新登录失败的关闭浏览器
+        """
+        with self._lock:
+            sessions = list(self._sessions.items())
+        for cookie_id, client in sessions:
+            if client.login_status():
+                continue
+            logger.warning(f'[xhs.XHSDaemon.keep_alive] cookie {cookie_id} 登录失效，重新登录')
+            cookie = self._cookies.get(cookie_id)
+            if cookie is None:
+                self.expire(cookie_id, '登录失效')
+                continue
+            try:
+                with self._main_locks[cookie_id]:
+                    client.login(cookie)
+            except Exception as e:
+                self.expire(cookie_id, f'重新登录失败:{e}')
+
+    def expire(self, cookie_id: int, reason: str):
+        """
+        登录失效并且不能重新登录，关闭浏览器，cookie设置为无效
+        """
+        with self._lock:
+            client = self._sessions.pop(cookie_id, None)
+            self._expired[cookie_id] = reason
+        logger.error(f'[xhs.XHSDaemon.expire] cookie {cookie_id} {reason}')
+        set_cookie_invalid('xhs', [cookie_id])
+        if client is not None:
+            client.close()
+
+    def start_keepalive(self) -> threading.Thread:
+        """
+        启动定时检查登录状态的线程
+        """
+        def run():
+            while not self._stop.wait(self._keepalive):
+                try:
+                    self.keep_alive()
+                except Exception as e:
+                    logger.error(f'[xhs.XHSDaemon.keep_alive] 检查登录状态失败:{e}')
+
+        thread = threading.Thread(target=run, name='xhs-keepalive', daemon=True)
+        thread.start()
+        return thread
+
+    def handle(self, path: str, params: dict) -> dict:
+        """
+        处理一个接口请求
+        :param path: 接口地址
+        :param params: 参数
+        :return: dict
+        """
+        if path == '/status':
+            # 保活线程会同时删除登录失效的浏览器，先在锁里复制一份
+            with self._lock:
+                sessions = list(self._sessions.items())
+                expired = dict(self._expired)
+            return {"sessions": {cookie_id: client.sign_stats() for cookie_id, client in sessions},
+                    "expired": expired}
+
+        cookie_id, client = self.session(params.get('cookie_id'))
+        if path == '/sign_batch':
+            result = {"headers": client.sign_batch([(url, data) for url, data in params['items']])}
+        elif path == '/page_state':
+            result = {"state": client.browser_page_state(params['url'])}
+        elif path == '/search':
+            with self._main_locks[cookie_id]:
+                result = {"notes": client.browser_get_note_by_search(params['keyword'], int(params['amount']))}
+        elif path == '/login':
+            with self._main_locks[cookie_id]:
+                client.login_cookie(params['cookie'])
+            result = {}
+        elif path == '/cookies':
+            client.set_cookies(params['cookies'])
+            result = {}
+        else:
+            raise DataFetchError(f'不支持的接口{path}')
+        result['cookie_id'] = cookie_id
+        return result
+
+    def close(self):
+        self._stop.set()
+        for client in self._sessions.values():
+            client.close()
+        self._sessions = {}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: '_Server'
+
+    def do_GET(self):
+        self._reply(self.path, {})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            params = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            self._send(400, {"success": False, "msg": f'参数错误:{e}'})
+            return
+        self._reply(self.path, params)
+
+    def _reply(self, path: str, params: dict):
+        try:
+            result = self.server.xhs_daemon.handle(path, params)
+        except LoginError as e:
+            logger.error(f'[xhs.XHSDaemon.handle] {path} 登录失效:{e}')
+            self._send(401, {"success": False, "code": RemoteXHSClient.LOGIN_EXPIRED_CODE, "msg": str(e)})
+            return
+        except Exception as e:
+            logger.error(f'[xhs.XHSDaemon.handle] {path} 处理失败:{e}')
+            self._send(500, {"success": False, "msg": str(e)})
+            return
+        result['success'] = True
+        self._send(200, result)
+
+    def _send(self, status: int, data: dict):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f'[xhs.XHSDaemon] {format % args}')
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    xhs_daemon: XHSDaemon
+
+
+def serve(daemon: XHSDaemon, address: str):
+    """
+    启动HTTP服务，一直运行到中断
+    :param daemon: 已经登录的守护进程
+    :param address: 监听地址，如 127.0.0.1:8960
+    """
+    host, port = address.rsplit(':', 1)
+    server = _Server((host, int(port)), _Handler)
+    server.xhs_daemon = daemon
+    daemon.start_keepalive()
+    logger.info(f'[xhs.daemon.serve] 监听{address}，登录的cookie:{daemon.cookie_ids}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        daemon.close()
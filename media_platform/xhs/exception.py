@@ -2,5 +2,21 @@ class DataFetchError(Exception):
     """something error when fetch"""
 
 
+class HTTPStatusError(DataFetchError):
+    """the server returned a status code other than 200"""
+
+    def __init__(self, status_code: int, message: str = ''):
+        super().__init__(f'{status_code} {message}'.strip())
+        self.status_code = status_code
+
+
 class IPBlockError(Exception):
-    """fetch so fast that the server block us ip"""
\ No newline at end of file
+    """fetch so fast that the server block us ip"""
+
+
+class TabBusyError(Exception):
+    """no idle browser tab in the pool before timeout"""
+
+
+class LoginError(Exception):
+    """login with cookie failed"""
@@ -0,0 +1,222 @@
+"""
+按关键词抓取笔记的流水线：搜索 -> 笔记详情 -> 写入数据库
+搜索线程每获取一页就批量签名后放进有界队列，多个详情线程从队列取出笔记获取详情，搜索和详情的请求共用一个自适应的限速，被限制时自动降低频率
+按限速的频率估算队列里的笔记多久后才会请求，只预先签名过期前能用到的笔记，其他的在请求时再签名
+任何一个线程异常退出时通知其他线程停止，不会一直等待队列
+传入SeenIndex时跳过最近获取过详情并且点赞数变化不大的笔记，点赞数变化大的笔记优先获取
+用户和笔记攒够一批后一次写入，写入在调用run的线程里执行，数据库的连接不跨线程使用
+"""
+import itertools
+import queue
+import threading
+import time
+
+from media_platform.xhs.crawler import XHSCrawler
+from media_platform.xhs.field import SearchSortType, SearchNoteType
+from media_platform.xhs.seen_index import SeenIndex, FRESH, MOVED
+from media_platform.xhs.service import NoteService, UserService
+from tools.pacer import AdaptivePacer
+from tools.utils import logger
+
+# 队列结束的标记
+_DONE = object()
+# 队列里的优先级，数字小的先获取
+_PRIORITY = {MOVED: 0}
+_PRIORITY_NEW = 1
+_PRIORITY_DONE = 9
+# 等待队列的空位或者新的笔记时，每隔多久检查一次是否要停止(秒)
+_POLL_INTERVAL = 0.5
+
+
+class NotePipeline:
+
+    def __init__(self, crawler: XHSCrawler, note_service: NoteService, user_service: UserService, pacer: AdaptivePacer,
+                 workers: int = 2, queue_size: int = 40, batch_size: int = 20, flush_interval: float = 30,
+                 min_liked: int = 500, seen: SeenIndex | None = None):
+        """
+        :param crawler: 已经登录的爬虫
+        :param pacer: 搜索和详情请求共用的限速，设置到客户端上，每个接口请求都按它的频率等待
+        :param workers: 获取详情的线程数
+        :param queue_size: 待获取详情的笔记队列长度，队列满了搜索线程等待
+        :param batch_size: 每批写入的数量
+        :param flush_interval: 不够一批时最长等待多久写入(秒)
+        :param min_liked: 点赞数小于这个值的笔记不获取详情
+        :param seen: 最近获取过详情的笔记的索引，不传时每篇笔记都获取
+        """
+        self._crawler = crawler
+        self._note_service = note_service
+        self._user_service = user_service
+        self._pacer = pacer
+        self._workers = workers
+        self._queue_size = queue_size
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._min_liked = min_liked
+        self._seen = seen
+
+    def run(self, keyword: str, page_size: int, search_type: SearchNoteType = SearchNoteType.ALL,
+            sort: SearchSortType = SearchSortType.GENERAL) -> dict:
+        """
+        抓取一个关键词，全部写入后返回
+        :param keyword: 搜索的关键词
+        :param page_size: 搜索的页数
+        :return: 各阶段的数量和总耗时
+        """
+        self._crawler.xhs_client.pacer = self._pacer
+        stats = {"pages": 0, "notes": 0, "filtered": 0, "skipped": 0, "moved": 0, "fetched": 0, "failed": 0,
+                 "users_written": 0, "notes_written": 0}
+        lock = threading.Lock()
+        start = time.monotonic()
+
+        def count(key: str, amount: int = 1):
+            with lock:
+                stats[key] += amount
+
+        note_queue = queue.PriorityQueue(self._queue_size)
+        sequence = itertools.count()
+        write_queue = queue.Queue()
+        stop = threading.Event()
+
+        def put(priority: int, item) -> bool:
+            """
+            放进队列，队列满时等待，要停止时返回False
+            """
+            while not stop.is_set():
+                try:
+                    note_queue.put((priority, next(sequence), item), timeout=_POLL_INTERVAL)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def presign_limit() -> int:
+            """
+            按当前的频率，签名后sign_max_age的一半时间内能请求到的笔记数量减去队列里已经有的数量
+            """
+            return int(self._pacer.rate * self._crawler.sign_max_age / 2) - note_queue.qsize()
+
+        def search():
+            try:
+                for users, notes in self._crawler.iter_search_by_api(keyword, page_size, search_type, sort):
+                    count("pages")
+                    count("notes", len(notes))
+                    write_queue.put(('user', users))
+                    # 点赞数不够的笔记不获取详情
+                    liked = [note for note in notes if note['liked_count'] >= self._min_liked]
+                    count("filtered", len(notes) - len(liked))
+                    notes = liked
+                    priorities = [_PRIORITY_NEW] * len(notes)
+                    if self._seen is not None and notes:
+                        checked = [(note, result) for note, result in zip(notes, self._seen.check(notes))
+                                   if result != FRESH]
+                        count("skipped", len(notes) - len(checked))
+                        count("moved", sum(1 for _, result in checked if result == MOVED))
+                        notes = [note for note, _ in checked]
+                        priorities = [_PRIORITY.get(result, _PRIORITY_NEW) for _, result in checked]
+                    if not notes:
+                        continue
+                    # 优先获取的笔记先签名，一页的笔记一次签名
+                    ordered = sorted(zip(priorities, notes), key=lambda pair: pair[0])
+                    signed = self._crawler.presign_note_details([note for _, note in ordered], 'pc_search',
+                                                                presign_limit())
+                    for (priority, _), item in zip(ordered, signed):
+                        if not put(priority, item):
+                            return
+            except Exception as e:
+                logger.error(f'[xhs.NotePipeline.search] 搜索{keyword}失败:{e}')
+            finally:
+                for _ in range(self._workers):
+                    put(_PRIORITY_DONE, _DONE)
+
+        def fetch_one(note: dict, headers: dict | None, signed_at: float | None):
+            field = self._crawler.note_detail_by_api(note['id'], note['xsec_token'], 'pc_search', keyword,
+                                                     headers, signed_at)
+            if field is None:
+                logger.warning(f"[xhs.NotePipeline.fetch]{note['id']}笔记获取失败.")
+                count("failed")
+                return
+            count("fetched")
+            write_queue.put(('note', [field]))
+            if self._seen is not None:
+                try:
+                    self._seen.add([note])
+                except Exception as e:
+                    logger.warning(f"[xhs.NotePipeline.fetch]{note['id']}记录已获取详情失败:{e}")
+
+        def fetch():
+            finished = False
+            try:
+                while not stop.is_set():
+                    try:
+                        _, _, item = note_queue.get(timeout=_POLL_INTERVAL)
+                    except queue.Empty:
+                        continue
+                    if item is _DONE:
+                        break
+                    try:
+                        fetch_one(*item)
+                    except Exception as e:
+                        # 一篇笔记出错不影响后面的笔记
+                        logger.error(f"[xhs.NotePipeline.fetch]{item[0]['id']}笔记处理失败:{e}")
+                        count("failed")
+                finished = True
+            finally:
+                if not finished:
+                    # 异常退出时通知其他线程停止，搜索线程不会一直等待队列的空位
+                    stop.set()
+
+        threads = [threading.Thread(target=search, name='xhs-search')]
+        threads += [threading.Thread(target=fetch, name=f'xhs-fetch-{i}') for i in range(self._workers)]
+        for thread in threads:
+            thread.start()
+
+        def close_writer():
+            for thread in threads:
+                thread.join()
+            write_queue.put(_DONE)
+
+        closer = threading.Thread(target=close_writer, name='xhs-closer')
+        closer.start()
+        # 写入在当前线程执行，数据库的连接不跨线程使用
+        try:
+            self._write(write_queue, count)
+        finally:
+            stop.set()
+            closer.join()
+
+        stats["elapsed"] = round(time.monotonic() - start, 2)
+        stats["pacer"] = self._pacer.stats()
+        return stats
+
+    def _write(self, write_queue: queue.Queue, count):
+        users = []
+        notes = []
+        last_flush = time.monotonic()
+
+        def flush():
+            nonlocal users, notes, last_flush
+            try:
+                if users:
+                    count("users_written", self._user_service.add_users(users))
+                if notes:
+                    count("notes_written", self._note_service.add_notes(notes))
+            except Exception as e:
+                logger.error(f'[xhs.NotePipeline.write] 写入{len(users)}个用户,{len(notes)}条笔记失败:{e}')
+            users = []
+            notes = []
+            last_flush = time.monotonic()
+
+        while True:
+            timeout = max(0.0, self._flush_interval - (time.monotonic() - last_flush))
+            try:
+                item = write_queue.get(timeout=timeout)
+            except queue.Empty:
+                flush()
+                continue
+            if item is _DONE:
+                break
+            kind, rows = item
+            (users if kind == 'user' else notes).extend(rows)
+            if len(users) + len(notes) >= self._batch_size:
+                flush()
+        flush()
@@ -0,0 +1,124 @@
+"""
+连接小红书浏览器守护进程(media_platform.xhs.daemon)的客户端
+签名、登录和浏览器打开页面通过守护进程完成，接口请求还是在本进程直接发出，其他方法和XHSClient一样
+守护进程里的登录失效并且重新登录失败时，请求抛出LoginError
+"""
+import requests
+
+from config import settings
+from media_platform.xhs.client import XHSApiClient
+from media_platform.xhs.exception import DataFetchError, LoginError
+from media_platform.xhs.sign_context import SignContext
+from tools.utils import logger
+
+
+class RemoteSignContext(SignContext):
+    """
+    签名在守护进程里执行，本地只统计耗时
+    """
+
+    def __init__(self, client: 'RemoteXHSClient'):
+        super().__init__(None)
+        self._client = client
+
+    def invalidate(self):
+        # 缓存在守护进程里，cookie变化时守护进程自己处理
+        pass
+
+    def headers(self, url: str, data=None) -> dict:
+        return self.headers_batch([(url, data)])[0]
+
+    def headers_batch(self, items: [(str, dict | None)]) -> [dict]:
+        if not items:
+            return []
+        with self.timer('remote_sign'):
+            return self._client.call('/sign_batch', {"items": [[url, data] for url, data in items]})["headers"]
+
+    def set_cookies(self, cookies: [dict]):
+        try:
+            self._client.call('/cookies', {"cookies": cookies})
+        except (requests.RequestException, DataFetchError) as e:
+            logger.warning(f'[xhs.RemoteSignContext.set_cookies] 同步cookie到守护进程失败:{e}')
+
+
+class RemoteXHSClient(XHSApiClient):
+    # 守护进程的登录失效时返回的错误码
+    LOGIN_EXPIRED_CODE = 'login_expired'
+    # 搜索页面每次下拉最长的等待时间(秒)，用来计算搜索请求的超时时间
+    SEARCH_SCROLL_TIMEOUT = 10
+
+    def __init__(self, address: str, cookie_id: int | None = None, timeout: float = 60):
+        """
+        :param address: 守护进程的地址，如 127.0.0.1:8960
+        :param cookie_id: 使用的登录用户，不传由守护进程分配，分配后一直使用同一个
+        :param timeout: 请求守护进程的超时时间(秒)
+        """
+        self._address = f'http://{address}'
+        self._cookie_id = cookie_id
+        self._timeout = timeout
+        self._session = requests.Session()
+        super().__init__(RemoteSignContext(self))
+
+    @classmethod
+    def connect(cls, address: str | None = None) -> 'RemoteXHSClient | None':
+        """
+        连接守护进程，没有配置或者连接不上时返回None
+        :param address: 不传使用配置XHS_DAEMON_ADDRESS
+        """
+        address = address or settings.XHS_DAEMON_ADDRESS
+        if not address:
+            return None
+        client = cls(address)
+        try:
+            status = client.call('/status', timeout=3)
+        except (requests.RequestException, DataFetchError, ValueError) as e:
+            logger.info(f'[xhs.RemoteXHSClient.connect] 连接守护进程{address}失败:{e}')
+            return None
+        if not status["sessions"]:
+            logger.info(f'[xhs.RemoteXHSClient.connect] 守护进程{address}没有登录的浏览器')
+            return None
+        return client
+
+    def call(self, path: str, params: dict | None = None, timeout: float | None = None) -> dict:
+        """
+        请求守护进程的接口
+        :param path: 接口地址
+        :param params: 参数，为None时使用GET请求
+        :param timeout: 超时时间(秒)，不传使用初始化时的值
+        :return: dict
+        """
+        timeout = self._timeout if timeout is None else timeout
+        if params is None:
+            response = self._session.get(f'{self._address}{path}', timeout=timeout)
+        else:
+            if self._cookie_id is not None:
+                params["cookie_id"] = self._cookie_id
+            response = self._session.post(f'{self._address}{path}', json=params, timeout=timeout)
+        data = response.json()
+        if not data.get("success"):
+            if data.get("code") == self.LOGIN_EXPIRED_CODE:
+                raise LoginError(data.get("msg"))
+            raise DataFetchError(data.get("msg"))
+        if self._cookie_id is None and data.get("cookie_id") is not None:
+            self._cookie_id = data["cookie_id"]
+        return data
+
+    def login_cookie(self, cookie: dict):
+        """
+        在守护进程的浏览器里设置登录的cookie
+        """
+        self.call('/login', {"cookie": cookie})
+
+    def close(self):
+        self._session.close()
+
+    def browser_page_state(self, url: str):
+        with self._signer.timer('detail'):
+            return self.call('/page_state', {"url": url})["state"]
+
+    def browser_get_note_by_search(self, keyword: str, amount: int):
+        """
+        在守护进程的浏览器里搜索并下拉amount次
+        """
+        timeout = self._timeout + amount * self.SEARCH_SCROLL_TIMEOUT
+        return self.call('/search', {"keyword": keyword, "amount": amount}, timeout=timeout)["notes"]
@@ -0,0 +1,111 @@
+"""
+最近获取过详情的笔记的索引，用来跳过不同关键词搜索到的同一篇笔记
+每天一个Redis位图做布隆过滤器，保存ttl_days天；每篇笔记写入两项：
+    笔记ID                -> 最近获取过详情
+    笔记ID:点赞数的档位     -> 获取详情时点赞数的档位，档位按2的倍数划分
+点赞数的档位没变的笔记跳过，档位变了的优先获取
+"""
+import hashlib
+import time
+
+from redis import Redis
+
+# 检查的结果
+FRESH = 'fresh'  # 最近获取过，点赞数变化不大
+MOVED = 'moved'  # 最近获取过，点赞数变化大
+NEW = 'new'  # 最近没有获取过
+
+
+class SeenIndex:
+
+    def __init__(self, redis: Redis, ttl_days: int = 3, bits: int = 1 << 23, hashes: int = 5,
+                 prefix: str = 'xhs_seen_note'):
+        """
+        :param ttl_days: 获取详情后多少天内不再获取
+        :param bits: 每天位图的大小，默认1MB，每天40万篇笔记时误判率约1%
+        :param hashes: 每项使用的哈希函数数量
+        :param prefix: 缓存key的前缀
+        """
+        self._redis = redis
+        self._ttl_days = ttl_days
+        self._bits = bits
+        self._hashes = hashes
+        self._prefix = prefix
+
+    @staticmethod
+    def liked_bucket(liked_count: int) -> int:
+        """
+        点赞数的档位，点赞数翻倍时档位加1
+        """
+        return max(int(liked_count), 0).bit_length()
+
+    def _offsets(self, item: str) -> [int]:
+        # 两个64位哈希值组合出多个哈希函数
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self._bits for i in range(self._hashes)]
+
+    def _keys(self) -> [str]:
+        now = time.time()
+        return [f"{self._prefix}_{time.strftime('%Y%m%d', time.localtime(now - 86400 * day))}"
+                for day in range(self._ttl_days)]
+
+    def _items(self, note: dict) -> (str, str):
+        return note['id'], f"{note['id']}:{self.liked_bucket(note['liked_count'])}"
+
+    def check(self, notes: [dict]) -> [str]:
+        """
+        检查笔记最近是否获取过详情，一次请求Redis
+        :param notes: [{"id": 笔记ID, "liked_count": 点赞数}]
+        :return: 每篇笔记的结果，FRESH、MOVED或NEW
+        """
+        if not notes:
+            return []
+        keys = self._keys()
+        pipe = self._redis.pipeline(transaction=False)
+        for note in notes:
+            for item in self._items(note):
+                offsets = self._offsets(item)
+                for key in keys:
+                    for offset in offsets:
+                        pipe.getbit(key, offset)
+        bits = pipe.execute()
+
+        result = []
+        step = self._hashes
+        pos = 0
+        for _ in notes:
+            found = []
+            for _item in range(2):
+                hit = False
+                for _key in keys:
+                    if all(bits[pos:pos + step]):
+                        hit = True
+                    pos += step
+                found.append(hit)
+            seen, same_bucket = found
+            if seen and same_bucket:
+                result.append(FRESH)
+            elif seen:
+                result.append(MOVED)
+            else:
+                result.append(NEW)
+        return result
+
+    def add(self, notes: [dict]):
+        """
+        记录笔记已经获取过详情
+        :param notes: [{"id": 笔记ID, "liked_count": 点赞数}]
+        """
+        if not notes:
+            return
+        key = self._keys()[0]
+        pipe = self._redis.pipeline(transaction=False)
+        for note in notes:
+            for item in self._items(note):
+                for offset in self._offsets(item):
+                    pipe.setbit(key, offset, 1)
+        # 多保留一天，保证最早一天的位图在ttl_days天内一直存在
+        pipe.expire(key, 86400 * (self._ttl_days + 1))
+        pipe.execute()
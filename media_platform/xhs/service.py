@@ -1,14 +1,19 @@
 import json
 
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 from redis import Redis
 from datetime import datetime
 
 from models.xhs import XHSNote, XHSUser, XhsUserSnapshot
+from tools.db import upsert, to_row
 from tools.utils import to_dict, logger
 
 
 class UserService:
+    # 用户存在时更新的字段
+    update_fields = ['nickname', 'location', 'desc', 'fans', 'tag_list']
+
     def __init__(self, db: Session, redis: Redis):
         self._db = db
         self._redis = redis
@@ -59,6 +64,48 @@ class UserService:
             self._db.add(fields)
         self._db.commit()
 
+    def add_users(self, users: [XHSUser]) -> int:
+        """
+        按user_id批量新增或更新用户，使用INSERT ... ON DUPLICATE KEY UPDATE批量写入，值为None的字段不更新
+        :param users: 用户列表，同一个用户出现多次时使用最后一个
+        :return: 写入的用户数量
+        """
+        # 过虑小红薯开头的账号，名字都没改账号不可能有意义
+        rows = {user.user_id: to_row(user) for user in users if not user.nickname.startswith('小红薯')}
+        if not rows:
+            return 0
+
+        try:
+            upsert(self._db, XHSUser, list(rows.values()), ['user_id'], self.update_fields)
+            self._db.commit()
+        except Exception:
+            self._db.rollback()
+            raise
+
+        self._delete_cache('get_info_by_user_id', rows)
+        return len(rows)
+
+    def add_snapshots(self, snapshots: [XhsUserSnapshot]) -> int:
+        """
+        批量添加用户快照，一次INSERT
+        :return: 添加的数量
+        """
+        if not snapshots:
+            return 0
+        try:
+            self._db.execute(insert(XhsUserSnapshot), [to_row(snapshot) for snapshot in snapshots])
+            self._db.commit()
+        except Exception:
+            self._db.rollback()
+            raise
+        return len(snapshots)
+
+    def _delete_cache(self, fun: str, keys):
+        pipe = self._redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.delete(self.get_cache_keys(fun, key))
+        pipe.execute()
+
     def add_snapshot(self,field: XhsUserSnapshot):
         self._db.add(field)
         self._db.commit()
@@ -88,6 +135,11 @@ class UserService:
 
 
 class NoteService:
+    # 笔记存在时更新的字段
+    update_fields = ['user_id', 'type', 'title', 'desc', 'video_url', 'liked_count', 'collected_count',
+                     'comment_count', 'image_list', 'tag_list', 'note_url', 'source_keyword', 'last_update_time',
+                     'add_time']
+
     def __init__(self, db: Session, redis: Redis):
         self._db = db
         self._redis = redis
@@ -109,6 +161,33 @@ class NoteService:
             self._db.add(field)
         self._db.commit()
 
+    def add_notes(self, notes: [XHSNote]) -> int:
+        """
+        按note_id批量新增或更新笔记，使用INSERT ... ON DUPLICATE KEY UPDATE批量写入，值为None的字段不更新
+        :param notes: 笔记列表，同一个笔记出现多次时使用最后一个
+        :return: 写入的笔记数量
+        """
+        rows = {note.note_id: to_row(note) for note in notes}
+        if not rows:
+            return 0
+
+        try:
+            upsert(self._db, XHSNote, list(rows.values()), ['note_id'], self.update_fields)
+            self._db.commit()
+        except Exception:
+            self._db.rollback()
+            raise
+
+        logger.debug(f'[xhs.service.add_notes]写入笔记{len(rows)}条')
+        self._delete_cache('get_info_by_note_id', rows)
+        return len(rows)
+
+    def _delete_cache(self, fun: str, keys):
+        pipe = self._redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.delete(self.get_cache_keys(fun, key))
+        pipe.execute()
+
     def get_info_by_note_id(self, note_id: str) -> XHSNote:
         cache_key = self.get_cache_keys('get_info_by_note_id', note_id)
         info: str = self._redis.get(cache_key)
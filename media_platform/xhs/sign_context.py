@@ -0,0 +1,165 @@
+"""
+小红书接口签名的会话上下文
+a1、b1和cookie字符串在一个会话里很少变化，缓存起来后每次签名只需要执行一次run_js
+接口返回Set-Cookie、重新登录、浏览器跳转页面或者缓存超时后重新从浏览器读取
+签名的js在标签页池里借出的标签页上执行，多个线程可以同时签名
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from media_platform.xhs.help import sign, convert_cookies
+from media_platform.xhs.tab_pool import TabPool
+from tools.utils import logger
+
+
+class SignContext:
+
+    def __init__(self, tabs: TabPool, ttl: int = 600):
+        """
+        :param tabs: 已经打开小红书的标签页池
+        :param ttl: 缓存时长(秒)，超过后重新从浏览器读取
+        """
+        self._tabs = tabs
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._ttl = ttl
+        self._a1 = ''
+        self._b1 = ''
+        self._cookie_str = ''
+        self._expire = 0
+        # 每个阶段的次数和耗时：refresh-读取浏览器cookie，js-执行签名js，js_batch-批量签名，sign-计算x-s-common，request-网络请求
+        self._timings = {}
+
+    @contextmanager
+    def timer(self, phase: str):
+        """
+        统计一个阶段的次数和耗时
+        :param phase: 阶段名
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            cost = time.perf_counter() - start
+            with self._lock:
+                count, total = self._timings.get(phase, (0, 0.0))
+                self._timings[phase] = (count + 1, total + cost)
+
+    def stats(self) -> dict:
+        """
+        每个阶段的次数、总耗时和平均耗时(毫秒)
+        :return: {阶段名: {"count": 次数, "total": 总耗时, "avg": 平均耗时}}
+        """
+        return {
+            phase: {"count": count, "total": round(total * 1000, 2), "avg": round(total * 1000 / count, 2)}
+            for phase, (count, total) in self._timings.items()
+        }
+
+    def invalidate(self):
+        """
+        cookie或者登录状态变化后，下次签名重新读取
+        """
+        self._expire = 0
+
+    def refresh(self):
+        """
+        从浏览器读取a1、b1和cookie字符串
+        """
+        with self.timer('refresh'), self._tabs.tab() as tab:
+            local_storage = tab.local_storage()
+            cookie_str, cookie_dict = convert_cookies(tab.cookies())
+        self._a1 = cookie_dict.get('a1', '')
+        self._b1 = local_storage.get('b1', '')
+        self._cookie_str = cookie_str
+        self._expire = time.monotonic() + self._ttl
+        logger.debug('[xhs.SignContext.refresh] 重新读取浏览器的cookie')
+
+    @property
+    def cookie_str(self) -> str:
+        if time.monotonic() >= self._expire:
+            # 多个线程同时过期时只读取一次，其他线程等待读取完成
+            with self._refresh_lock:
+                if time.monotonic() >= self._expire:
+                    self.refresh()
+        return self._cookie_str
+
+    def headers(self, url: str, data=None) -> dict:
+        """
+        生成接口请求的签名头
+        :param url: 请求的url的地址
+        :param data: 请求参数
+        :return: dict
+        """
+        cookie_str = self.cookie_str
+        with self.timer('js'), self._tabs.tab() as tab:
+            encrypt_params = tab.run_js('return window._webmsxyw(arguments[0],arguments[1]);',
+                                              url, data if data else str(data))
+        return self.build_headers(encrypt_params, cookie_str)
+
+    def headers_batch(self, items: [(str, dict | None)]) -> [dict]:
+        """
+        一次执行js生成多个请求的签名头
+        :param items: [(请求的url的地址, 请求参数)]
+        :return: [dict]，顺序和items一样
+        """
+        if not items:
+            return []
+        cookie_str = self.cookie_str
+        with self.timer('js_batch'), self._tabs.tab() as tab:
+            encrypt_list = tab.run_js(
+                'return arguments[0].map(function (item) { return window._webmsxyw(item[0], item[1]); });',
+                [[url, data if data else str(data)] for url, data in items])
+        return [self.build_headers(encrypt_params, cookie_str) for encrypt_params in encrypt_list]
+
+    def build_headers(self, encrypt_params: dict, cookie_str: str | None = None) -> dict:
+        """
+        根据_webmsxyw的结果生成签名头
+        :param encrypt_params: _webmsxyw返回的X-s、X-t
+        :param cookie_str: cookie字符串，不传使用缓存的值
+        :return: dict
+        """
+        if cookie_str is None:
+            cookie_str = self.cookie_str
+        with self.timer('sign'):
+            signs = sign(
+                a1=self._a1,
+                b1=self._b1,
+                x_s=encrypt_params.get("X-s", ""),
+                x_t=str(encrypt_params.get("X-t", ""))
+            )
+        return {
+            "X-S": signs["x-s"],
+            "X-T": signs["x-t"],
+            "x-S-Common": signs["x-s-common"],
+            "X-B3-Traceid": signs["x-b3-traceid"],
+            'Cookie': cookie_str
+        }
+
+    def on_response(self, response):
+        """
+        接口返回了Set-Cookie时同步到浏览器，缓存失效
+        :param response: requests的返回结果
+        """
+        if response is None or not response.headers.get('Set-Cookie'):
+            return
+        self.set_cookies(cookie_list(response.cookies))
+
+    def set_cookies(self, cookies: [dict]):
+        """
+        设置浏览器的cookie，缓存失效
+        :param cookies: [{"name": 名称, "value": 值, "domain": 域名, "path": 路径}]
+        """
+        try:
+            with self._tabs.tab() as tab:
+                tab.set.cookies(cookies)
+        except Exception as e:
+            logger.warning(f'[xhs.SignContext.set_cookies] 同步cookie到浏览器失败:{e}')
+        self.invalidate()
+
+
+def cookie_list(cookie_jar) -> [dict]:
+    """
+    requests返回的cookie转换为可以json序列化的列表
+    """
+    return [{"name": c.name, "value": c.value, "domain": c.domain, "path": c.path} for c in cookie_jar]
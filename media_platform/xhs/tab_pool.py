@@ -0,0 +1,107 @@
+"""
+登录后的浏览器里的标签页池
+所有标签页共用一个浏览器的cookie和登录状态，签名、页面抓取可以在不同的标签页上同时执行
+按先来先得的顺序借出空闲的标签页，不可用的关闭后重新打开
+检查标签页是否可用要多一次和浏览器的通信，只在距离上次检查超过check_interval秒或者上次使用出错后才检查
+"""
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from DrissionPage import ChromiumPage
+from DrissionPage.errors import BaseError
+
+from media_platform.xhs.exception import TabBusyError
+from tools.utils import logger
+
+
+class TabPool:
+
+    def __init__(self, browser: ChromiumPage, url: str, size: int = 2, timeout: float = 30,
+                 ready_js: str = "return typeof window._webmsxyw === 'function';", on_open=None,
+                 check_interval: float = 60):
+        """
+        :param browser: 浏览器
+        :param url: 标签页打开的地址
+        :param size: 标签页的数量
+        :param timeout: 等待空闲标签页的最长时间(秒)
+        :param ready_js: 检查标签页是否可用的js，返回true为可用，默认检查签名函数是否存在
+        :param on_open: 新打开标签页后执行的设置，参数为标签页，重新打开的标签页也会执行
+        :param check_interval: 借出前检查标签页是否可用的最短间隔(秒)
+        """
+        self._browser = browser
+        self._url = url
+        self._timeout = timeout
+        self._ready_js = ready_js
+        self._on_open = on_open
+        self._check_interval = check_interval
+        # 新建和关闭标签页都要通过浏览器的连接，不同线程同时执行时加锁
+        self._lock = threading.Lock()
+        # (标签页, 上次确认可用的时间)
+        self._idle = queue.Queue()
+        self.size = size
+        self.recycled = 0  # 重新打开的标签页数量
+        self.checks = 0  # 借出前检查的次数
+        for _ in range(size):
+            self._idle.put((self._open(), time.monotonic()))
+
+    def _open(self):
+        with self._lock:
+            tab = self._browser.new_tab(self._url)
+        tab.wait.doc_loaded()
+        if self._on_open is not None:
+            self._on_open(tab)
+        return tab
+
+    def healthy(self, tab) -> bool:
+        """
+        标签页是否可用：连接正常，页面的js可以执行并且ready_js返回true
+        """
+        try:
+            return tab.states.is_alive and bool(tab.run_js(self._ready_js))
+        except BaseError:
+            return False
+
+    def recycle(self, tab):
+        """
+        关闭不可用的标签页，重新打开一个
+        :return: 新的标签页
+        """
+        logger.warning(f'[xhs.TabPool.recycle] 标签页{tab.tab_id}不可用，重新打开')
+        with self._lock:
+            try:
+                self._browser.close_tabs(tab.tab_id)
+            except BaseError:
+                pass
+        self.recycled += 1
+        return self._open()
+
+    @contextmanager
+    def tab(self, timeout: float | None = None):
+        """
+        借出一个空闲的标签页，用完自动归还；执行过程中出现浏览器的异常时重新打开后再归还，
+        出现其他异常(如签名函数返回的结果不对)时下次借出前检查是否可用
+        :param timeout: 等待空闲标签页的最长时间(秒)，不传使用初始化时的值
+        """
+        try:
+            tab, checked_at = self._idle.get(timeout=self._timeout if timeout is None else timeout)
+        except queue.Empty:
+            raise TabBusyError(f'{self.size}个标签页都在使用中')
+
+        try:
+            if time.monotonic() - checked_at >= self._check_interval:
+                self.checks += 1
+                if not self.healthy(tab):
+                    tab = self.recycle(tab)
+                checked_at = time.monotonic()
+            yield tab
+        except BaseError:
+            tab = self.recycle(tab)
+            checked_at = time.monotonic()
+            raise
+        except Exception:
+            checked_at = 0.0
+            raise
+        finally:
+            self._idle.put((tab, checked_at))
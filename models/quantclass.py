@@ -25,7 +25,7 @@ class QtcArticleSummary(Base):
     tags: Mapped[str] = Column(String(500), nullable=True, default='', comment="标签")
     category_id: Mapped[int] = Column(Integer, nullable=False, comment="分类ID")
     summary: Mapped[str] = Column(String(1000), nullable=False, comment="简介")
-    aid: Mapped[int] = Column(Integer, nullable=False, comment="文章ID")
+    aid: Mapped[int] = Column(Integer, nullable=False, unique=True, comment="文章ID")
     author_id: Mapped[int] = Column(Integer, nullable=False, comment="作者ID")
     fetch: Mapped[int] = Column(Integer, nullable=True, default=1, comment="1-没抓取内容,2-抓取内容")
     segmentation: Mapped[int] = Column(Integer, nullable=True, default=0, comment="是否已分段,0-否,1-是")
@@ -63,7 +63,7 @@ class TweetSummaries(Base):
                                                    comment="推特发表时间")
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP, nullable=False, default=current_time, comment="创建时间")
     updated_at: Mapped[Optional[datetime]] = mapped_column(TIMESTAMP, nullable=True, onupdate=current_time,comment="更新时间")
-    rest_id: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True, comment="帖子ID")
+    rest_id: Mapped[int] = mapped_column(BigInteger, nullable=False, unique=True, comment="帖子ID")
     user_id: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True, comment="用户ID")
 
 
@@ -74,7 +74,7 @@ class TweetRaw(Base):
     )
 
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True, comment="唯一标识符")
-    content_id: Mapped[int] = mapped_column(BigInteger, nullable=False, comment="引用tweet_summaries表中的内容ID")
+    content_id: Mapped[int] = mapped_column(BigInteger, nullable=False, unique=True, comment="引用tweet_summaries表中的内容ID")
     pid: Mapped[int] = mapped_column(BigInteger, default=0, comment="父内容ID，用于记录回复关系")
     raw_content: Mapped[str] = mapped_column(Text, nullable=False, comment="原文")
 
@@ -13,7 +13,7 @@ class XHSUser(Base):
     __table_args__ = {'comment': '小红书博主'}
 
     id = Column(Integer, primary_key=True, autoincrement=True, comment='自增ID')
-    user_id = Column(String(64), nullable=False, comment='用户ID')
+    user_id = Column(String(64), nullable=False, unique=True, comment='用户ID')
     nickname = Column(String(64), nullable=False, comment='用户昵称')
     location = Column(String(64), nullable=True, comment='所在地')
     desc = Column(Text, nullable=True, comment='用户描述')  # 注意: `desc` 是关键字，所以加了反引号
@@ -29,7 +29,7 @@ class XHSNote(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True, comment='自增ID')
     user_id = Column(String(64), nullable=False, comment='用户ID')
-    note_id = Column(String(64), nullable=False, comment='笔记ID')
+    note_id = Column(String(64), nullable=False, unique=True, comment='笔记ID')
     type = Column(String(16), nullable=True, comment='笔记类型(normal | video)')
     title = Column(String(255), nullable=True, comment='笔记标题')
     desc = Column(Text, nullable=True, comment='笔记描述')
@@ -0,0 +1,139 @@
+"""
+对比OFFSET分页和按id分页(tools.db.keyset_pages)的耗时，以及处理时修改查询条件字段后是否会跳过数据
+默认使用SQLite临时文件数据库，数据和get_not_fetch的查询一样：加精并且没有抓取内容的文章
+python -m scripts.benchmark.keyset_pagination [数据条数] [每页数量]
+"""
+import math
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, insert, update
+from sqlalchemy.orm import Session
+
+from models.quantclass import Base, QtcArticleSummary
+from tools.db import keyset_pages, keyset_page
+
+# 测试OFFSET分页耗时的页，按总页数的比例
+page_ratios = (0, 0.25, 0.5, 0.75, 1)
+
+
+def fill(db: Session, amount: int):
+    now = datetime.now()
+    rows = [{
+        "aid": aid,
+        "title": f'title {aid}',
+        "tags": '',
+        "category_id": aid % 20,
+        "summary": f'summary {aid}',
+        "author_id": aid % 1000,
+        "fetch": 1,
+        "segmentation": 0,
+        "is_essence": 1 if aid % 4 else 2,
+        "add_time": now,
+    } for aid in range(1, amount + 1)]
+    for start in range(0, amount, 10000):
+        db.execute(insert(QtcArticleSummary), rows[start:start + 10000])
+    db.commit()
+
+
+def not_fetch_query(db: Session):
+    return db.query(QtcArticleSummary).where(QtcArticleSummary.is_essence == 1, QtcArticleSummary.fetch == 1)
+
+
+def offset_page(db: Session, page: int, limit: int):
+    # 原来get_not_fetch的写法：每页先COUNT再OFFSET
+    query = not_fetch_query(db)
+    page_total = math.ceil(query.count() / limit)
+    if page > page_total:
+        return []
+    return query.order_by(QtcArticleSummary.id.desc()).offset((page - 1) * limit).limit(limit).all()
+
+
+def timed(fun, rounds: int = 5) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fun()
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def bench_pages(db: Session, limit: int):
+    query = not_fetch_query(db)
+    page_total = math.ceil(query.count() / limit)
+    print(f'共{page_total}页，每页{limit}条')
+    for ratio in page_ratios:
+        page = max(1, int(page_total * ratio))
+        rows = offset_page(db, page, limit)
+        # 按id分页时上一页最后一条的id，和OFFSET分页取到同一页
+        after = rows[0].id + 1
+        db.expunge_all()
+        offset_cost = timed(lambda: offset_page(db, page, limit))
+        keyset_cost = timed(lambda: keyset_page(query, QtcArticleSummary.id, limit, after))
+        print(f'第{page:<7}页 OFFSET {offset_cost:8.2f}毫秒  按id {keyset_cost:6.2f}毫秒')
+
+    start = time.perf_counter()
+    pages = sum(1 for _ in keyset_pages(query, QtcArticleSummary.id, limit))
+    cost = time.perf_counter() - start
+    print(f'按id分页遍历全部{pages}页 耗时{cost:.2f}秒 每页{cost / pages * 1000:.2f}毫秒')
+
+
+def bench_mutation(db: Session, limit: int):
+    """
+    和sync_content一样，每处理一条就设置已抓取，数据不再满足查询条件
+    """
+    def process(rows):
+        ids = [row.id for row in rows]
+        db.execute(update(QtcArticleSummary).where(QtcArticleSummary.id.in_(ids)).values(fetch=2))
+        db.commit()
+        return len(ids)
+
+    def reset():
+        db.execute(update(QtcArticleSummary).values(fetch=1))
+        db.commit()
+
+    total = not_fetch_query(db).count()
+
+    reset()
+    processed = 0
+    page = 1
+    start = time.perf_counter()
+    while True:
+        rows = offset_page(db, page, limit)
+        if not rows:
+            break
+        processed += process(rows)
+        page += 1
+    print(f'OFFSET分页 处理{processed}/{total}条 耗时{time.perf_counter() - start:.2f}秒')
+
+    reset()
+    processed = 0
+    start = time.perf_counter()
+    for rows in keyset_pages(not_fetch_query(db), QtcArticleSummary.id, limit):
+        processed += process(rows)
+    print(f'按id分页   处理{processed}/{total}条 耗时{time.perf_counter() - start:.2f}秒')
+
+
+def main():
+    amount = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    with tempfile.TemporaryDirectory() as path:
+        engine = create_engine(f'sqlite:///{os.path.join(path, "bench.db")}')
+        Base.metadata.create_all(engine, tables=[QtcArticleSummary.__table__])
+        with Session(engine) as db:
+            start = time.perf_counter()
+            fill(db, amount)
+            print(f'写入{amount}条数据 耗时{time.perf_counter() - start:.1f}秒')
+            bench_pages(db, limit)
+
+            # 修改数据的测试OFFSET分页越往后越慢，只用前2万条数据
+            db.execute(update(QtcArticleSummary).where(QtcArticleSummary.aid > 20000).values(is_essence=2))
+            db.commit()
+            bench_mutation(db, limit)
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
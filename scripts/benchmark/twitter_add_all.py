@@ -0,0 +1,87 @@
+"""
+对比ContentServie.add_all批量写入和原来逐条查询写入的耗时
+默认使用SQLite内存数据库，传入数据库地址可以在MySQL上测试，会清空tweet_summaries表
+python -m scripts.benchmark.twitter_add_all [数据库地址] [数据条数]
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, delete, BigInteger
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+
+from models.twitter import Base, TweetSummaries
+from media_platform.twitter.service import ContentServie
+
+# 每页的推特数量
+page_size = 20
+
+
+@compiles(BigInteger, 'sqlite')
+def _compile_big_integer(type_, compiler, **kw):
+    # SQLite只有INTEGER主键才会自增
+    return 'INTEGER'
+
+
+def make_page(start: int, now: datetime) -> [TweetSummaries]:
+    return [
+        TweetSummaries(
+            content=f'tweet {rest_id}',
+            reply_count=rest_id % 7,
+            retweet_count=rest_id % 11,
+            views_count=rest_id % 13,
+            like_count=rest_id % 17,
+            x_created_at=now - timedelta(minutes=rest_id),
+            user_id=rest_id % 300,
+            rest_id=rest_id,
+        )
+        for rest_id in range(start, start + page_size)
+    ]
+
+
+def legacy_add_all(db: Session, data: [TweetSummaries]):
+    """
+    原来的写入方式：每条数据查询一次，存在则更新，不存在则插入
+    """
+    for val in data:
+        info = db.query(TweetSummaries).where(TweetSummaries.rest_id == val.rest_id).first()
+        if info:
+            info.like_count = val.like_count
+            info.reply_count = val.reply_count
+            info.views_count = val.views_count
+            info.retweet_count = val.retweet_count
+            info.x_created_at = val.x_created_at
+        else:
+            db.add(val)
+    db.commit()
+
+
+def run(db: Session, name: str, add_all, amount: int):
+    db.execute(delete(TweetSummaries))
+    db.commit()
+    now = datetime.now()
+
+    # 第一轮全部是新数据，第二轮全部是已存在的数据
+    for action in ('insert', 'update'):
+        start = time.perf_counter()
+        for offset in range(0, amount, page_size):
+            add_all(make_page(offset + 1, now))
+        cost = time.perf_counter() - start
+        print(f'{name:<8}{action:<8}{amount}条 耗时{cost:.3f}秒 {amount / cost:.0f}条/秒')
+
+
+def main():
+    url = sys.argv[1] if len(sys.argv) > 1 else 'sqlite://'
+    amount = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    engine = create_engine(url)
+    Base.metadata.create_all(engine, tables=[TweetSummaries.__table__])
+    with Session(engine) as db:
+        run(db, 'legacy', lambda page: legacy_add_all(db, page), amount)
+        run(db, 'upsert', ContentServie(db).add_all, amount)
+        print(f'数据条数:{db.query(TweetSummaries).count()}')
+
+
+if __name__ == '__main__':
+    main()
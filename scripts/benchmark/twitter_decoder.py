@@ -0,0 +1,148 @@
+"""
+对比UserTweets接口返回数据原来的解析方式和decoder的耗时
+可以传入抓包保存的UserTweets返回内容(json文件)，不传则生成一页同样结构的数据
+python -m scripts.benchmark.twitter_decoder [次数] [json文件...]
+"""
+import json
+import sys
+import time as _time
+
+from media_platform.twitter import decoder
+from tools import time
+
+
+def make_payload(size: int = 20) -> bytes:
+    """
+    生成一页UserTweets返回数据，包含单条、会话、推荐关注和翻页的数据
+    """
+    def tweet(rest_id: int):
+        return {
+            "__typename": "Tweet",
+            "rest_id": str(rest_id),
+            "core": {"user_results": {"result": {"rest_id": "1"}}},
+            "views": {"count": str(rest_id % 1000), "state": "EnabledWithCount"},
+            "legacy": {
+                "id_str": str(rest_id),
+                "full_text": f"tweet {rest_id} " * 10,
+                "created_at": "Tue Apr 17 00:56:17 +0000 2024",
+                "favorite_count": rest_id % 17,
+                "reply_count": rest_id % 7,
+                "retweet_count": rest_id % 11,
+                "quoted_status_id_str": str(rest_id - 1) if rest_id % 5 == 0 else None,
+            },
+        }
+
+    entries = []
+    for i in range(size):
+        rest_id = 1800000000000000000 + i
+        if i % 4 == 0:
+            entries.append({"entryId": f"profile-conversation-{i}", "content": {
+                "entryType": "TimelineTimelineModule",
+                "items": [{"item": {"itemContent": {"tweet_results": {"result": tweet(rest_id)}}}}]}})
+        else:
+            entries.append({"entryId": f"tweet-{rest_id}", "content": {
+                "entryType": "TimelineTimelineItem",
+                "itemContent": {"itemType": "TimelineTweet", "tweet_results": {"result": tweet(rest_id)}}}})
+    entries.append({"entryId": "who-to-follow-1", "content": {"entryType": "TimelineTimelineModule", "items": []}})
+    entries.append({"entryId": "cursor-bottom", "content": {
+        "entryType": "TimelineTimelineCursor", "cursorType": "Bottom", "value": "DAABCgABGSw"}})
+
+    instructions = [{"type": "TimelineClearCache"}, {"type": "TimelineAddEntries", "entries": entries}]
+    data = {"data": {"user": {"result": {"timeline_v2": {"timeline": {"instructions": instructions}}}}}}
+    return json.dumps(data).encode()
+
+
+def legacy_decode(content: bytes, user_id: int):
+    """
+    原来的解析方式：response.json()之后逐层取值，返回dict列表
+    """
+    result = json.loads(content)
+    instructions = result["data"]["user"]["result"]["timeline_v2"]["timeline"]["instructions"]
+    entries = []
+    for timeline in instructions:
+        if timeline["type"] == "TimelineAddEntries":
+            entries = timeline["entries"]
+
+    data = []
+    next_cursor = ''
+    for v in entries:
+        if v["content"]["entryType"] == "TimelineTimelineModule":
+            if v["entryId"].startswith("who-to-follow"):
+                continue
+            if v["content"]["items"][0]["item"]["itemContent"]["tweet_results"]["result"]['__typename'] == 'Tweet':
+                tweet = v["content"]["items"][0]["item"]["itemContent"]["tweet_results"]["result"]
+            else:
+                tweet = v["content"]["items"][0]["item"]["itemContent"]["tweet_results"]["result"]['tweet']
+            legacy = tweet["legacy"]
+            views = tweet["views"]
+            data.append({
+                "content": legacy["full_text"],
+                "created_at": time.convert_to_ymd(legacy["created_at"]),
+                "favorite_count": legacy["favorite_count"],
+                "reply_count": legacy["reply_count"],
+                "retweet_count": legacy["retweet_count"],
+                "views_count": 0 if views["state"] == "Enabled" else views['count'],
+                "id": int(tweet["rest_id"]),
+                "user_id": int(user_id),
+                "retweeted_id": 0,
+            })
+        elif v["content"]["entryType"] == "TimelineTimelineItem":
+            if v["content"]["itemContent"]["tweet_results"]["result"].get('core', -1) == -1:
+                continue
+            legacy = v["content"]["itemContent"]["tweet_results"]["result"]["legacy"]
+            views = v["content"]["itemContent"]["tweet_results"]["result"]["views"]
+            retweeted_id = 0
+            if legacy.get("quoted_status_id_str"):
+                retweeted_id = legacy["quoted_status_id_str"]
+            elif legacy.get("retweeted_status_result"):
+                retweeted_id = legacy["retweeted_status_result"]["result"]["rest_id"]
+            data.append({
+                "content": legacy["full_text"],
+                "created_at": time.convert_to_ymd(legacy["created_at"]),
+                "favorite_count": legacy["favorite_count"],
+                "reply_count": legacy["reply_count"],
+                "retweet_count": legacy["retweet_count"],
+                "views_count": 0 if views["state"] == "Enabled" else views["count"],
+                "id": int(legacy["id_str"]),
+                "user_id": int(user_id),
+                "retweeted_id": retweeted_id,
+            })
+        elif v["content"]["entryType"] == "TimelineTimelineCursor" and v["content"]["cursorType"] == "Bottom":
+            next_cursor = v["content"]["value"]
+    return data, next_cursor
+
+
+def new_decode(content: bytes, user_id: int):
+    return decoder.decode_user_tweets(decoder.loads(content), user_id)
+
+
+def bench(name: str, fun, payloads: [bytes], rounds: int):
+    start = _time.perf_counter()
+    for _ in range(rounds):
+        for payload in payloads:
+            fun(payload, 1)
+    cost = _time.perf_counter() - start
+    pages = rounds * len(payloads)
+    print(f'{name:<8}{pages}页 耗时{cost:.3f}秒 每页{cost / pages * 1e6:.1f}微秒')
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    payloads = [open(path, 'rb').read() for path in sys.argv[2:]] or [make_payload()]
+
+    # 两种方式解析出来的数据要一致
+    for payload in payloads:
+        old, old_cursor = legacy_decode(payload, 1)
+        new, new_cursor = new_decode(payload, 1)
+        assert old_cursor == new_cursor and len(old) == len(new)
+        for o, n in zip(old, new):
+            assert (o["id"], o["content"], o["favorite_count"], int(o["views_count"])) == \
+                   (n.id, n.content, n.favorite_count, n.views_count)
+
+    print(f'json后端:{"orjson" if hasattr(decoder, "orjson") else "json"}')
+    bench('legacy', legacy_decode, payloads, rounds)
+    bench('decoder', new_decode, payloads, rounds)
+
+
+if __name__ == '__main__':
+    main()
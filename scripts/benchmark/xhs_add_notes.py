@@ -0,0 +1,115 @@
+"""
+对比NoteService.add_notes批量写入和原来add_note逐条写入的耗时
+默认使用SQLite内存数据库和进程内的缓存，传入数据库地址可以在MySQL上测试，会清空xhs_note表；传入Redis地址时使用Redis
+python -m scripts.benchmark.xhs_add_notes [数据库地址] [数据条数] [Redis地址]
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+from redis import Redis
+from sqlalchemy import create_engine, delete
+from sqlalchemy.orm import Session
+
+from models.xhs import Base, XHSNote
+from media_platform.xhs.service import NoteService
+
+# 每批写入的数量，和搜索接口一页的数量一样
+batch_size = 20
+
+
+class MemoryCache:
+    """
+    只实现NoteService用到的方法，测试时不依赖Redis服务
+    """
+
+    def __init__(self):
+        self._data = {}
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def set(self, key, value, ex=None):
+        self._data[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self._data.pop(key, None)
+
+    def pipeline(self, transaction=True):
+        return _MemoryPipeline(self)
+
+
+class _MemoryPipeline:
+
+    def __init__(self, cache: MemoryCache):
+        self._cache = cache
+        self._commands = []
+
+    def delete(self, *keys):
+        self._commands.append(keys)
+
+    def execute(self):
+        for keys in self._commands:
+            self._cache.delete(*keys)
+        self._commands = []
+
+
+def make_batch(start: int, now: datetime, liked: int) -> [XHSNote]:
+    return [
+        XHSNote(
+            note_id=f'{note_id:024x}',
+            user_id=f'{note_id % 500:024x}',
+            type='normal',
+            title=f'note {note_id}',
+            desc=f'note {note_id} ' * 20,
+            liked_count=liked + note_id % 100,
+            collected_count=note_id % 50,
+            comment_count=note_id % 30,
+            image_list=[{"url": f"https://example.com/{note_id}.jpg"}],
+            tag_list=[{"name": "家居"}],
+            note_url=f'https://www.xiaohongshu.com/explore/{note_id:024x}',
+            source_keyword='家居',
+            last_update_time=now - timedelta(minutes=note_id),
+            add_time=now - timedelta(days=1, minutes=note_id),
+        )
+        for note_id in range(start, start + batch_size)
+    ]
+
+
+def run(db: Session, name: str, add_notes, amount: int):
+    db.execute(delete(XHSNote))
+    db.commit()
+    now = datetime.now()
+
+    # 第一轮全部是新数据，第二轮全部是已存在的数据
+    for action, liked in (('insert', 500), ('update', 600)):
+        start = time.perf_counter()
+        for offset in range(0, amount, batch_size):
+            add_notes(make_batch(offset + 1, now, liked))
+        cost = time.perf_counter() - start
+        print(f'{name:<8}{action:<8}{amount}条 耗时{cost:.3f}秒 {amount / cost:.0f}条/秒')
+
+
+def main():
+    url = sys.argv[1] if len(sys.argv) > 1 else 'sqlite://'
+    amount = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    redis = Redis.from_url(sys.argv[3], decode_responses=True) if len(sys.argv) > 3 else MemoryCache()
+
+    engine = create_engine(url)
+    Base.metadata.create_all(engine, tables=[XHSNote.__table__])
+    with Session(engine) as db:
+        service = NoteService(db, redis)
+
+        def legacy_add_notes(notes: [XHSNote]):
+            for note in notes:
+                service.add_note(note)
+
+        run(db, 'legacy', legacy_add_notes, amount)
+        run(db, 'upsert', service.add_notes, amount)
+        print(f'数据条数:{db.query(XHSNote).count()} '
+              f'点赞数:{db.query(XHSNote).order_by(XHSNote.id).first().liked_count}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+对比浏览器抓取笔记详情原来每条新建标签页和复用详情页标签页的耗时
+需要可用的小红书cookie，先按关键词搜索一页笔记，再用两种方式分别打开每条笔记
+python -m scripts.benchmark.xhs_note_detail [关键词] [笔记数量]
+"""
+import statistics
+import sys
+import time
+
+from database import get_db, get_redis
+from media_platform.xhs.crawler import XHSCrawler
+from media_platform.xhs.exception import DataFetchError
+from tools.cookie_pool import get_cookie_by_platform
+
+
+def legacy_detail(crawler: XHSCrawler, note_id: str, xsec_token: str):
+    """
+    原来的方式：每条笔记新建标签页，完整加载页面后读取数据再关闭
+    """
+    browser = crawler.context_page
+    tab = browser.new_tab()
+    tab.get(f"https://www.xiaohongshu.com/explore/{note_id}?xsec_token={xsec_token}"
+            f"&xsec_source=pc_search&source=web_explore_feed")
+    data_dict = tab.run_js('return window.__INITIAL_STATE__')
+    browser.close_tabs(tab.tab_id)
+    return data_dict['note']['noteDetailMap'][note_id]['note']
+
+
+def pooled_detail(crawler: XHSCrawler, note_id: str, xsec_token: str):
+    return crawler.xhs_client.browser_get_note_detail(note_id, 'pc_search', xsec_token)
+
+
+def bench(name: str, fun, crawler: XHSCrawler, notes: [dict]):
+    costs = []
+    failed = 0
+    for note in notes:
+        start = time.perf_counter()
+        try:
+            fun(crawler, note['id'], note['xsec_token'])
+        except (DataFetchError, KeyError, TypeError):
+            failed += 1
+            continue
+        costs.append((time.perf_counter() - start) * 1000)
+        time.sleep(1)
+
+    if not costs:
+        print(f'{name:<8}全部失败')
+        return
+    costs.sort()
+    print(f'{name:<8}{len(costs)}条 失败{failed}条 平均{statistics.mean(costs):.0f}毫秒 '
+          f'p50 {costs[len(costs) // 2]:.0f}毫秒 p90 {costs[int(len(costs) * 0.9)]:.0f}毫秒 '
+          f'最大{costs[-1]:.0f}毫秒')
+
+
+def main():
+    keyword = sys.argv[1] if len(sys.argv) > 1 else 'web3'
+    amount = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    cookie_pool = get_cookie_by_platform('xhs')
+    if len(cookie_pool) == 0:
+        print('没有可用的cookie')
+        return
+
+    crawler = XHSCrawler(cookie_pool[0].value, get_db(), get_redis())
+    notes = crawler.search_by_api(keyword)['note_ids'][:amount]
+    print(f'关键词:{keyword} 笔记{len(notes)}条')
+
+    bench('legacy', legacy_detail, crawler, notes)
+    bench('pooled', pooled_detail, crawler, notes)
+    print(crawler.xhs_client.sign_stats())
+
+
+if __name__ == '__main__':
+    main()
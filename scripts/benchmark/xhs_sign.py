@@ -0,0 +1,215 @@
+"""
+小红书签名函数mrc、b64Encode、encodeUtf8的正确性检查和耗时对比
+先用固定的测试数据和随机数据检查新的实现和原来逐字节计算的实现结果完全一样，再对比耗时
+python -m scripts.benchmark.xhs_sign [次数]
+"""
+import ctypes
+import json
+import random
+import string
+import sys
+import time
+import urllib.parse
+
+from media_platform.xhs import help
+
+# 固定的测试数据：(mrc的输入, mrc的结果)，结果由原来的实现计算
+GOLDEN_MRC = [
+    ('1729000000000XYW_eyJzaWduU3ZuIjoiNTEiLCJzaWduVHlwZSI6IngyIiwiYXBwSWQiOiJ4aHMtcGMtd2ViIn0=', -3943381333),
+    ('xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx', -1503792536),
+    ('000000000000000000000000000000000000000000000000000000000tail', -626740341),
+    ('ÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿÿé', -3354455265),
+    ('1780774726074XYW_iCgfrp0uA9J+maDDKnV4blgRtVbSsxitWtVpGN4IGfVFrl9Ttbiv1qb+YIFoYkjdY4SSr4jBT9smUjRqIMaUdhO3xVMjdxU0Ni7wJDEI4MHEcHSOMEq3LoTVLlGizw6rsFCQkiufA+ZOOS7EX1EFgBJeBdcQf7RmPwmP6+eX2YCTqUk6tvzyABQBMgJT4S=xtv/qyAvYbw9vyyimx2eb=nuyYzA2p5kqUu1llAgBtJx+35yo5pja8xYRJTMNf3lDv9fo2s9U=tTBp6pvnLqivdtOYjsVp/CCCx83Xv4mBxXAiTzowBQdqSten8sE1q7PFnSGKRw90Z0J+RoTea2M+fvdaAkWiNL6i64YeOQ6l4rOD0kUvKrhGCecf5GTzDVlfvRBCBAaL/h', -73950366),
+]
+
+# 固定的测试数据：(字符串, b64Encode(encodeUtf8(字符串))的结果)，结果由原来的实现计算
+GOLDEN_B64 = [
+    ('', ''),
+    ('a', 'Gc=='),
+    ('ab', 'GnH='),
+    ('abc', 'GnQ0'),
+    ('小红书', 'EJsOEvxjENff'),
+    ('{"x1":"3.7.8-2","x9":-123}', '2UQhPaHCH0P1+UhhN/HjNsQhwaHCN/rUP7F='),
+    ("~()*!.'-_ %/?&=+", 'KjWktjr1QUMKHsL6OUGRtI=='),
+    ('😀é\n\t', 'uQXGWPwksWD='),
+]
+
+
+def legacy_mrc(e):
+    ie = [
+        0, 1996959894, 3993919788, 2567524794, 124634137, 1886057615, 3915621685,
+        2657392035, 249268274, 2044508324, 3772115230, 2547177864, 162941995,
+        2125561021, 3887607047, 2428444049, 498536548, 1789927666, 4089016648,
+        2227061214, 450548861, 1843258603, 4107580753, 2211677639, 325883990,
+        1684777152, 4251122042, 2321926636, 335633487, 1661365465, 4195302755,
+        2366115317, 997073096, 1281953886, 3579855332, 2724688242, 1006888145,
+        1258607687, 3524101629, 2768942443, 901097722, 1119000684, 3686517206,
+        2898065728, 853044451, 1172266101, 3705015759, 2882616665, 651767980,
+        1373503546, 3369554304, 3218104598, 565507253, 1454621731, 3485111705,
+        3099436303, 671266974, 1594198024, 3322730930, 2970347812, 795835527,
+        1483230225, 3244367275, 3060149565, 1994146192, 31158534, 2563907772,
+        4023717930, 1907459465, 112637215, 2680153253, 3904427059, 2013776290,
+        251722036, 2517215374, 3775830040, 2137656763, 141376813, 2439277719,
+        3865271297, 1802195444, 476864866, 2238001368, 4066508878, 1812370925,
+        453092731, 2181625025, 4111451223, 1706088902, 314042704, 2344532202,
+        4240017532, 1658658271, 366619977, 2362670323, 4224994405, 1303535960,
+        984961486, 2747007092, 3569037538, 1256170817, 1037604311, 2765210733,
+        3554079995, 1131014506, 879679996, 2909243462, 3663771856, 1141124467,
+        855842277, 2852801631, 3708648649, 1342533948, 654459306, 3188396048,
+        3373015174, 1466479909, 544179635, 3110523913, 3462522015, 1591671054,
+        702138776, 2966460450, 3352799412, 1504918807, 783551873, 3082640443,
+        3233442989, 3988292384, 2596254646, 62317068, 1957810842, 3939845945,
+        2647816111, 81470997, 1943803523, 3814918930, 2489596804, 225274430,
+        2053790376, 3826175755, 2466906013, 167816743, 2097651377, 4027552580,
+        2265490386, 503444072, 1762050814, 4150417245, 2154129355, 426522225,
+        1852507879, 4275313526, 2312317920, 282753626, 1742555852, 4189708143,
+        2394877945, 397917763, 1622183637, 3604390888, 2714866558, 953729732,
+        1340076626, 3518719985, 2797360999, 1068828381, 1219638859, 3624741850,
+        2936675148, 906185462, 1090812512, 3747672003, 2825379669, 829329135,
+        1181335161, 3412177804, 3160834842, 628085408, 1382605366, 3423369109,
+        3138078467, 570562233, 1426400815, 3317316542, 2998733608, 733239954,
+        1555261956, 3268935591, 3050360625, 752459403, 1541320221, 2607071920,
+        3965973030, 1969922972, 40735498, 2617837225, 3943577151, 1913087877,
+        83908371, 2512341634, 3803740692, 2075208622, 213261112, 2463272603,
+        3855990285, 2094854071, 198958881, 2262029012, 4057260610, 1759359992,
+        534414190, 2176718541, 4139329115, 1873836001, 414664567, 2282248934,
+        4279200368, 1711684554, 285281116, 2405801727, 4167216745, 1634467795,
+        376229701, 2685067896, 3608007406, 1308918612, 956543938, 2808555105,
+        3495958263, 1231636301, 1047427035, 2932959818, 3654703836, 1088359270,
+        936918000, 2847714899, 3736837829, 1202900863, 817233897, 3183342108,
+        3401237130, 1404277552, 615818150, 3134207493, 3453421203, 1423857449,
+        601450431, 3009837614, 3294710456, 1567103746, 711928724, 3020668471,
+        3272380065, 1510334235, 755167117,
+    ]
+    o = -1
+
+    def right_without_sign(num: int, bit: int = 0) -> int:
+        val = ctypes.c_uint32(num).value >> bit
+        MAX32INT = 4294967295
+        return (val + (MAX32INT + 1)) % (2 * (MAX32INT + 1)) - MAX32INT - 1
+
+    for n in range(57):
+        o = ie[(o & 255) ^ ord(e[n])] ^ right_without_sign(o, 8)
+    return o ^ -1 ^ 3988292384
+
+
+_LEGACY_LOOKUP = ['Z', 'm', 's', 'e', 'r', 'b', 'B', 'o', 'H', 'Q', 't', 'N', 'P', '+', 'w', 'O', 'c', 'z', 'a', '/', 'L', 'p', 'n', 'g', 'G', '8', 'y', 'J', 'q', '4', '2', 'K', 'W', 'Y', 'j', '0', 'D', 'S', 'f', 'd', 'i', 'k', 'x', '3', 'V', 'T', '1', '6', 'I', 'l', 'U', 'A', 'F', 'M', '9', '7', 'h', 'E', 'C', 'v', 'u', 'R', 'X', '5']
+
+
+def _triplet_to_base64(e):
+    return (
+            _LEGACY_LOOKUP[63 & (e >> 18)] +
+            _LEGACY_LOOKUP[63 & (e >> 12)] +
+            _LEGACY_LOOKUP[(e >> 6) & 63] +
+            _LEGACY_LOOKUP[e & 63]
+    )
+
+
+def _encode_chunk(e, t, r):
+    m = []
+    for b in range(t, r, 3):
+        n = (16711680 & (e[b] << 16)) + \
+            ((e[b + 1] << 8) & 65280) + (e[b + 2] & 255)
+        m.append(_triplet_to_base64(n))
+    return ''.join(m)
+
+
+def legacy_b64encode(e):
+    P = len(e)
+    W = P % 3
+    U = []
+    z = 16383
+    H = 0
+    Z = P - W
+    while H < Z:
+        U.append(_encode_chunk(e, H, Z if H + z > Z else H + z))
+        H += z
+    if 1 == W:
+        F = e[P - 1]
+        U.append(_LEGACY_LOOKUP[F >> 2] + _LEGACY_LOOKUP[(F << 4) & 63] + "==")
+    elif 2 == W:
+        F = (e[P - 2] << 8) + e[P - 1]
+        U.append(_LEGACY_LOOKUP[F >> 10] + _LEGACY_LOOKUP[63 & (F >> 4)] +
+                 _LEGACY_LOOKUP[(F << 2) & 63] + "=")
+    return "".join(U)
+
+
+def legacy_encode_utf8(e):
+    b = []
+    m = urllib.parse.quote(e, safe='~()*!.\'')
+    w = 0
+    while w < len(m):
+        T = m[w]
+        if T == "%":
+            E = m[w + 1] + m[w + 2]
+            S = int(E, 16)
+            b.append(S)
+            w += 2
+        else:
+            b.append(ord(T[0]))
+        w += 1
+    return b
+
+
+def random_sign_input() -> str:
+    """
+    和签名时mrc的输入一样：x-t + x-s + b1
+    """
+    x_t = str(random.randint(1700000000000, 1800000000000))
+    x_s = 'XYW_' + ''.join(random.choices(string.ascii_letters + string.digits + '+/=', k=random.randint(60, 200)))
+    b1 = ''.join(random.choices(string.ascii_letters + string.digits + '+/=', k=random.randint(0, 400)))
+    return x_t + x_s + b1
+
+
+def random_text() -> str:
+    chars = string.printable + '小红书笔记😀éß'
+    return ''.join(random.choices(chars, k=random.randint(0, 600)))
+
+
+def check(vectors: int):
+    for text, expected in GOLDEN_MRC:
+        assert help.mrc(text) == expected, text
+    for text, expected in GOLDEN_B64:
+        assert help.b64Encode(help.encodeUtf8(text)) == expected, text
+
+    for _ in range(vectors):
+        text = random_sign_input()
+        assert help.mrc(text) == legacy_mrc(text), text
+        text = random_text()
+        encoded = legacy_encode_utf8(text)
+        assert help.encodeUtf8(text) == encoded, text
+        assert help.b64Encode(encoded) == legacy_b64encode(encoded), text
+        assert help.b64Encode(text.encode('utf-8')) == legacy_b64encode(encoded), text
+    print(f'固定数据{len(GOLDEN_MRC) + len(GOLDEN_B64)}条，随机数据{vectors}条，结果一致')
+
+
+def bench(name: str, fun, args: list, rounds: int):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for arg in args:
+            fun(arg)
+    cost = time.perf_counter() - start
+    calls = rounds * len(args)
+    print(f'{name:<18}{calls}次 耗时{cost:.3f}秒 每次{cost / calls * 1e6:.1f}微秒')
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    random.seed(0)
+    check(2000)
+
+    mrc_inputs = [random_sign_input() for _ in range(50)]
+    # x-s-common编码前的json，和sign里的一样
+    common_inputs = [json.dumps({
+        "s0": 3, "s1": "", "x0": "1", "x1": "3.7.8-2", "x2": "Mac OS", "x3": "xhs-pc-web", "x4": "4.27.2",
+        "x5": "a" * 52, "x6": text[:13], "x7": text[13:], "x8": "b" * 200, "x9": help.mrc(text), "x10": 154,
+    }, separators=(',', ':')) for text in mrc_inputs]
+
+    bench('legacy mrc', legacy_mrc, mrc_inputs, rounds)
+    bench('mrc', help.mrc, mrc_inputs, rounds)
+    bench('legacy x-s-common', lambda text: legacy_b64encode(legacy_encode_utf8(text)), common_inputs, rounds)
+    bench('x-s-common', lambda text: help.b64Encode(text.encode('utf-8')), common_inputs, rounds)
+
+
+if __name__ == '__main__':
+    main()
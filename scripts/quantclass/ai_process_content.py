@@ -4,10 +4,10 @@ ai对数据进行处理
  文章转化向量存入向量数据库
 """
 import argparse
-import math
 import json
 from pymilvus import DataType, FieldSchema
 
+from tools.db import keyset_pages
 from tools.utils import logger
 from models import quantclass
 from database import get_db, get_redis
@@ -52,15 +52,12 @@ def extract_tags():
         return
 
     limit = 30
-    max_page = math.ceil(amount / limit)
-    logger.debug(f"[scripts.qtc.ai_process_content.extract_tags] 一共有{amount}条数据需要处理，需要循环{max_page}次")
+    logger.debug(f"[scripts.qtc.ai_process_content.extract_tags] 一共有{amount}条数据需要处理，1页处理{limit}条数据")
 
-    for page in range(0, max_page):
-        logger.debug(f"[scripts.qtc.ai_process_content.extract_tags] 当前处理第{page + 1}页数据，1页处理{limit}条数据")
-        start_page = page * limit
-        summary_list = query.limit(limit).offset(start_page).all()
+    # 处理后标签不再为空，按id分页，不会跳过后面的数据
+    for page, summary_list in enumerate(keyset_pages(query, quantclass.QtcArticleSummary.id, limit)):
         logger.debug(
-            f"[scripts.qtc.ai_process_content.extract_tags] {len(summary_list)}条数据,limit={limit},offset={start_page}")
+            f"[scripts.qtc.ai_process_content.extract_tags] 当前处理第{page + 1}页数据,{len(summary_list)}条数据")
         ai_extract_tags(summary_list)
 
 
@@ -70,8 +67,7 @@ def ai_extract_tags(summaries):
         try:
             tags_json = json.loads(tags_str)
             tag = ','.join(tags_json['tags'])
-            summary.tags = tag
-            db.commit()
+            summary_service.set_tags(summary.aid, tag)
             logger.debug(f'[scripts.qtc.ai_process_content.ai_extract_tags],id={summary.id}. ai转换标签[{tag}]')
         except Exception as e:
             logger.error(f'[scripts.qtc.ai_process_content.ai_extract_tags] 转换json格式失败. {tags_str}')
@@ -94,15 +90,12 @@ def segmentation():
         logger.info("[scripts.qtc.ai_process_content.segmentation] 没有要处理的文章了")
         return
     limit = 30
-    max_page = math.ceil(amount / limit)
-    logger.debug(f"[scripts.qtc.ai_process_content.segmentation] 一共有{amount}条数据需要处理，需要循环{max_page}次")
+    logger.debug(f"[scripts.qtc.ai_process_content.segmentation] 一共有{amount}条数据需要处理，1页处理{limit}条数据")
 
-    for page in range(0, max_page):
-        logger.debug(f"[scripts.qtc.ai_process_content.segmentation] 当前处理第{page + 1}页数据，1页处理{limit}条数据")
-        start_page = page * limit
-        summary_list = query.limit(limit).offset(start_page).all()
+    # 分段后segmentation不再为0，按id分页，不会跳过后面的数据
+    for page, summary_list in enumerate(keyset_pages(query, quantclass.QtcArticleSummary.id, limit)):
         logger.debug(
-            f"[scripts.qtc.ai_process_content.segmentation] {len(summary_list)}条数据,limit={limit},offset={start_page}")
+            f"[scripts.qtc.ai_process_content.segmentation] 当前处理第{page + 1}页数据,{len(summary_list)}条数据")
 
         for summary in summary_list:
             content = db.query(quantclass.QtcArticleContent).where(
@@ -171,15 +164,11 @@ def embedding(collection_name):
         logger.info("[scripts.qtc.ai_process_content.embedding] 没有要处理的文章段落了")
         return
     limit = 30
-    max_page = math.ceil(amount / limit)
-    logger.debug(f"[scripts.qtc.ai_process_content.segmentation] 一共有{amount}条数据需要处理，需要循环{max_page}次")
+    logger.debug(f"[scripts.qtc.ai_process_content.embedding] 一共有{amount}条数据需要处理，1页处理{limit}条数据")
 
-    for page in range(0, max_page):
-        logger.debug(f"[scripts.qtc.ai_process_content.segmentation] 当前处理第{page + 1}页数据，1页处理{limit}条数据")
-        start_page = page * limit
-        segment_list = query.limit(limit).offset(start_page).all()
+    for page, segment_list in enumerate(keyset_pages(query, quantclass.ArticleSegmentation.id, limit)):
         logger.debug(
-            f"[scripts.qtc.ai_process_content.segmentation] {len(segment_list)}条数据,limit={limit},offset={start_page}")
+            f"[scripts.qtc.ai_process_content.embedding] 当前处理第{page + 1}页数据,{len(segment_list)}条数据")
 
         for segment in segment_list:
             try:
@@ -5,11 +5,10 @@ import argparse
 
 from database import get_db, get_redis
 from tools.utils import logger
-from tools.time import random_wait
-from models.quantclass import QtcArticleSummary
+from tools.pacer import RatePacer
 from media_platform.quantclass.crawler import QuantClassCrawler
+from media_platform.quantclass.pipeline import ArticleListPipeline
 from media_platform.quantclass.service import ArticleSummaryService, CategoryService
-from media_platform.quantclass.exception import DataFetchError
 
 db = get_db()
 redis = get_redis()
@@ -18,47 +17,24 @@ summary_service = ArticleSummaryService(db, redis)
 category_service = CategoryService(db, redis)
 
 
-def fetch_data_by_cid(cid: int, cname: str, days: int):
-    page = 1
-    max_loop = 100  # 最大循环次数
-    while max_loop > 0:
-        article_list = crawler.get_article_by_list(page, 50, cid, 0, days)
-        logger.info(f'获取分类:{cname},第{page}/{article_list["total_page"]}页的文章列表')
-
-        if article_list['page_length'] == 0:
-            logger.info(f'cid={cid}数据抓取完毕!')
-            return ''
-        write_database(article_list['summary'])
-
-        page += 1
-        max_loop -= 1
-        random_wait(2, 4)
-
-
-def write_database(data: [QtcArticleSummary]):
-    amount = len(data)
-    logger.debug(f'文章内容写入数据库：{amount}')
-    result = summary_service.add(data)
-    if result is False:
-        logger.error(f'文章内容插入失败')
-
-
-def main(cid_arr, days):
+def main(cid_arr, days, workers, rate):
+    categories = []
     for cid in cid_arr:
-        try:
-            if cid == 0:
-                cname = '全部数据'
-            else:
-                # 获取分类信息
-                cate_info = category_service.get_by_id(cid)
-                cname = cate_info.name
-                if cate_info is None:
-                    logger.error(f'{cid}未知的分类id')
-                    continue
-            # 获取数据
-            fetch_data_by_cid(cid, cname, days)
-        except DataFetchError as e:
-            logger.error(f'获取cid={cid}得到错误。{e}')
+        if cid == 0:
+            categories.append((cid, '全部数据'))
+            continue
+        # 获取分类信息
+        cate_info = category_service.get_by_id(cid)
+        if cate_info is None:
+            logger.error(f'{cid}未知的分类id')
+            continue
+        categories.append((cid, cate_info.name))
+
+    # 所有分类和页共用一个限速
+    pacer = RatePacer(rate, burst=workers, jitter=0.3)
+    pipeline = ArticleListPipeline(crawler, summary_service, pacer, workers=workers)
+    stats = pipeline.run(categories, days)
+    logger.info(f'文章列表抓取完毕:{stats},缓存:{summary_service.cache.stats()}')
 
 
 if __name__ == '__main__':
@@ -68,6 +44,8 @@ if __name__ == '__main__':
     # 添加数组类型的参数，使用 nargs='+' 表示接受一个或多个参数
     parser.add_argument('--cid', type=int, nargs='+', default=[0], help='传入要抓取的分类id')
     parser.add_argument('--days', type=int, default=0, help='传入要抓取几天内的数据，0表示抓取所有数据')
+    parser.add_argument('--workers', type=int, default=4, help='同时请求的线程数')
+    parser.add_argument('--rate', type=float, default=1.0, help='所有线程合计每秒请求的次数')
 
     # 解析参数
     args = parser.parse_args()
@@ -77,4 +55,4 @@ if __name__ == '__main__':
     else:
         logger.info(f'抓取分类{args.cid},抓取{args.days}天内的数据')
 
-    main(args.cid, args.days)
+    main(args.cid, args.days, args.workers, args.rate)
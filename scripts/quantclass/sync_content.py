@@ -16,7 +16,7 @@ redis = get_redis()
 crawler = QuantClassCrawler(db, redis)
 summary_service = ArticleSummaryService(db, redis)
 content_service = ArticleContentService(db)
-cache_key = 'qtc_sync_content'
+cache_key = 'qtc_sync_content_last_id'
 
 
 def fetch_data_by_aid(aid: int, title: str, headers: dict):
@@ -36,24 +36,22 @@ def main(headers):
     if not crawler.is_login(headers):
         logger.error(f'[qtc.scripts.sync_content] 认证信息错误')
         raise AUTHENError('[qtc.scripts.sync_content] 认证信息错误')
-    page = redis.get(cache_key)
-    start_page = int(page) if page else 1
+    # 记录处理到的文章id，中断后从这里继续
+    last_id = redis.get(cache_key)
+    last_id = int(last_id) if last_id else None
     while True:
-        logger.debug(f'[qtc.scripts.sync_content] 开始获取第{start_page}页数据')
-        page_total, data = summary_service.get_not_fetch(start_page)
+        logger.debug(f'[qtc.scripts.sync_content] 开始获取id小于{last_id}的数据')
+        data = summary_service.get_not_fetch(last_id)
         # 没有可抓取的数据直接返回
-        if page_total == 0:
+        if not data:
             redis.delete(cache_key)
             logger.info('[qtc.scripts.sync_content] 没有可抓取的数据')
             return
+        last_id = data[-1].id
         # 通过接口获取数据
         for article in data:
             fetch_data_by_aid(article.aid, article.title, headers)
-        start_page += 1
-        if start_page > page_total or data is None:
-            redis.delete(cache_key)
-            return
-        redis.set(cache_key, start_page, 86400)
+        redis.set(cache_key, last_id, 86400)
 
 
 if __name__ == '__main__':
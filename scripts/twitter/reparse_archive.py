@@ -0,0 +1,60 @@
+"""
+从归档的接口原始返回内容重新解析数据，补全tweet_summaries、tweet_raw和x_users表，不消耗接口次数
+解析逻辑修改或者增加字段后执行一次即可，不用重新抓取
+python -m scripts.twitter.reparse_archive [接口名] [用户id或帖子id]
+"""
+import sys
+
+from config import settings
+from database import get_db
+from media_platform.twitter import decoder
+from media_platform.twitter.archive import ResponseArchive
+from media_platform.twitter.crawler import TwitterCrawler
+from media_platform.twitter.exception import DataAddError
+from media_platform.twitter.service import UserService, ContentServie
+from tools.utils import logger
+
+db = get_db()
+
+user_service = UserService(db)
+content_service = ContentServie(db)
+
+
+def reparse(archive: ResponseArchive, endpoint: str | None = None, key: str | None = None):
+    pages = 0
+    tweets = 0
+    raws = 0
+    users = 0
+    for item, content in archive.iter_records(endpoint, key):
+        data = decoder.loads(content)
+        try:
+            if item["endpoint"] == 'UserTweets':
+                records, _ = decoder.decode_user_tweets(data, item["key"])
+                tweets += content_service.add_all(TwitterCrawler.to_summaries(records))
+                raws += content_service.add_raw_all({record.id: record.content for record in records})
+            elif item["endpoint"] == 'TweetDetail':
+                # 详情里是完整的原文，长推特也不会被截断
+                text = decoder.decode_tweet_detail(data)
+                if text:
+                    raws += content_service.add_raw_all({int(item["key"]): text})
+            elif item["endpoint"] == 'Following':
+                user_list, _ = decoder.decode_following(data)
+                user_service.add_all(user_list)
+                users += len(user_list)
+        except (DataAddError, KeyError, TypeError) as e:
+            logger.error(f'[script.twitter.reparse_archive] 解析{item["endpoint"]}失败,'
+                         f'key={item["key"]},cursor={item["cursor"]}:{str(e)}')
+            continue
+        pages += 1
+
+    logger.info(f'[script.twitter.reparse_archive] 解析{pages}页数据,推特{tweets}条,原文{raws}条,用户{users}个')
+
+
+if __name__ == '__main__':
+    if not settings.TWITTER_ARCHIVE_DIR:
+        logger.error('[script.twitter.reparse_archive] 没有配置TWITTER_ARCHIVE_DIR')
+        sys.exit(1)
+
+    reparse(ResponseArchive(settings.TWITTER_ARCHIVE_DIR),
+            sys.argv[1] if len(sys.argv) > 1 else None,
+            sys.argv[2] if len(sys.argv) > 2 else None)
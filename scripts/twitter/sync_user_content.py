@@ -1,20 +1,20 @@
 """
 同步用户表里的最新数据
 """
+import asyncio
 import traceback
 
-from media_platform.twitter.crawler import TwitterCrawler
+from media_platform.twitter.crawler import AsyncTwitterCrawler
 from media_platform.twitter.service import UserService, ContentServie
 from media_platform.twitter.exception import RateLimitError, TokenWaitError
 from database import get_db, get_redis
 from tools.utils import logger
-from tools.time import random_wait
+from tools.time import async_random_wait
 from tools.message import send_msg_error
 
 redis = get_redis()
 db = get_db()
 
-crawler = TwitterCrawler(db, redis)
 user_service = UserService(db)
 content_service = ContentServie(db)
 
@@ -22,33 +22,92 @@ content_service = ContentServie(db)
 cache_key = 'sync_user_notify'
 
 
-def main():
+# 全量抓取的用户每次最多抓取的页数，没抓完下次从中断的位置继续
+full_pages = 200
+# 增量同步每次最多翻几页，遇到已经保存的帖子就会停止
+incremental_pages = 5
+# 可请求次数中至少留给全量抓取的比例，增量同步的用户很多时全量抓取也能继续
+full_share = 0.3
+# 等待cookie刷新后重新请求的次数
+max_retry = 3
+# 按接下来多少分钟的可请求次数来安排同步任务
+plan_minutes = 60
+
+
+async def sync_user(crawler: AsyncTwitterCrawler, user, pages: int, semaphore: asyncio.Semaphore):
+    logger.info(f"[script.twitter.sync_user_content] 开始获取{user.name}的内容")
+    for _ in range(max_retry):
+        # 等待cookie时先释放信号量，其他用户可以继续请求
+        wait = None
+        async with semaphore:
+            try:
+                if user.full != 2:
+                    await crawler.sync_content_by_name(user.name, pages)
+                elif await crawler.backfill_content_by_name(user.name, pages):
+                    user_service.set_full(user.id)
+                return
+            except TokenWaitError as e:
+                # 按最早有cookie可用的时间等待，不浪费接口的访问次数
+                logger.warning(f'[script.twitter.sync_user_content] 所有Token都不可用，等待{e.wait}秒后再请求')
+                wait = e.wait + 1
+            except RateLimitError as e:
+                logger.error(f'[script.twitter.sync_user_content] 没有可用的Token，等待15分钟后再请求,{str(e)}')
+            except Exception as e:
+                if redis.get(cache_key):
+                    send_msg_error(f'推特sysc_user_content脚本出错：{e}')
+                    redis.set(cache_key,1, 1200)
+
+                stack_trace = traceback.format_exc()
+                logger.error(f'[script.twitter.sync_user_content]{stack_trace}')
+                return
+
+        if wait is None:
+            await async_random_wait(900, 1000)
+            return
+        await asyncio.sleep(wait)
+
+
+def plan_users(crawler: AsyncTwitterCrawler, user_list: list) -> [(object, int)]:
+    """
+    根据接下来plan_minutes分钟UserTweets接口还能请求的次数安排要同步的用户
+    增量同步的用户一般只要1次请求，优先安排；全量抓取的用户至少分到full_share比例的次数，
+    次数平均分给尽量多的用户，每个用户至少1页，最多full_pages页
+    :return: [(用户, 最多请求的页数)]
+    """
+    available = crawler.forecast('UserTweets', plan_minutes)
+    incremental = [user for user in user_list if user.full != 2]
+    full = [user for user in user_list if user.full == 2]
+
+    full_budget = max(available - len(incremental), int(available * full_share))
+    full_amount = min(len(full), full_budget)
+    pages = min(full_pages, full_budget // full_amount) if full_amount else 0
+    logger.info(f'[script.twitter.sync_user_content] {plan_minutes}分钟内可请求{available}次,'
+                f'增量同步{len(incremental)}个用户,全量抓取{full_amount}/{len(full)}个用户,每个用户{pages}页')
+    return [(user, incremental_pages) for user in incremental] + [(user, pages) for user in full[:full_amount]]
+
+
+async def main(crawler: AsyncTwitterCrawler):
     # 获取用户列表
     user_list = user_service.get_user_monitored_list()
     if len(user_list) == 0:
         logger.info('[script.twitter.sync_user_content] 没有需要监控的账号')
 
-    for user in user_list:
-        logger.info(f"[script.twitter.sync_user_content] 开始获取{user.name}的内容")
-        try:
-            page = 200 if user.full == 2 else 1
-            crawler.sync_content_by_name(user.name, page)
-            if user.full == 2:
-                user_service.set_full(user.id)
-        except (TokenWaitError, RateLimitError) as e:
-            logger.error(f'[script.twitter.sync_user_content] 所有Token都不可用，等待15分钟后再请求,{str(e)}')
-            random_wait(900, 1000)
-        except Exception as e:
-            if redis.get(cache_key):
-                send_msg_error(f'推特sysc_user_content脚本出错：{e}')
-                redis.set(cache_key,1, 1200)
-
-            stack_trace = traceback.format_exc()
-            logger.error(f'[script.twitter.sync_user_content]{stack_trace}')
-            continue
+    user_list = plan_users(crawler, user_list)
+
+    # 同时请求的数量不超过登录用户cookie的数量
+    semaphore = asyncio.Semaphore(max(crawler.cookie_budget(), 1))
+    await asyncio.gather(*[sync_user(crawler, user, pages, semaphore) for user, pages in user_list])
+
+
+async def run():
+    crawler = AsyncTwitterCrawler(db, redis)
+    try:
+        while True:
+            await main(crawler)
+            await async_random_wait(300, 600)
+    finally:
+        await crawler.aclose()
 
 
 if __name__ == '__main__':
-    while True:
-        main()
-        random_wait(300, 600)
+    asyncio.run(run())
@@ -0,0 +1,25 @@
+"""
+启动小红书浏览器守护进程，cookie池里每个登录用户的cookie启动一个浏览器并保持登录
+sync_note.py、sync_user.py等脚本配置了XHS_DAEMON_ADDRESS后会直接使用这里已经登录的浏览器
+python -m scripts.xhs.daemon [监听地址]
+"""
+import sys
+
+from config import settings
+from media_platform.xhs.daemon import XHSDaemon, serve
+from tools.cookie_pool import get_cookie_by_platform
+from tools.utils import logger
+
+address = sys.argv[1] if len(sys.argv) > 1 else settings.XHS_DAEMON_ADDRESS or '127.0.0.1:8960'
+
+cookie_pool = get_cookie_by_platform('xhs')
+if len(cookie_pool) == 0:
+    logger.error('[xsh.daemon]没有可用的cookie，退出脚本')
+    exit()
+
+daemon = XHSDaemon.login(cookie_pool)
+if not daemon.cookie_ids:
+    logger.error('[xsh.daemon]所有cookie都登录失败，退出脚本')
+    exit()
+
+serve(daemon, address)
@@ -2,14 +2,15 @@
 根据关键词抓取笔记
 """
 
-import random
-import time
-
 from database import get_db, get_redis
 from media_platform.xhs.crawler import XHSCrawler
+from media_platform.xhs.pipeline import NotePipeline
+from media_platform.xhs.remote import RemoteXHSClient
+from media_platform.xhs.seen_index import SeenIndex
 from media_platform.xhs.service import NoteService, UserService
 from media_platform.xhs.field import SearchSortType, SearchNoteType
 from tools.cookie_pool import get_cookie_by_platform, set_cookie_invalid
+from tools.pacer import AdaptivePacer
 from tools.utils import logger
 from tools.time import random_wait
 
@@ -21,20 +22,26 @@ exec_cache_key = 'xhs_sync_note_exec'
 if redis.get(exec_cache_key):
     logger.debug("[xsh.sync_note] 已经同步过数据了，不在同步")
 
-cookie_pool = get_cookie_by_platform('xhs')
-if len(cookie_pool) == 0:
-    logger.error('[xsh.sync_note]没有可用的cookie，退出脚本')
-    exit()
-
-for cookie in cookie_pool:
-    try:
-        crawler = XHSCrawler(cookie.value, db, redis)
-        break
-    except Exception as e:
-        set_cookie_invalid('xhs', [cookie.id])
-        logger.error(f'[xsh.sync_note]初始化浏览器失败，退出脚本.{e}')
+# 守护进程里有已经登录的浏览器时直接使用，不用启动浏览器和登录
+xhs_client = RemoteXHSClient.connect()
+if xhs_client is not None:
+    logger.info('[xsh.sync_note]使用守护进程的浏览器')
+    crawler = XHSCrawler(None, db, redis, xhs_client)
+else:
+    cookie_pool = get_cookie_by_platform('xhs')
+    if len(cookie_pool) == 0:
+        logger.error('[xsh.sync_note]没有可用的cookie，退出脚本')
         exit()
 
+    for cookie in cookie_pool:
+        try:
+            crawler = XHSCrawler(cookie.value, db, redis)
+            break
+        except Exception as e:
+            set_cookie_invalid('xhs', [cookie.id])
+            logger.error(f'[xsh.sync_note]初始化浏览器失败，退出脚本.{e}')
+            exit()
+
 user_service = UserService(db, redis)
 note_serivce = NoteService(db, redis)
 
@@ -46,36 +53,15 @@ keywords = [
     {"keyword": "小户型", "page_size": 10},
 ]
 
+# 搜索和详情的请求共用一个限速，从每2.5秒一个请求开始，没被限制时逐渐加快，被限制时减半
+pacer = AdaptivePacer(rate=0.4, min_rate=0.05, max_rate=2, burst=2, jitter=0.3)
+# 不同关键词会搜到同一篇笔记，3天内获取过详情并且点赞数的档位(按2的倍数划分)没变的不再获取
+pipeline = NotePipeline(crawler, note_serivce, user_service, pacer, seen=SeenIndex(redis, ttl_days=3))
+
 for value in keywords:
     logger.info(f"开始同步关键词{value['keyword']},一共同步{value['page_size']}页")
-    result = crawler.search_by_api(value['keyword'], value['page_size'],SearchNoteType.IMAGE,SearchSortType.GENERAL)
-    if result is None:
-        logger.error('[xsh.sync_note]搜索笔记数据为空，脚本停止运行')
-
-    logger.debug(f"[xsh.sync_note]同步用户数据，一共{len(result['user_fields'])}条数据需要同步")
-    for user in result['user_fields']:
-        user_service.add_user(user)
-
-    logger.debug(f"[xsh.sync_note]获取笔记详情,一共{len(result['note_ids'])}条数据需要同步")
-
-    for note in result['note_ids']:
-        logger.info(f"[xsh.sync_note]获取{note['id']}笔记，点赞数{note['liked_count']}")
-
-        # 进行一个策略的过滤
-        # 点赞数小于300的笔记不抓取
-        if note['liked_count'] < 500:
-            logger.info(f"[xsh.sync_note]获取{note['id']}过滤，点赞数{note['liked_count']},不足300.")
-            continue
-
-        field = crawler.note_detail_by_api(note['id'], note['xsec_token'], 'pc_search', value['keyword'])
-        if field is None:
-            logger.warning(f"[xsh.sync_note]{note['id']}笔记获取失败.")
-            continue
-
-        note_serivce.add_note(field)
-        pause_duration = random.uniform(1, 5)
-        time.sleep(pause_duration)
-
-    time.sleep(random.uniform(5, 10))
+    stats = pipeline.run(value['keyword'], value['page_size'], SearchNoteType.IMAGE, SearchSortType.GENERAL)
+    logger.info(f"[xsh.sync_note]关键词{value['keyword']}同步完成:{stats}")
 
+logger.info(f"[xsh.sync_note]签名和请求的耗时统计:{crawler.xhs_client.sign_stats()}")
 redis.set(exec_cache_key, 1, 3600 * 4)
\ No newline at end of file
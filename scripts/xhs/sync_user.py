@@ -3,12 +3,15 @@
 """
 from database import get_db, get_redis
 from media_platform.xhs.crawler import XHSCrawler
+from media_platform.xhs.remote import RemoteXHSClient
 from media_platform.xhs.service import UserService
 from models.xhs import XHSUser, XhsUserSnapshot
 from tools.cookie_pool import get_cookie_by_platform, set_cookie_invalid
 from tools.utils import logger
 from tools.time import random_wait
 from media_platform.xhs.help import chinese_to_number
+from media_platform.xhs.exception import IPBlockError, DataFetchError
+from tools.pacer import AdaptivePacer
 
 redis = get_redis()
 db = get_db()
@@ -19,20 +22,29 @@ if redis.get(exec_cache_key):
     logger.debug("[xsh.sysc_user] 已经同步过数据了，不在同步")
 
 
-cookie_pool = get_cookie_by_platform('xhs')
-if len(cookie_pool) == 0:
-    logger.error('[xsh.sysc_user]没有可用的cookie，退出脚本')
-    exit()
-
-for cookie in cookie_pool:
-    try:
-        crawler = XHSCrawler(cookie.value, db, redis)
-        break
-    except Exception as e:
-        set_cookie_invalid('xhs', [cookie.id])
-        logger.error(f'[xsh.sysc_user]初始化浏览器失败，退出脚本.{e}')
+# 守护进程里有已经登录的浏览器时直接使用，不用启动浏览器和登录
+xhs_client = RemoteXHSClient.connect()
+if xhs_client is not None:
+    logger.info('[xsh.sysc_user]使用守护进程的浏览器')
+    crawler = XHSCrawler(None, db, redis, xhs_client)
+else:
+    cookie_pool = get_cookie_by_platform('xhs')
+    if len(cookie_pool) == 0:
+        logger.error('[xsh.sysc_user]没有可用的cookie，退出脚本')
         exit()
 
+    for cookie in cookie_pool:
+        try:
+            crawler = XHSCrawler(cookie.value, db, redis)
+            break
+        except Exception as e:
+            set_cookie_invalid('xhs', [cookie.id])
+            logger.error(f'[xsh.sysc_user]初始化浏览器失败，退出脚本.{e}')
+            exit()
+
+# 每个请求的间隔由pacer控制，没被限制时逐渐加快，被限制时减半
+crawler.xhs_client.pacer = AdaptivePacer(rate=0.5, min_rate=0.05, max_rate=2, jitter=0.3)
+
 user_service = UserService(db, redis)
 page_number = 1
 while True:
@@ -43,10 +55,20 @@ while True:
     if len(user_list) == 0:
         redis.set(exec_cache_key, 1, 3600 * 4)
         logger.info('[xhs.sync_user]没有用户数据')
+        logger.info(f"[xhs.sync_user]请求频率统计:{crawler.xhs_client.pacer.stats()}")
         exit()
 
+    users = []
+    snapshots = []
     for user in user_list:
-        user_info = crawler.user_info_by_api(user.user_id)
+        try:
+            user_info = crawler.user_info_by_api(user.user_id)
+        except IPBlockError as e:
+            logger.warning(f'[xhs.sync_user]获取{user.user_id}被限制:{e}')
+            continue
+        except DataFetchError as e:
+            logger.warning(f'[xhs.sync_user]获取{user.user_id}失败:{e}')
+            continue
 
         if user_info is None:
             continue
@@ -58,7 +80,7 @@ while True:
         fans = chinese_to_number(user_info['fans'])
 
         # 更新用户表
-        user_service.add_user(XHSUser(
+        users.append(XHSUser(
             user_id=user.user_id,
             nickname=user_info['nickname'],
             location=user_info['location'],
@@ -67,11 +89,12 @@ while True:
             tag_list=tag_list
         ))
         # 添加用户快照
-        user_service.add_snapshot(XhsUserSnapshot(
+        snapshots.append(XhsUserSnapshot(
             user_id=user.user_id,
             fans=fans
         ))
 
-        random_wait(1, 3)
-
+    # 一页的用户一次写入
+    user_service.add_users(users)
+    user_service.add_snapshots(snapshots)
     page_number += 1
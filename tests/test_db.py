@@ -0,0 +1,53 @@
+"""
+tools.db 的批量写入
+python -m pytest tests
+"""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+from models.quantclass import Base, QtcArticleSummary
+from tools.db import upsert_counts
+
+UPDATE_FIELDS = ['view_count', 'vote_count', 'is_essence', 'summary', 'title']
+
+
+@pytest.fixture
+def db():
+    engine = create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+def make_row(aid: int, **fields) -> dict:
+    row = {
+        "aid": aid,
+        "title": f'title {aid}',
+        "category_id": 1,
+        "summary": f'summary {aid}',
+        "author_id": 1,
+        "created_at": datetime(2024, 1, 1),
+    }
+    row.update(fields)
+    return row
+
+
+def test_upsert_counts_identical_row_is_updated(db):
+    row = make_row(1)
+    assert upsert_counts(db, QtcArticleSummary, [row], ['aid'], UPDATE_FIELDS) == (1, 0)
+    db.commit()
+    assert upsert_counts(db, QtcArticleSummary, [row], ['aid'], UPDATE_FIELDS) == (0, 1)
+    db.commit()
+    assert db.scalar(select(func.count()).select_from(QtcArticleSummary)) == 1
+
+
+def test_upsert_counts_mixed(db):
+    upsert_counts(db, QtcArticleSummary, [make_row(1), make_row(2)], ['aid'], UPDATE_FIELDS)
+    db.commit()
+    rows = [make_row(2, view_count=5), make_row(3)]
+    assert upsert_counts(db, QtcArticleSummary, rows, ['aid'], UPDATE_FIELDS) == (1, 1)
+    db.commit()
+    assert db.scalar(select(QtcArticleSummary.view_count).where(QtcArticleSummary.aid == 2)) == 5
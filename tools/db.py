@@ -0,0 +1,141 @@
+"""
+数据库的通用操作
+"""
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects import mysql, sqlite, postgresql
+
+from tools.time import current_time
+
+# 支持 INSERT ... ON CONFLICT 的数据库
+_ON_CONFLICT_DIALECTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+
+def upsert(db: Session, model, rows: [dict], index_elements: [str], update_fields: [str]) -> int:
+    """
+    批量插入数据，唯一键冲突时更新指定的字段
+    MySQL使用 INSERT ... ON DUPLICATE KEY UPDATE，SQLite、PostgreSQL使用 INSERT ... ON CONFLICT DO UPDATE
+    字段不同的数据分组后各执行一次executemany，不会提交事务
+    :param db: 数据库会话
+    :param model: 数据表模型
+    :param rows: 要插入的数据
+    :param index_elements: 唯一键字段，ON CONFLICT需要
+    :param update_fields: 冲突时更新的字段
+    :return: 处理的数据条数
+    """
+    if not rows:
+        return 0
+    _execute_upsert(db, model, rows, index_elements, update_fields)
+    return len(rows)
+
+
+def upsert_counts(db: Session, model, rows: [dict], index_elements: [str], update_fields: [str]) -> (int, int):
+    """
+    和upsert一样批量插入或更新，返回新增和更新的数量，不会提交事务
+    影响的行数分不出新增和更新(MySQL字段值没有变化的数据只算1行)，写入前在同一个事务里查询已经存在的数量，
+    有并发写入时是近似值
+    :param rows: 要插入的数据，唯一键不能重复
+    :return: (新增的数量, 更新的数量)
+    """
+    if not rows:
+        return 0, 0
+    columns = [getattr(model, name) for name in index_elements]
+    if len(columns) == 1:
+        condition = columns[0].in_([row[index_elements[0]] for row in rows])
+    else:
+        condition = tuple_(*columns).in_([tuple(row[name] for name in index_elements) for row in rows])
+    exists = db.scalar(select(func.count()).select_from(model).where(condition))
+    _execute_upsert(db, model, rows, index_elements, update_fields)
+    return len(rows) - exists, exists
+
+
+def _execute_upsert(db: Session, model, rows: [dict], index_elements: [str], update_fields: [str]) -> int:
+    """
+    执行upsert的语句
+    :return: 语句影响的行数
+    """
+    # 批量语句不会触发onupdate，更新时间要自己设置
+    update_fields = list(update_fields)
+    if hasattr(model, 'updated_at') and 'updated_at' not in update_fields:
+        update_fields.append('updated_at')
+        now = current_time()
+        rows = [{**row, 'updated_at': now} for row in rows]
+
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+
+    dialect = db.get_bind().dialect.name
+    affected = 0
+    for keys, group in groups.items():
+        fields = [field for field in update_fields if field in keys]
+        if dialect == 'mysql':
+            stmt = mysql.insert(model)
+            stmt = stmt.on_duplicate_key_update({field: stmt.inserted[field] for field in fields})
+        elif dialect in _ON_CONFLICT_DIALECTS:
+            stmt = _ON_CONFLICT_DIALECTS[dialect](model)
+            stmt = stmt.on_conflict_do_update(index_elements=index_elements,
+                                              set_={field: stmt.excluded[field] for field in fields})
+        else:
+            raise NotImplementedError(f'upsert不支持{dialect}数据库')
+        # 通过会话的连接执行，返回的结果才有影响的行数，还在同一个事务里
+        affected += db.connection().execute(stmt, group).rowcount
+
+    return affected
+
+
+def to_row(obj, exclude: [str] = ('id',)) -> dict:
+    """
+    数据表模型的对象转换为upsert使用的字典，值为None的字段不包含，插入时使用字段的默认值，更新时不修改
+    :param obj: 数据表模型的对象
+    :param exclude: 不包含的字段，默认不包含自增主键
+    :return: dict
+    """
+    row = {}
+    for column in obj.__table__.columns:
+        if column.name in exclude:
+            continue
+        value = getattr(obj, column.key)
+        if value is not None:
+            row[column.name] = value
+    return row
+
+
+def keyset_page(query, column, size: int = 50, after=None, desc: bool = True) -> list:
+    """
+    按字段分页查询一页数据，用上一页最后一条的值代替OFFSET，每页的耗时和页数无关
+    :param query: 查询，不要带排序
+    :param column: 分页的字段，值必须唯一，一般使用主键
+    :param size: 每页数量
+    :param after: 上一页最后一条数据的字段值，None时查询第一页
+    :param desc: 是否倒序
+    :return: 一页数据
+    """
+    if after is not None:
+        query = query.where(column < after if desc else column > after)
+    return query.order_by(column.desc() if desc else column.asc()).limit(size).all()
+
+
+def keyset_pages(query, column, size: int = 50, after=None, desc: bool = True):
+    """
+    按字段分页遍历查询的所有数据，每次返回一页
+    处理过程中数据不再满足查询条件时也不会跳过后面的数据，OFFSET分页会跳过
+    :param query: 查询，不要带排序
+    :param column: 分页的字段，值必须唯一，一般使用主键
+    :param size: 每页数量
+    :param after: 从这个字段值之后开始，None时从头开始
+    :param desc: 是否倒序
+    :return: 每页数据的生成器
+    """
+    while True:
+        rows = keyset_page(query, column, size, after, desc)
+        if not rows:
+            return
+        # 先记下分页的值，调用方处理这一页时提交事务后对象会过期
+        after = getattr(rows[-1], column.key)
+        yield rows
+        if len(rows) < size:
+            return
@@ -0,0 +1,150 @@
+"""
+请求的限速
+"""
+import random
+import threading
+import time
+
+from tools.utils import logger
+
+
+class RatePacer:
+    """
+    令牌桶限速，多个线程共用一个实例时总的请求频率不超过rate
+    """
+
+    def __init__(self, rate: float, burst: int = 1, jitter: float = 0.0):
+        """
+        :param rate: 每秒允许的请求次数
+        :param burst: 空闲后最多可以连续请求的次数
+        :param jitter: 每次额外等待0到jitter倍请求间隔的随机时间，避免请求的间隔过于规律
+        """
+        self.rate = rate
+        self.burst = burst
+        self.jitter = jitter
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0  # 累计等待的时间(秒)
+
+    def reserve(self) -> float:
+        """
+        预约一次请求
+        :return: 需要等待的时间(秒)
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # 令牌不够时预支，后来的请求排在后面等待
+            self._tokens -= 1
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            if self.jitter:
+                delay += random.uniform(0, self.jitter / self.rate)
+            self.waited += delay
+        return delay
+
+    def wait(self) -> float:
+        """
+        等待到可以请求
+        :return: 等待的时间(秒)
+        """
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class AdaptivePacer(RatePacer):
+    """
+    根据请求结果调整频率(AIMD)：请求成功时频率加法增加，被限制时乘法降低
+    连续被限制max_blocks次后熔断，暂停所有请求cooldown秒，连续熔断时暂停时间翻倍
+    """
+
+    def __init__(self, rate: float, min_rate: float, max_rate: float, increase: float = 0.02,
+                 decrease: float = 0.5, burst: int = 1, jitter: float = 0.0, max_blocks: int = 3,
+                 cooldown: float = 60, max_cooldown: float = 1800):
+        """
+        :param rate: 初始的每秒请求次数
+        :param min_rate: 最低的每秒请求次数
+        :param max_rate: 最高的每秒请求次数
+        :param increase: 每次成功增加的每秒请求次数
+        :param decrease: 每次被限制后频率乘以这个值
+        :param max_blocks: 连续被限制多少次后熔断
+        :param cooldown: 熔断后暂停的时间(秒)
+        :param max_cooldown: 连续熔断时最长的暂停时间(秒)
+        """
+        super().__init__(rate, burst, jitter)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.max_blocks = max_blocks
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.ceiling = max_rate  # 最近一次被限制时的频率
+        self.successes = 0  # 成功的次数
+        self.blocks = 0  # 被限制的次数
+        self.trips = 0  # 熔断的次数
+        self._failures = 0  # 连续被限制的次数
+        self._next_cooldown = cooldown
+        self._open_until = 0.0
+
+    def success(self):
+        """
+        请求成功，频率加法增加
+        """
+        with self._lock:
+            self.successes += 1
+            self._failures = 0
+            self._next_cooldown = self.cooldown
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def blocked(self):
+        """
+        请求被限制，频率乘法降低，连续被限制max_blocks次后熔断
+        """
+        with self._lock:
+            self.blocks += 1
+            self._failures += 1
+            self.ceiling = self.rate
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            if self._failures < self.max_blocks:
+                return
+            self._failures = 0
+            self.trips += 1
+            self._open_until = time.monotonic() + self._next_cooldown
+            # 熔断期间不攒令牌，恢复后按降低后的频率重新开始
+            self._tokens = 0.0
+            cooldown = self._next_cooldown
+            self._next_cooldown = min(self.max_cooldown, self._next_cooldown * 2)
+        logger.warning(f'[tools.pacer.AdaptivePacer] 连续被限制{self.max_blocks}次，暂停{cooldown}秒，'
+                       f'频率降低到每秒{self.rate:.3f}次')
+
+    @property
+    def is_open(self) -> bool:
+        """
+        是否处于熔断中
+        """
+        return time.monotonic() < self._open_until
+
+    def reserve(self) -> float:
+        with self._lock:
+            paused = max(0.0, self._open_until - time.monotonic())
+            self.waited += paused
+        return paused + super().reserve()
+
+    def stats(self) -> dict:
+        """
+        当前安全的频率和请求结果的统计
+        :return: {"rate": 当前每秒请求次数, "ceiling": 最近一次被限制时的频率, ...}
+        """
+        return {
+            "rate": round(self.rate, 3),
+            "ceiling": round(self.ceiling, 3),
+            "successes": self.successes,
+            "blocks": self.blocks,
+            "trips": self.trips,
+            "open": self.is_open,
+            "waited": round(self.waited, 1),
+        }
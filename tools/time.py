@@ -1,3 +1,4 @@
+import asyncio
 import random
 import time
 from zoneinfo import ZoneInfo
@@ -92,6 +93,15 @@ def random_wait(start: int, end: int):
     time.sleep(sec)
 
 
+async def async_random_wait(start: int, end: int):
+    """
+    在一个区间内随机等待，不阻塞事件循环
+    """
+    sec = random.uniform(start, end)
+    logger.debug(f'暂停{sec}秒执行')
+    await asyncio.sleep(sec)
+
+
 def get_time_within_duration(days_duration):
     """
     获取以指定时间为基础，指定天数范围内的时间区间。